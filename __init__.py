@@ -94,6 +94,15 @@ class AHC_Addon_Properties(PropertyGroup):
         max = 100
         )
      
+    wheel_radius: FloatProperty(
+        name = "Wheel Radius (m)",
+        description = "Measured wheel radius, overrides the radius from the tire size when above zero",
+        default = 0.0,
+        precision = 4,
+        min = 0.0,
+        max = 10.0
+        )
+     
     root_node: PointerProperty(
         type = bpy.types.Object,
         name = "Object"
@@ -124,6 +133,62 @@ class AHC_Addon_Properties(PropertyGroup):
         name = "Include Child Translation",
         default = True
         )
+        
+    split_vertex_limit: IntProperty(
+        name = "Vertex Limit",
+        description = "Maximum exported vertices per mesh, AC meshes use 16-bit indices",
+        default = 65535,
+        min = 3,
+        max = 65535
+        )
+        
+    center_mode: EnumProperty(
+        name = "Center Mode",
+        description = "How the center of each child mesh is computed",
+        items = [
+            ('MEDIAN', "Median", "Average of all vertex positions"),
+            ('BOUNDS', "Bounds", "Center of the vertex bounding box"),
+            ],
+        default = 'MEDIAN'
+        )
+        
+    center_space: EnumProperty(
+        name = "Center Space",
+        description = "Coordinate space the child mesh centers are computed in",
+        items = [
+            ('LOCAL', "Local", "Mesh space, optionally offset by the child translation"),
+            ('WORLD', "World", "World space, including the full child transform"),
+            ],
+        default = 'LOCAL'
+        )
+        
+    lod_a_budget: IntProperty(
+        name = "LOD A Triangles",
+        description = "Triangle budget of the whole car in the main model",
+        default = 250000,
+        min = 0
+        )
+        
+    lod_b_budget: IntProperty(
+        name = "LOD B Triangles",
+        description = "Triangle budget of the whole car in LOD_B",
+        default = 80000,
+        min = 0
+        )
+        
+    lod_c_budget: IntProperty(
+        name = "LOD C Triangles",
+        description = "Triangle budget of the whole car in LOD_C",
+        default = 25000,
+        min = 0
+        )
+        
+    lod_d_budget: IntProperty(
+        name = "LOD D Triangles",
+        description = "Triangle budget of the whole car in LOD_D",
+        default = 6000,
+        min = 0
+        )
     
     def execute(self, context):
         self.report({'INFO'}, self.collection_name)
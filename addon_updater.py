@@ -24,18 +24,24 @@ https://github.com/CGCookie/blender-addon-updater
 
 __version__ = "1.1.1"
 
-import errno
+import hashlib
+import http.client
+import time
 import traceback
 import platform
+import re
+import socket
 import ssl
 import urllib.request
 import urllib
 import os
 import json
 import zipfile
+import zlib
 import shutil
 import threading
 import fnmatch
+import concurrent.futures
 from datetime import datetime, timedelta
 
 # Blender imports, used in limited cases.
@@ -93,6 +99,23 @@ class SingletonUpdater:
         self._check_interval_hours = 0
         self._check_interval_minutes = 0
 
+        # Seconds allowed to connect (including the TLS handshake and response
+        # headers) and between two reads of a response body.
+        self._connect_timeout = 10.0
+        self._read_timeout = 30.0
+
+        # Interrupted downloads are resumed from the partial file this many
+        # times before the update is aborted.
+        self._download_retries = 4
+
+        # Install by building the new addon folder next to the current one and
+        # swapping the two, instead of merging files into the live folder.
+        self._atomic_install = True
+
+        # Threads extracting the update zip, 1 extracts on the caller's thread.
+        self._extract_workers = min(4, os.cpu_count() or 1)
+        self._download_status = DownloadStatus()
+
         # runtime variables, initial conditions
         self._verbose = False
         self._use_print_traces = True
@@ -103,6 +126,10 @@ class SingletonUpdater:
         self._update_version = None
         self._source_zip = None
         self._check_thread = None
+        self._check_handle = None
+        self._update_handle = None
+        self._thread_state = threading.local()
+        self._response_cache = None
         self._select_link = None
         self.skip_tag = None
 
@@ -165,6 +192,17 @@ class SingletonUpdater:
     def async_checking(self):
         return self._async_checking
 
+    @property
+    def atomic_install(self):
+        return self._atomic_install
+
+    @atomic_install.setter
+    def atomic_install(self, value):
+        try:
+            self._atomic_install = bool(value)
+        except:
+            raise ValueError("atomic_install must be a boolean value")
+
     @property
     def auto_reload_post_update(self):
         return self._auto_reload_post_update
@@ -208,6 +246,16 @@ class SingletonUpdater:
                 self._check_interval_hours,
                 self._check_interval_minutes)
 
+    @property
+    def connect_timeout(self):
+        return self._connect_timeout
+
+    @connect_timeout.setter
+    def connect_timeout(self, value):
+        if value is None or value <= 0:
+            raise ValueError("connect_timeout must be a positive number")
+        self._connect_timeout = value
+
     @property
     def current_version(self):
         return self._current_version
@@ -229,6 +277,20 @@ class SingletonUpdater:
                     "current_version must be a tuple of integers")
         self._current_version = tuple(tuple_values)
 
+    @property
+    def download_retries(self):
+        return self._download_retries
+
+    @download_retries.setter
+    def download_retries(self, value):
+        if value is None or value < 0:
+            raise ValueError("download_retries must be zero or more")
+        self._download_retries = int(value)
+
+    @property
+    def download_status(self):
+        return self._download_status
+
     @property
     def engine(self):
         return self._engine.name
@@ -253,6 +315,16 @@ class SingletonUpdater:
     def error_msg(self):
         return self._error_msg
 
+    @property
+    def extract_workers(self):
+        return self._extract_workers
+
+    @extract_workers.setter
+    def extract_workers(self, value):
+        if value is None or value < 1:
+            raise ValueError("extract_workers must be at least 1")
+        self._extract_workers = int(value)
+
     @property
     def fake_install(self):
         return self._fake_install
@@ -351,6 +423,16 @@ class SingletonUpdater:
         else:
             self._engine.token = str(value)
 
+    @property
+    def read_timeout(self):
+        return self._read_timeout
+
+    @read_timeout.setter
+    def read_timeout(self, value):
+        if value is None or value <= 0:
+            raise ValueError("read_timeout must be a positive number")
+        self._read_timeout = value
+
     @property
     def remove_pre_update_patterns(self):
         return self._remove_pre_update_patterns
@@ -429,6 +511,10 @@ class SingletonUpdater:
             return None
         return self._tag_latest["name"]
 
+    @property
+    def update_downloading(self):
+        return self._update_handle is not None and self._update_handle.running()
+
     @property
     def update_link(self):
         return self._update_link
@@ -665,9 +751,14 @@ class SingletonUpdater:
                 self.print_verbose(
                     "Most recent tag found:" + str(self._tags[n]['name']))
 
-    def get_raw(self, url):
-        """All API calls to base url."""
-        request = urllib.request.Request(url)
+    def get_raw(self, url, headers=None, response_info=None):
+        """All API calls to base url.
+
+        Extra request headers can be given in headers. If response_info is a
+        dict, it receives the HTTP status and response headers, and a 304 Not
+        Modified reply returns an empty string instead of counting as error.
+        """
+        request = self.build_request(url, headers)
         try:
             context = ssl._create_unverified_context()
         except:
@@ -675,24 +766,14 @@ class SingletonUpdater:
             # useful for local network setups otherwise minimal impact.
             context = None
 
-        # Setup private request headers if appropriate.
-        if self._engine.token is not None:
-            if self._engine.name == "gitlab":
-                request.add_header('PRIVATE-TOKEN', self._engine.token)
-            else:
-                self.print_verbose("Tokens not setup for engine yet")
-
-        # Always set user agent.
-        request.add_header(
-            'User-Agent', "Python/" + str(platform.python_version()))
-
         # Run the request.
         try:
-            if context:
-                result = urllib.request.urlopen(request, context=context)
-            else:
-                result = urllib.request.urlopen(request)
+            result = self.urlopen(request, context)
         except urllib.error.HTTPError as e:
+            if e.code == 304 and response_info is not None:
+                response_info["status"] = e.code
+                response_info["headers"] = e.headers
+                return ""
             if str(e.code) == "403":
                 self._error = "HTTP error (access denied)"
                 self._error_msg = str(e.code) + " - server error response"
@@ -716,18 +797,74 @@ class SingletonUpdater:
             self.print_trace()
             self._update_ready = None
             return None
+        except socket.timeout as e:
+            self._error = "Connection timed out, check internet connection"
+            self._error_msg = str(e)
+            print(self._error, self._error_msg)
+            self._update_ready = None
+            return None
         else:
-            result_string = result.read()
-            result.close()
+            if response_info is not None:
+                response_info["status"] = result.getcode()
+                response_info["headers"] = result.headers
+            try:
+                result_string = result.read()
+            except socket.timeout as e:
+                self._error = "Connection timed out, check internet connection"
+                self._error_msg = str(e)
+                print(self._error, self._error_msg)
+                self._update_ready = None
+                return None
+            except Exception:
+                # A cancelled check shuts the socket down under the read.
+                self.raise_if_cancelled()
+                raise
+            finally:
+                result.close()
+            self.raise_if_cancelled()
             return result_string.decode()
 
+    def build_request(self, url, headers=None):
+        """Request with the private token, user agent and extra headers"""
+        request = urllib.request.Request(url)
+
+        # Setup private request headers if appropriate.
+        if self._engine.token is not None:
+            if self._engine.name == "gitlab":
+                request.add_header('PRIVATE-TOKEN', self._engine.token)
+            else:
+                self.print_verbose("Tokens not setup for engine yet")
+
+        # Always set user agent.
+        request.add_header(
+            'User-Agent', "Python/" + str(platform.python_version()))
+        for key, value in (headers or dict()).items():
+            request.add_header(key, value)
+        return request
+
     def get_api(self, url):
-        """Result of all api calls, decoded into json format."""
+        """Result of all api calls, decoded into json format.
+
+        Requests are made conditional on the validators of the cached
+        response, a 304 reply returns the cached result without decoding.
+        """
+        cache = self.get_response_cache()
+        response_info = dict()
         get = None
-        get = self.get_raw(url)
+        get = self.get_raw(url, cache.conditional_headers(url), response_info)
+        if get is not None and response_info.get("status") == 304:
+            cached = cache.get(url)
+            if cached is not None:
+                self.print_verbose("Not modified, using cached response")
+                return cached
+            # Evicted since the validators were sent, ask for the full body.
+            response_info = dict()
+            get = self.get_raw(url, None, response_info)
         if get is not None:
             try:
-                return json.JSONDecoder().decode(get)
+                result = json.JSONDecoder().decode(get)
+                cache.put(url, response_info.get("headers"), result, len(get))
+                return result
             except Exception as e:
                 self._error = "API response has invalid JSON format"
                 self._error_msg = str(e.reason)
@@ -738,8 +875,13 @@ class SingletonUpdater:
         else:
             return None
 
-    def stage_repository(self, url):
-        """Create a working directory and download the new files"""
+    def stage_repository(self, url, sha256=None):
+        """Create a working directory and download the new files.
+
+        When sha256 is given the download is rejected unless it matches.
+        Release zipballs publish no digest, so the expected hash only comes
+        from callers of run_update/start_update.
+        """
 
         local = os.path.join(self._updater_path, "update_staging")
         error = None
@@ -774,27 +916,18 @@ class SingletonUpdater:
         self._source_zip = os.path.join(local, "source.zip")
         self.print_verbose("Starting download update zip")
         try:
-            request = urllib.request.Request(url)
-            context = ssl._create_unverified_context()
-
-            # Setup private token if appropriate.
-            if self._engine.token is not None:
-                if self._engine.name == "gitlab":
-                    request.add_header('PRIVATE-TOKEN', self._engine.token)
-                else:
-                    self.print_verbose(
-                        "Tokens not setup for selected engine yet")
-
-            # Always set user agent
-            request.add_header(
-                'User-Agent', "Python/" + str(platform.python_version()))
-
-            self.url_retrieve(urllib.request.urlopen(request, context=context),
-                              self._source_zip)
-            # Add additional checks on file size being non-zero.
-            self.print_verbose("Successfully downloaded update zip")
+            # The partial download lives outside of the staging folder, so a
+            # failed attempt can be resumed by the next one.
+            part_path = os.path.join(self._updater_path, "update_download.part")
+            digest = self.download(url, part_path, self._source_zip, sha256)
+            self.print_verbose(
+                "Successfully downloaded update zip, sha256 " + digest)
             return True
+        except UpdateCancelled:
+            self._download_status.fail("Cancelled")
+            raise
         except Exception as e:
+            self._download_status.fail(str(e))
             self._error = "Error retrieving download, bad link?"
             self._error_msg = "Error: {}".format(e)
             print("Error retrieving download, bad link?")
@@ -874,6 +1007,49 @@ class SingletonUpdater:
 
         self.reload_addon()
 
+    def extract_zip(self, source_zip, outdir):
+        """Stream the files of source_zip into outdir.
+
+        Like the zipball layout, the top level folder of the zip is dropped.
+        Member paths escaping outdir raise UnsafeZipPath before anything is
+        written. Members are copied in EXTRACT_BUFFER sized pieces, and
+        spread over extract_workers threads (each with its own ZipFile)
+        when there are enough of them. Returns the number of files.
+        """
+        zsep = '/'  # Not using os.sep, always the / value even on windows.
+        folders = []
+        files = []
+        with zipfile.ZipFile(source_zip, "r") as zfile:
+            for info in zfile.infolist():
+                if zsep not in info.filename:
+                    continue
+                sub_path = info.filename[info.filename.index(zsep) + 1:]
+                if not sub_path:
+                    continue  # Skip top level folder.
+                path = zip_member_path(outdir, sub_path)
+                if info.is_dir():
+                    folders.append(path)
+                else:
+                    files.append((info.file_size, info.filename, path))
+
+        # Every path was validated, only now anything gets created.
+        for path in folders:
+            os.makedirs(path, exist_ok=True)
+
+        # Largest first, dealt round robin so workers get similar sizes.
+        files.sort(reverse=True)
+        workers = min(self._extract_workers, len(files) // EXTRACT_MIN_FILES)
+        if workers <= 1:
+            extract_members(source_zip, files)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                jobs = [executor.submit(extract_members, source_zip,
+                                        files[index::workers])
+                        for index in range(workers)]
+                for job in jobs:
+                    job.result()
+        return len(files)
+
     def unpack_staged_zip(self, clean=False):
         """Unzip the downloaded file, and validate contents"""
         if not os.path.isfile(self._source_zip):
@@ -910,44 +1086,31 @@ class SingletonUpdater:
 
         self.print_verbose(
             "Begin extracting source from zip:" + str(self._source_zip))
-        with zipfile.ZipFile(self._source_zip, "r") as zfile:
-
-            if not zfile:
-                self._error = "Install failed"
-                self._error_msg = "Resulting file is not a zip, cannot extract"
-                self.print_verbose(self._error_msg)
-                return -1
-
-            # Now extract directly from the first subfolder (not root)
-            # this avoids adding the first subfolder to the path length,
-            # which can be too long if the download has the SHA in the name.
-            zsep = '/'  # Not using os.sep, always the / value even on windows.
-            for name in zfile.namelist():
-                if zsep not in name:
-                    continue
-                top_folder = name[:name.index(zsep) + 1]
-                if name == top_folder + zsep:
-                    continue  # skip top level folder
-                sub_path = name[name.index(zsep) + 1:]
-                if name.endswith(zsep):
-                    try:
-                        os.mkdir(os.path.join(outdir, sub_path))
-                        self.print_verbose(
-                            "Extract - mkdir: " + os.path.join(outdir, sub_path))
-                    except OSError as exc:
-                        if exc.errno != errno.EEXIST:
-                            self._error = "Install failed"
-                            self._error_msg = "Could not create folder from zip"
-                            self.print_trace()
-                            return -1
-                else:
-                    with open(os.path.join(outdir, sub_path), "wb") as outfile:
-                        data = zfile.read(name)
-                        outfile.write(data)
-                        self.print_verbose(
-                            "Extract - create: " + os.path.join(outdir, sub_path))
+        try:
+            count = self.extract_zip(self._source_zip, outdir)
+        except zipfile.BadZipFile:
+            self._error = "Install failed"
+            self._error_msg = "Resulting file is not a zip, cannot extract"
+            self.print_verbose(self._error_msg)
+            return -1
+        except UnsafeZipPath as err:
+            self._error = "Install failed"
+            self._error_msg = "Unsafe path in zip: {}".format(err)
+            print(self._error_msg)
+            return -1
+        except (zlib.error, RuntimeError, NotImplementedError) as err:
+            # Corrupt data, encrypted members or unsupported compression.
+            self._error = "Install failed"
+            self._error_msg = "Could not extract zip: {}".format(err)
+            self.print_trace()
+            return -1
+        except OSError as err:
+            self._error = "Install failed"
+            self._error_msg = "Could not extract zip: {}".format(err)
+            self.print_trace()
+            return -1
 
-        self.print_verbose("Extracted source")
+        self.print_verbose("Extracted {} files".format(count))
 
         unpath = os.path.join(self._updater_path, "source")
         if not os.path.isdir(unpath):
@@ -981,7 +1144,13 @@ class SingletonUpdater:
 
         # Merge code with the addon directory, using blender default behavior,
         # plus any modifiers indicated by user (e.g. force remove/keep).
-        self.deep_merge_directory(self._addon_root, unpath, clean)
+        swapped = False
+        if self._atomic_install:
+            swapped = self.swap_directory(self._addon_root, unpath, clean)
+            if swapped is None:
+                return -1
+        if not swapped:
+            self.deep_merge_directory(self._addon_root, unpath, clean)
 
         # Now save the json state.
         # Change to True to trigger the handler on other side if allowing
@@ -1108,6 +1277,120 @@ class SingletonUpdater:
             self.print_verbose(error)
             self.print_trace()
 
+    def swap_directory(self, base, merger, clean=False):
+        """Install 'merger' over 'base' by swapping in a rebuilt folder.
+
+        Applies the same rules as deep_merge_directory, but the result is
+        built in a sibling folder first: kept files of base are hardlinked
+        (or copied) and new files moved in, then the folders are swapped
+        with two renames. base is left untouched if anything fails before
+        the swap. Returns False in that case so the caller can fall back,
+        or None if base could not be restored, when nothing else should
+        be attempted.
+        """
+        # Resolved up front, a path through base stops working once it moved.
+        # The sibling folders have a dot in their name, so neither Python nor
+        # Blender's addon scan sees them as packages.
+        parent = os.path.dirname(os.path.abspath(base))
+        build = os.path.join(parent, self._addon + ".updater_install_new")
+        retired = os.path.join(parent, self._addon + ".updater_install_old")
+
+        if not os.path.exists(base) or not os.path.exists(merger):
+            self.print_verbose("Base or merger path does not exist")
+            return False
+
+        for leftover in (build, retired):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover, ignore_errors=True)
+
+        remove = compile_patterns(self._remove_pre_update_patterns)
+        overwrite = compile_patterns(self._overwrite_patterns)
+
+        # The updater folder is carried over without the transient staging
+        # and extracted source folders.
+        updater_rel = os.path.relpath(self._updater_path, base)
+        if updater_rel.startswith(os.pardir) or os.path.isabs(updater_rel):
+            updater_rel = None
+        transient = {os.path.join(self._updater_path, "update_staging"),
+                     os.path.join(self._updater_path, "source")}
+
+        new_files = dict()
+        for path, dirs, files in os.walk(merger):
+            rel_path = os.path.relpath(path, merger)
+            for file in files:
+                new_files[os.path.normpath(os.path.join(rel_path, file))] = (
+                    os.path.join(path, file))
+
+        try:
+            os.makedirs(build)
+            kept = set()
+            for path, dirs, files in os.walk(base):
+                dirs[:] = [d for d in dirs
+                           if os.path.join(path, d) not in transient]
+                rel_path = os.path.relpath(path, base)
+                in_updater = updater_rel is not None and (
+                    rel_path == updater_rel
+                    or rel_path.startswith(updater_rel + os.sep))
+                if clean and not in_updater and rel_path != os.curdir:
+                    continue
+                os.makedirs(os.path.join(build, rel_path), exist_ok=True)
+                for file in files:
+                    rel_file = os.path.normpath(os.path.join(rel_path, file))
+                    if not in_updater:
+                        if clean or match_pattern(remove, file):
+                            continue
+                        if rel_file in new_files and match_pattern(
+                                overwrite, file):
+                            continue
+                    link_or_copy(os.path.join(path, file),
+                                 os.path.join(build, rel_file))
+                    kept.add(rel_file)
+                if clean and not in_updater:
+                    dirs[:] = [d for d in dirs if updater_rel is not None
+                               and os.path.normpath(os.path.join(
+                                   rel_path, d)) == updater_rel]
+
+            for rel_file, source in new_files.items():
+                if rel_file in kept:
+                    continue
+                dest_file = os.path.join(build, rel_file)
+                os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+                link_or_copy(source, dest_file)
+        except Exception as err:
+            print("Failed to build new addon folder: " + str(err))
+            self.print_trace()
+            shutil.rmtree(build, ignore_errors=True)
+            return False
+
+        try:
+            os.rename(base, retired)
+        except OSError as err:
+            # Typically files held open on Windows, merge in place instead.
+            print("Could not move current addon folder: " + str(err))
+            shutil.rmtree(build, ignore_errors=True)
+            return False
+        try:
+            os.rename(build, base)
+        except OSError:
+            self.print_trace()
+            try:
+                os.rename(retired, base)
+            except OSError as err:
+                # Keep both folders, the add-on is gone from Blender
+                # until the user moves retired back by hand.
+                self._error = "Install failed"
+                self._error_msg = (
+                    "Could not restore addon folder, "
+                    "previous version is in: " + retired)
+                print(self._error_msg + " " + str(err))
+                return None
+            shutil.rmtree(build, ignore_errors=True)
+            return False
+
+        self.print_verbose("Swapped in new addon folder")
+        shutil.rmtree(retired, ignore_errors=True)
+        return True
+
     def reload_addon(self):
         # if post_update false, skip this function
         # else, unload/reload addon & trigger popup
@@ -1136,6 +1419,7 @@ class SingletonUpdater:
     # Other non-api functions and setups
     # -------------------------------------------------------------------------
     def clear_state(self):
+        self.cancel_update()
         self._update_ready = None
         self._update_link = None
         self._update_version = None
@@ -1143,18 +1427,194 @@ class SingletonUpdater:
         self._error = None
         self._error_msg = None
 
-    def url_retrieve(self, url_file, filepath):
-        """Custom urlretrieve implementation"""
-        chunk = 1024 * 8
-        f = open(filepath, "wb")
-        while 1:
-            data = url_file.read(chunk)
-            if not data:
-                # print("done.")
+    def urlopen(self, request, context=None):
+        """Open a request with the connect timeout, then switch the socket to
+        the read timeout for the body.
+
+        The response is registered with the running check, so cancelling the
+        check also shuts down a connection blocked in a read.
+        """
+        self.raise_if_cancelled()
+        if context:
+            result = urllib.request.urlopen(
+                request, context=context, timeout=self._connect_timeout)
+        else:
+            result = urllib.request.urlopen(
+                request, timeout=self._connect_timeout)
+
+        sock = response_socket(result)
+        if sock is not None:
+            sock.settimeout(self._read_timeout)
+        handle = getattr(self._thread_state, "handle", None)
+        if handle is not None:
+            handle.track(result)
+        return result
+
+    def raise_if_cancelled(self):
+        """Raise UpdateCancelled in a check thread once it was cancelled"""
+        handle = getattr(self._thread_state, "handle", None)
+        if handle is not None and handle.cancelled():
+            raise UpdateCancelled()
+
+    def url_retrieve(self, url_file, filepath, offset=0, digest=None,
+                     status=None):
+        """Custom urlretrieve implementation.
+
+        Reads grow from DOWNLOAD_CHUNK_MIN up to DOWNLOAD_CHUNK_MAX while the
+        connection keeps up and shrink again when a read stalls. With an
+        offset the file is truncated there and appended to. Data is fed to
+        digest and counted in status while it is copied. A cancelled update
+        stops with UpdateCancelled between chunks. url_file is left open,
+        closing it is up to the caller.
+        """
+        chunk = DOWNLOAD_CHUNK_MIN
+        with open(filepath, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            while 1:
+                self.raise_if_cancelled()
+                start = time.monotonic()
+                try:
+                    data = url_file.read(chunk)
+                except Exception:
+                    self.raise_if_cancelled()
+                    raise
+                if not data:
+                    break
+                f.write(data)
+                if digest is not None:
+                    digest.update(data)
+                if status is not None:
+                    status.advance(len(data))
+
+                elapsed = time.monotonic() - start
+                if elapsed < DOWNLOAD_FAST_READ and chunk < DOWNLOAD_CHUNK_MAX:
+                    chunk *= 2
+                elif elapsed > DOWNLOAD_SLOW_READ and chunk > DOWNLOAD_CHUNK_MIN:
+                    chunk //= 2
+
+    def download(self, url, part_path, filepath, sha256=None):
+        """Download url to filepath, resuming interrupted attempts.
+
+        Data is written to part_path, with the url and the ETag/Last-Modified
+        validator of the response kept next to it. Interrupted downloads and
+        later calls continue from the end of the partial file with a Range
+        request (If-Range makes the server send the full file again if it
+        changed). The SHA-256 is computed while copying and checked against
+        sha256 when given. Progress goes to download_status.
+        Returns the hex digest.
+        """
+        meta_path = part_path + ".json"
+        meta = dict()
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            pass
+        if meta.get("url") != url or not meta.get("validator"):
+            meta = {"url": url, "validator": None}
+            if os.path.isfile(part_path):
+                os.remove(part_path)
+
+        try:
+            context = ssl._create_unverified_context()
+        except:
+            context = None
+
+        status = self._download_status
+        attempt = 0
+        while True:
+            offset = 0
+            if os.path.isfile(part_path) and meta["validator"]:
+                offset = os.path.getsize(part_path)
+            headers = dict()
+            if offset:
+                headers["Range"] = "bytes={}-".format(offset)
+                headers["If-Range"] = meta["validator"]
+
+            response = None
+            try:
+                response = self.urlopen(self.build_request(url, headers), context)
+                total = response.headers.get("Content-Length")
+                total = int(total) if total is not None else None
+                content_range = response.headers.get("Content-Range", "")
+                if response.getcode() == 206:
+                    if not content_range.startswith("bytes {}-".format(offset)):
+                        # Some other part of the file, retry without Range.
+                        meta["validator"] = None
+                        raise IOError("Unexpected Content-Range " + content_range)
+                    size = content_range.rpartition("/")[2]
+                    total = int(size) if size.isdigit() else None
+                else:
+                    # Not resumable, or the file changed: start over.
+                    offset = 0
+
+                validator = response.headers.get("ETag")
+                if validator is None or validator.startswith("W/"):
+                    validator = response.headers.get("Last-Modified")
+                meta["validator"] = validator
+                with open(meta_path, "w") as meta_file:
+                    json.dump(meta, meta_file)
+
+                digest = hashlib.sha256()
+                if offset:
+                    self.print_verbose(
+                        "Resuming download at {} bytes".format(offset))
+                    with open(part_path, "rb") as part_file:
+                        remaining = offset
+                        while remaining:
+                            data = part_file.read(min(remaining, 1024 * 1024))
+                            if not data:
+                                break
+                            digest.update(data)
+                            remaining -= len(data)
+
+                status.begin(url, total, offset)
+                self.url_retrieve(response, part_path, offset=offset,
+                                  digest=digest, status=status)
+                received = os.path.getsize(part_path)
+                if total is not None and received != total:
+                    raise IOError("Download incomplete, {} of {} bytes".format(
+                        received, total))
                 break
-            f.write(data)
-            # print("Read %s bytes" % len(data))
-        f.close()
+            except UpdateCancelled:
+                raise
+            except urllib.error.HTTPError as e:
+                if e.code == 416:
+                    # Range not satisfiable, the partial file is useless.
+                    meta["validator"] = None
+                elif e.code < 500:
+                    raise
+                error = e
+            except (urllib.error.URLError, http.client.HTTPException,
+                    OSError) as e:
+                error = e
+            finally:
+                # Also when the download fails partway through.
+                if response is not None:
+                    response.close()
+
+            attempt += 1
+            if attempt > self._download_retries:
+                raise error
+            status.interrupted(str(error))
+            self.print_verbose("Download interrupted ({}), retrying".format(
+                error))
+            time.sleep(min(2 ** attempt, 10))
+            self.raise_if_cancelled()
+
+        hexdigest = digest.hexdigest()
+        if sha256 is not None and hexdigest.lower() != sha256.lower():
+            os.remove(part_path)
+            os.remove(meta_path)
+            raise ValueError("Downloaded file does not match its SHA-256")
+
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+        os.replace(part_path, filepath)
+        os.remove(meta_path)
+        status.finish(hexdigest)
+        return hexdigest
 
     def version_tuple_from_text(self, text):
         """Convert text into a tuple of numbers (int).
@@ -1358,7 +1818,8 @@ class SingletonUpdater:
         if not tg:
             raise ValueError("Version tag not found: " + name)
 
-    def run_update(self, force=False, revert_tag=None, clean=False, callback=None):
+    def run_update(self, force=False, revert_tag=None, clean=False,
+                   callback=None, sha256=None):
         """Runs an install, update, or reversion of an addon from online source
 
         Arguments:
@@ -1366,6 +1827,20 @@ class SingletonUpdater:
             revert_tag: Version to install, if none uses detected update link
             clean: not used, but in future could use to totally refresh addon
             callback: used to run function on update completion
+            sha256: expected SHA-256 of the download, only checked when given
+        """
+        link, result = self.prepare_update(force, revert_tag, callback)
+        if link is None:
+            return result
+        return self.finish_update(
+            self.stage_repository(link, sha256), clean, callback)
+
+    def prepare_update(self, force=False, revert_tag=None, callback=None):
+        """First step of run_update, checks that an update can be staged.
+
+        Returns (link, None) with the link to download, or (None, result)
+        when there is nothing to download and result is what run_update
+        returns (fake installs finish here).
         """
         self._json["update_ready"] = False
         self._json["ignore"] = False  # clear ignore flag
@@ -1392,7 +1867,9 @@ class SingletonUpdater:
                 self.create_backup()
             self.reload_addon()
             self._update_ready = False
-            res = True  # fake "success" zip download flag
+            if callback:
+                callback(self._addon_package)
+            return None, 0
 
         elif not force:
             if not self._update_ready:
@@ -1401,48 +1878,44 @@ class SingletonUpdater:
                     callback(
                         self._addon_package,
                         "Update stopped, new version not ready")
-                return "Update stopped, new version not ready"
+                return None, "Update stopped, new version not ready"
             elif self._update_link is None:
                 # this shouldn't happen if update is ready
                 self.print_verbose("Update stopped, update link unavailable")
                 if callback:
                     callback(self._addon_package,
                              "Update stopped, update link unavailable")
-                return "Update stopped, update link unavailable"
+                return None, "Update stopped, update link unavailable"
 
             if revert_tag is None:
                 self.print_verbose("Staging update")
             else:
                 self.print_verbose("Staging install")
 
-            res = self.stage_repository(self._update_link)
-            if not res:
-                print("Error in staging repository: " + str(res))
-                if callback is not None:
-                    callback(self._addon_package, self._error_msg)
-                return self._error_msg
-            res = self.unpack_staged_zip(clean)
-            if res < 0:
-                if callback:
-                    callback(self._addon_package, self._error_msg)
-                return res
-
         else:
             if self._update_link is None:
                 self.print_verbose("Update stopped, could not get link")
-                return "Update stopped, could not get link"
+                return None, "Update stopped, could not get link"
             self.print_verbose("Forcing update")
 
-            res = self.stage_repository(self._update_link)
-            if not res:
-                print("Error in staging repository: " + str(res))
-                if callback:
-                    callback(self._addon_package, self._error_msg)
-                return self._error_msg
-            res = self.unpack_staged_zip(clean)
-            if res < 0:
-                return res
-            # would need to compare against other versions held in tags
+        return self._update_link, None
+
+    def finish_update(self, staged, clean=False, callback=None):
+        """Last step of run_update, installs the staged download.
+
+        staged is the result of stage_repository. Runs on the main thread,
+        as it reloads the addon. Returns 0 on success.
+        """
+        if not staged:
+            print("Error in staging repository: " + str(staged))
+            if callback is not None:
+                callback(self._addon_package, self._error_msg)
+            return self._error_msg
+        res = self.unpack_staged_zip(clean)
+        if res < 0:
+            if callback:
+                callback(self._addon_package, self._error_msg)
+            return res
 
         # run the front-end's callback if provided
         if callback:
@@ -1451,6 +1924,48 @@ class SingletonUpdater:
         # return something meaningful, 0 means it worked
         return 0
 
+    def start_update(self, force=False, revert_tag=None, sha256=None,
+                     callback=None):
+        """Start run_update with the download on a background thread.
+
+        Returns an UpdateCheck handle whose result is the stage_repository
+        result, the caller polls it from the main thread and then installs
+        with finish_update. Returns None when there is nothing to download,
+        after calling callback like run_update does.
+        """
+        if self._update_handle is not None and self._update_handle.running():
+            return self._update_handle
+        link, result = self.prepare_update(force, revert_tag, callback)
+        if link is None:
+            return None
+
+        handle = UpdateCheck()
+        download_thread = threading.Thread(
+            target=self.async_stage_repository, args=(link, sha256, handle))
+        download_thread.daemon = True
+        self._update_handle = handle
+        download_thread.start()
+        return handle
+
+    def async_stage_repository(self, url, sha256, handle):
+        """Download the update, run as target of a background thread"""
+        self._thread_state.handle = handle
+        try:
+            handle.set_result(self.stage_repository(url, sha256))
+        except UpdateCancelled:
+            self.print_verbose("Update download cancelled")
+            handle.set_done()
+        except Exception as exception:
+            self.print_trace()
+            handle.set_exception(exception)
+            handle.set_done()
+
+    def cancel_update(self):
+        """Cancel a download started with start_update"""
+        if self._update_handle is not None:
+            self._update_handle.cancel()
+        self._update_handle = None
+
     def past_interval_timestamp(self):
         if not self._check_interval_enabled:
             return True  # ie this exact feature is disabled
@@ -1495,6 +2010,19 @@ class SingletonUpdater:
             self.print_trace()
         return json_path
 
+    def get_cache_path(self):
+        """Returns the path of the API response cache, next to the state"""
+        return os.path.join(
+            self._updater_path,
+            "{}_updater_cache.json".format(self._addon_package))
+
+    def get_response_cache(self):
+        """Returns the response cache of the current updater path"""
+        path = self.get_cache_path()
+        if self._response_cache is None or self._response_cache.path != path:
+            self._response_cache = ResponseCache(path)
+        return self._response_cache
+
     def set_updater_json(self):
         """Load or initialize JSON dictionary data for updater state"""
         if self._updater_path is None:
@@ -1569,23 +2097,35 @@ class SingletonUpdater:
     # ASYNC related methods
     # -------------------------------------------------------------------------
     def start_async_check_update(self, now=False, callback=None):
-        """Start a background thread which will check for updates"""
-        if self._async_checking:
-            return
+        """Start a background thread which will check for updates.
+
+        Returns an UpdateCheck handle which can be waited on or cancelled,
+        the handle of the running check if one was already started.
+        """
+        if self._async_checking and self._check_handle is not None:
+            return self._check_handle
         self.print_verbose("Starting background checking thread")
+        handle = UpdateCheck()
         check_thread = threading.Thread(target=self.async_check_update,
-                                        args=(now, callback,))
+                                        args=(now, callback, handle))
         check_thread.daemon = True
+        self._async_checking = True
+        self._check_handle = handle
         self._check_thread = check_thread
         check_thread.start()
+        return handle
 
-    def async_check_update(self, now, callback=None):
+    def async_check_update(self, now, callback=None, handle=None):
         """Perform update check, run as target of background thread"""
         self._async_checking = True
+        self._thread_state.handle = handle
         self.print_verbose("Checking for update now in background")
 
+        result = None
         try:
-            self.check_for_update(now=now)
+            result = self.check_for_update(now=now)
+        except UpdateCancelled:
+            self.print_verbose("Background check cancelled")
         except Exception as exception:
             print("Checking for update error:")
             print(exception)
@@ -1596,9 +2136,25 @@ class SingletonUpdater:
                 self._update_link = None
                 self._error = "Error occurred"
                 self._error_msg = "Encountered an error while checking for updates"
+            if handle is not None:
+                handle.set_exception(exception)
 
-        self._async_checking = False
-        self._check_thread = None
+        if handle is not None and handle.cancelled():
+            # Leave the state as if the check never ran so it can be retried,
+            # unless a new check took over already.
+            if self._check_handle is None:
+                self._update_ready = None
+                self._error = None
+                self._error_msg = None
+            handle.set_done()
+            return
+
+        if self._check_handle is handle:
+            self._async_checking = False
+            self._check_thread = None
+            self._check_handle = None
+        if handle is not None:
+            handle.set_result(result)
 
         if callback:
             self.print_verbose("Finished check update, doing callback")
@@ -1606,24 +2162,373 @@ class SingletonUpdater:
         self.print_verbose("BG thread: Finished check update, no callback")
 
     def stop_async_check_update(self):
-        """Method to give impression of stopping check for update.
+        """Cancel the running background check.
 
-        Currently does nothing but allows user to retry/stop blocking UI from
-        hitting a refresh button. This does not actually stop the thread, as it
-        will complete after the connection timeout regardless. If the thread
-        does complete with a successful response, this will be still displayed
-        on next UI refresh (ie no update, or update available).
+        Open connections of the check are shut down, so the thread ends
+        promptly instead of waiting for the server or a timeout. The UI can
+        start a new check right away.
         """
-        if self._check_thread is not None:
-            self.print_verbose("Thread will end in normal course.")
-            # however, "There is no direct kill method on a thread object."
-            # better to let it run its course
-            # self._check_thread.stop()
+        handle = self._check_handle
+        if handle is not None:
+            self.print_verbose("Cancelling background check")
+            handle.cancel()
+        self._check_handle = None
+        self._check_thread = None
         self._async_checking = False
         self._error = None
         self._error_msg = None
 
 
+# -----------------------------------------------------------------------------
+# Install file helpers
+# -----------------------------------------------------------------------------
+
+
+class UnsafeZipPath(ValueError):
+    """Raised for a zip member that would be extracted outside its folder"""
+
+
+# Copy buffer used per extracted file, and the files each extract thread
+# should have at least before more threads are used.
+EXTRACT_BUFFER = 1024 * 1024
+EXTRACT_MIN_FILES = 8
+
+
+def compile_patterns(patterns):
+    """Single regex matching a file name against any of the fnmatch patterns"""
+    if not patterns:
+        return None
+    return re.compile("|".join(
+        fnmatch.translate(os.path.normcase(p)) for p in patterns))
+
+
+def match_pattern(regex, name):
+    return regex is not None and regex.match(os.path.normcase(name)) is not None
+
+
+def link_or_copy(source, dest):
+    """Hardlink source to dest, copying where links aren't supported"""
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def zip_member_path(outdir, name):
+    """Path of zip member name below outdir, refusing zip-slip paths"""
+    parts = name.replace('\\', '/').split('/')
+    if os.path.isabs(name) or os.path.splitdrive(name)[0] or ".." in parts:
+        raise UnsafeZipPath(name)
+    root = os.path.realpath(outdir)
+    path = os.path.realpath(os.path.join(root, *[p for p in parts if p]))
+    if os.path.commonpath([root, path]) != root:
+        raise UnsafeZipPath(name)
+    return path
+
+
+def extract_members(source_zip, files):
+    """Copy (size, member, path) entries of source_zip to their paths"""
+    with zipfile.ZipFile(source_zip, "r") as zfile:
+        for size, name, path in files:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with zfile.open(name) as source, open(path, "wb") as outfile:
+                shutil.copyfileobj(source, outfile, EXTRACT_BUFFER)
+
+
+# -----------------------------------------------------------------------------
+# Background check handle
+# -----------------------------------------------------------------------------
+
+
+class UpdateCancelled(Exception):
+    """Raised inside updater work after it was cancelled"""
+
+
+def response_socket(response):
+    """The socket below a urllib response, None if it can't be reached"""
+    raw = getattr(getattr(response, "fp", None), "raw", None)
+    return getattr(raw, "_sock", None)
+
+
+class UpdateCheck:
+    """Future-like handle of a background update check or download.
+
+    result() waits for the result of the thread, (update_ready, version,
+    link) for a check and the stage_repository result for a download.
+    cancel() stops it: the thread raises UpdateCancelled at its next request
+    or download chunk, and connections it has open are shut down so blocked
+    reads return immediately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._cancelled = False
+        self._result = None
+        self._exception = None
+        self._responses = list()
+
+    def track(self, response):
+        with self._lock:
+            cancelled = self._cancelled
+            if not cancelled:
+                self._responses.append(response)
+        if cancelled:
+            self._shutdown(response)
+            raise UpdateCancelled()
+
+    def cancel(self):
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self._cancelled = True
+            responses = self._responses
+            self._responses = list()
+        for response in responses:
+            self._shutdown(response)
+        return True
+
+    def _shutdown(self, response):
+        sock = response_socket(response)
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def cancelled(self):
+        return self._cancelled
+
+    def done(self):
+        return self._done.is_set() or self._cancelled
+
+    def running(self):
+        return not self.done()
+
+    def result(self, timeout=None):
+        if self._cancelled:
+            raise concurrent.futures.CancelledError()
+        if not self._done.wait(timeout):
+            raise concurrent.futures.TimeoutError()
+        if self._cancelled:
+            raise concurrent.futures.CancelledError()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def set_result(self, result):
+        self._result = result
+        self.set_done()
+
+    def set_exception(self, exception):
+        self._exception = exception
+
+    def set_done(self):
+        with self._lock:
+            self._responses = list()
+        self._done.set()
+
+
+# -----------------------------------------------------------------------------
+# Download progress
+# -----------------------------------------------------------------------------
+
+# Read sizes of url_retrieve, and the read durations (seconds) below which
+# it grows or above which it shrinks its reads.
+DOWNLOAD_CHUNK_MIN = 16 * 1024
+DOWNLOAD_CHUNK_MAX = 4 * 1024 * 1024
+DOWNLOAD_FAST_READ = 0.05
+DOWNLOAD_SLOW_READ = 0.5
+
+
+class DownloadStatus:
+    """Thread-safe progress of the current update download.
+
+    Written by the thread downloading, read by the UI through snapshot().
+    The throughput is a moving average over the recent reads. An optional
+    callback is called with the status after every change.
+    """
+
+    RATE_SMOOTHING = 0.3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.callback = None
+        self._reset()
+
+    def _reset(self):
+        self._state = "idle"
+        self._url = None
+        self._total = None
+        self._received = 0
+        self._resumed_from = 0
+        self._rate = 0.0
+        self._last_time = None
+        self._error = None
+        self._sha256 = None
+
+    def _changed(self):
+        if self.callback is not None:
+            self.callback(self)
+
+    def begin(self, url, total, offset):
+        with self._lock:
+            self._reset()
+            self._state = "downloading"
+            self._url = url
+            self._total = total
+            self._received = offset
+            self._resumed_from = offset
+            self._last_time = time.monotonic()
+        self._changed()
+
+    def advance(self, count):
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                rate = count / elapsed
+                self._rate += self.RATE_SMOOTHING * (rate - self._rate)
+            self._last_time = now
+            self._received += count
+        self._changed()
+
+    def interrupted(self, error):
+        with self._lock:
+            self._state = "interrupted"
+            self._error = error
+            self._rate = 0.0
+        self._changed()
+
+    def fail(self, error):
+        with self._lock:
+            self._state = "failed"
+            self._error = error
+            self._rate = 0.0
+        self._changed()
+
+    def finish(self, sha256):
+        with self._lock:
+            self._state = "done"
+            self._sha256 = sha256
+            self._rate = 0.0
+        self._changed()
+
+    def snapshot(self):
+        """Consistent copy of the status as a dictionary"""
+        with self._lock:
+            progress = None
+            if self._total:
+                progress = min(1.0, self._received / self._total)
+            return {
+                "state": self._state,
+                "url": self._url,
+                "total": self._total,
+                "received": self._received,
+                "resumed_from": self._resumed_from,
+                "progress": progress,
+                "rate": self._rate,
+                "error": self._error,
+                "sha256": self._sha256
+            }
+
+
+# -----------------------------------------------------------------------------
+# Response cache
+# -----------------------------------------------------------------------------
+
+
+class ResponseCache:
+    """On-disk cache of decoded API responses for conditional requests.
+
+    Keeps the ETag and Last-Modified validators with the decoded response of
+    each url, so a 304 Not Modified reply is answered from memory without
+    downloading or decoding the body. The file is read once per session.
+    Least recently used entries are evicted beyond max_entries or when the
+    stored bodies exceed max_bytes.
+    """
+
+    def __init__(self, path, max_entries=16, max_bytes=4 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        self._entries = dict()
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+            if isinstance(entries, dict):
+                self._entries = entries
+        except (OSError, ValueError):
+            pass
+        return self._entries
+
+    def conditional_headers(self, url):
+        with self._lock:
+            entry = self._load().get(url)
+        headers = dict()
+        if entry is None:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def get(self, url):
+        with self._lock:
+            entry = self._load().get(url)
+            if entry is None:
+                return None
+            entry["used"] = datetime.now().timestamp()
+            return entry["data"]
+
+    def put(self, url, headers, data, size):
+        etag = headers.get("ETag") if headers is not None else None
+        last_modified = headers.get("Last-Modified") if headers is not None else None
+        with self._lock:
+            entries = self._load()
+            if etag is None and last_modified is None:
+                # Nothing to revalidate with, don't keep a stale copy.
+                if entries.pop(url, None) is not None:
+                    self._save()
+                return
+            entries[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": size,
+                "used": datetime.now().timestamp(),
+                "data": data
+            }
+            self._evict()
+            self._save()
+
+    def _evict(self):
+        entries = self._entries
+        by_age = sorted(entries, key=lambda url: entries[url]["used"])
+        total = sum(entry["size"] for entry in entries.values())
+        while by_age and (len(entries) > self.max_entries
+                          or total > self.max_bytes):
+            total -= entries.pop(by_age.pop(0))["size"]
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            return
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w') as outf:
+                json.dump(self._entries, outf)
+            os.replace(temp_path, self.path)
+        except OSError:
+            print("Failed to save updater response cache: ", self.path)
+
+
 # -----------------------------------------------------------------------------
 # Updater Engines
 # -----------------------------------------------------------------------------
@@ -21,6 +21,7 @@
 Implements draw calls, popups, and operators that use the addon_updater.
 """
 
+import concurrent.futures
 import os
 import traceback
 
@@ -207,16 +208,7 @@ class AddonUpdaterInstallPopup(bpy.types.Operator):
                 updater.ignore_update()
                 return {'FINISHED'}
 
-            res = updater.run_update(force=False,
-                                     callback=post_update_callback,
-                                     clean=self.clean_install)
-
-            # Should return 0, if not something happened.
-            if updater.verbose:
-                if res == 0:
-                    print("Updater returned successful")
-                else:
-                    print("Updater returned {}, error occurred".format(res))
+            run_update_background(clean=self.clean_install)
         elif updater.update_ready is None:
             _ = updater.check_for_update(now=True)
 
@@ -295,16 +287,7 @@ class AddonUpdaterUpdateNow(bpy.types.Operator):
         if updater.update_ready:
             # if it fails, offer to open the website instead
             try:
-                res = updater.run_update(force=False,
-                                         callback=post_update_callback,
-                                         clean=self.clean_install)
-
-                # Should return 0, if not something happened.
-                if updater.verbose:
-                    if res == 0:
-                        print("Updater returned successful")
-                    else:
-                        print("Updater error response: {}".format(res))
+                run_update_background(clean=self.clean_install)
             except Exception as expt:
                 updater._error = "Error trying to run update"
                 updater._error_msg = str(expt)
@@ -388,20 +371,8 @@ class AddonUpdaterUpdateTarget(bpy.types.Operator):
         if updater.invalid_updater:
             return {'CANCELLED'}
 
-        res = updater.run_update(
-            force=False,
-            revert_tag=self.target,
-            callback=post_update_callback,
-            clean=self.clean_install)
-
-        # Should return 0, if not something happened.
-        if res == 0:
-            updater.print_verbose("Updater returned successful")
-        else:
-            updater.print_verbose(
-                "Updater returned {}, , error occurred".format(res))
-            return {'CANCELLED'}
-
+        run_update_background(clean=self.clean_install,
+                              revert_tag=self.target)
         return {'FINISHED'}
 
 
@@ -615,6 +586,7 @@ class AddonUpdaterEndBackground(bpy.types.Operator):
         if updater.invalid_updater:
             return {'CANCELLED'}
         updater.stop_async_check_update()
+        updater.cancel_update()
         return {'FINISHED'}
 
 
@@ -764,6 +736,46 @@ def ui_refresh(update_status):
                 area.tag_redraw()
 
 
+def run_update_background(clean=False, revert_tag=None):
+    """Download the update on a background thread, then install it.
+
+    A timer polls the download, redrawing the UI so the progress shows in
+    the preferences, and installs on the main thread once it finished.
+    """
+    if updater.update_downloading:
+        return
+    handle = updater.start_update(force=False, revert_tag=revert_tag,
+                                  callback=post_update_callback)
+    if handle is None:
+        return
+
+    def poll_download():
+        ui_refresh(None)
+        if not handle.done():
+            return 0.25
+        try:
+            staged = handle.result()
+        except concurrent.futures.CancelledError:
+            updater.print_verbose("Update download cancelled")
+            return None
+        except Exception as expt:
+            updater._error = "Error trying to run update"
+            updater._error_msg = str(expt)
+            staged = False
+        res = updater.finish_update(staged, clean, post_update_callback)
+
+        # Should return 0, if not something happened.
+        if res == 0:
+            updater.print_verbose("Updater returned successful")
+        else:
+            updater.print_verbose(
+                "Updater returned {}, error occurred".format(res))
+        ui_refresh(None)
+        return None
+
+    bpy.app.timers.register(poll_download, first_interval=0.25)
+
+
 def check_for_update_background():
     """Function for asynchronous background check.
 
@@ -931,6 +943,19 @@ def update_notice_box_ui(self, context):
         col.operator("wm.url_open", text="Get it now").url = updater.website
 
 
+def download_status_text(download):
+    """Short progress line from a DownloadStatus snapshot"""
+    received = download["received"] / (1024 * 1024)
+    if download["state"] == "interrupted":
+        return "Download interrupted at {:.1f} MB, retrying".format(received)
+    text = "Downloading update: {:.1f} MB".format(received)
+    if download["progress"] is not None:
+        text += " ({:.0%})".format(download["progress"])
+    if download["rate"] > 0:
+        text += " at {:.1f} MB/s".format(download["rate"] / (1024 * 1024))
+    return text
+
+
 def update_settings_ui(self, context, element=None):
     """Preferences - for drawing with full width inside user preferences
 
@@ -1012,6 +1037,18 @@ def update_settings_ui(self, context, element=None):
         split.operator(AddonUpdaterCheckNow.bl_idname,
                        text="", icon="FILE_REFRESH")
 
+    elif updater.update_downloading:
+        sub_col = col.row(align=True)
+        sub_col.scale_y = 1
+        split = sub_col.split(align=True)
+        split.enabled = False
+        split.scale_y = 2
+        split.operator(AddonUpdaterCheckNow.bl_idname,
+                       text="Downloading update...")
+        split = sub_col.split(align=True)
+        split.scale_y = 2
+        split.operator(AddonUpdaterEndBackground.bl_idname, text="", icon="X")
+
     elif updater.update_ready is None and not updater.async_checking:
         col.scale_y = 2
         col.operator(AddonUpdaterCheckNow.bl_idname)
@@ -1094,7 +1131,10 @@ def update_settings_ui(self, context, element=None):
     row = box.row()
     row.scale_y = 0.7
     last_check = updater.json["last_check"]
-    if updater.error is not None and updater.error_msg is not None:
+    download = updater.download_status.snapshot()
+    if download["state"] in ("downloading", "interrupted"):
+        row.label(text=download_status_text(download))
+    elif updater.error is not None and updater.error_msg is not None:
         row.label(text=updater.error_msg)
     elif last_check:
         last_check = last_check[0: last_check.index(".")]
@@ -0,0 +1,151 @@
+"""Quadric error vertex clustering used to build LOD meshes.
+
+This module only depends on NumPy. The LOD generator runs it in spawned
+worker processes, which import it as a top level module without bpy.
+"""
+import numpy as np
+
+from multiprocessing import shared_memory
+
+# Bisection steps over the grid resolution, and the largest resolution tried
+SEARCH_STEPS = 14
+MAX_RESOLUTION = 1 << 16
+
+def _grid(positions, resolution):
+    # Integer cell coordinates of every vertex on a cubic grid over the bounds
+    low = positions.min(axis=0)
+    extent = float((positions.max(axis=0) - low).max())
+    cell_size = extent / resolution if extent > 0.0 else 1.0
+    cells = np.floor((positions - low) / cell_size).astype(np.int64)
+    np.clip(cells, 0, resolution - 1, out=cells)
+    return cells, low, cell_size
+
+def _cluster(positions, triangles, resolution):
+    """Clusters vertices per grid cell and collapses the triangles.
+
+    Returns (vertex labels, cell coordinates per label, kept triangle
+    indices, collapsed triangles in label space, source corners) plus the
+    grid origin and cell size. Collapsed triangles are rotated, source
+    corners hold the corner of the kept triangle each of their corners came
+    from. Triangles that lose an edge are dropped, and duplicates with the
+    same winding are kept once.
+    """
+    cells, low, cell_size = _grid(positions, resolution)
+    keys = cells[:, 0] + resolution * (cells[:, 1] + resolution * cells[:, 2])
+    unique, first, labels = np.unique(keys, return_index=True, return_inverse=True)
+    labels = labels.reshape(-1)
+
+    collapsed = labels[triangles]
+    keep = ((collapsed[:, 0] != collapsed[:, 1]) & (collapsed[:, 1] != collapsed[:, 2])
+            & (collapsed[:, 0] != collapsed[:, 2]))
+    kept = np.flatnonzero(keep)
+    collapsed = collapsed[kept]
+
+    # Rotate the smallest label first so equal triangles compare equal
+    # without losing their winding
+    shift = collapsed.argmin(axis=1)[:, None]
+    corners = (shift + np.arange(3)) % 3
+    collapsed = np.take_along_axis(collapsed, corners, axis=1)
+    rows = np.ascontiguousarray(collapsed).view(np.dtype((np.void, collapsed.itemsize * 3))).ravel()
+    rows, unique_rows = np.unique(rows, return_index=True)
+    unique_rows.sort()
+
+    return labels, cells[first], kept[unique_rows], collapsed[unique_rows], corners[unique_rows], low, cell_size
+
+def collapsed_count(positions, triangles, resolution):
+    return len(_cluster(positions, triangles, resolution)[2])
+
+def find_resolution(positions, triangles, target):
+    # Largest grid resolution whose clustering keeps at most target triangles
+    low, high = 1, 2
+    while high < MAX_RESOLUTION and collapsed_count(positions, triangles, high) <= target:
+        low, high = high, high * 2
+
+    for _ in range(SEARCH_STEPS):
+        if high - low <= 1:
+            break
+        middle = (low + high) // 2
+        if collapsed_count(positions, triangles, middle) <= target:
+            low = middle
+        else:
+            high = middle
+    return low
+
+def _solve_quadrics(positions, triangles, labels, count, cells, low, cell_size):
+    """Places every cluster at the point minimizing its summed plane quadrics.
+
+    Each triangle adds its area weighted plane quadric to the clusters of its
+    three corners. The solve is regularized towards the cluster mean, so flat
+    or degenerate clusters fall back to the average position, and the result
+    is clamped to the cluster's grid cell.
+    """
+    p0 = positions[triangles[:, 0]]
+    normal = np.cross(positions[triangles[:, 1]] - p0, positions[triangles[:, 2]] - p0)
+    length = np.linalg.norm(normal, axis=1)
+    # n n^T / |n| is the plane quadric weighted by (twice) the triangle area
+    normal /= np.sqrt(np.maximum(length, 1e-30))[:, None]
+    offset = -np.einsum("ij,ij->i", normal, p0)
+
+    corner_labels = labels[triangles].ravel()
+    def accumulate(values):
+        return np.bincount(corner_labels, weights=np.repeat(values, 3), minlength=count)
+
+    a = np.empty((count, 3, 3))
+    for i in range(3):
+        for j in range(i, 3):
+            a[:, i, j] = a[:, j, i] = accumulate(normal[:, i] * normal[:, j])
+    b = np.stack([accumulate(normal[:, i] * offset) for i in range(3)], axis=1)
+
+    members = np.bincount(labels, minlength=count)[:, None]
+    mean = np.stack([np.bincount(labels, weights=positions[:, i], minlength=count) for i in range(3)], axis=1)
+    mean /= np.maximum(members, 1)
+
+    regularization = np.trace(a, axis1=1, axis2=2) * 1e-3 + 1e-12
+    a[:, [0, 1, 2], [0, 1, 2]] += regularization[:, None]
+    rhs = regularization[:, None] * mean - b
+    solved = np.linalg.solve(a, rhs[:, :, None])[:, :, 0]
+
+    cell_low = low + cells * cell_size
+    return np.clip(solved, cell_low, cell_low + cell_size)
+
+def decimate(positions, triangles, target):
+    """Reduces a triangle mesh to at most target triangles.
+
+    Returns (positions, triangles, source, corners) where source holds the
+    index of the input triangle every output triangle was collapsed from and
+    corners which of its corners (0-2) each output corner came from, so the
+    caller can carry UVs and materials over.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64)
+    if len(triangles) <= target:
+        return positions, triangles, np.arange(len(triangles)), np.tile(np.arange(3), (len(triangles), 1))
+
+    resolution = find_resolution(positions, triangles, target)
+    labels, cells, kept, collapsed, corners, low, cell_size = _cluster(positions, triangles, resolution)
+    clustered = _solve_quadrics(positions, triangles, labels, len(cells), cells, low, cell_size)
+
+    # Compact to the clusters still referenced by a triangle
+    used, remap = np.unique(collapsed, return_inverse=True)
+    return clustered[used], remap.reshape(-1, 3), kept, corners
+
+def shared_arrays(block, vertex_count, triangle_count):
+    # Positions (float32) followed by triangles (int32) in one shared block
+    positions = np.ndarray((vertex_count, 3), dtype=np.float32, buffer=block.buf)
+    triangles = np.ndarray((triangle_count, 3), dtype=np.int32, buffer=block.buf, offset=vertex_count * 12)
+    return positions, triangles
+
+def decimate_shared(name, vertex_count, triangle_count, target):
+    # Worker entry point, reads the input mesh from a shared memory block.
+    # The views are copied and dropped first, a block with live views can't close.
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        positions, triangles = shared_arrays(block, vertex_count, triangle_count)
+        positions = positions.astype(np.float64)
+        triangles = triangles.astype(np.int64)
+    finally:
+        block.close()
+
+    positions, triangles, source, corners = decimate(positions, triangles, target)
+    return (positions.astype(np.float32), triangles.astype(np.int32),
+            source.astype(np.int32), corners.astype(np.int8))
@@ -0,0 +1,372 @@
+import bpy
+import csv
+import json
+import math
+import numpy as np
+
+from . import ahc_mesh
+
+from mathutils import kdtree
+
+def wheel_layout(wheel_base, front_track_width, rear_track_width, tire_width, tire_aspect, rim_diameter,
+                 wheel_radius=0.0):
+    # Wheel radius and wheel locations in root space, in the hierarchy units.
+    # A measured wheel_radius (m) overrides the one derived from the tyre size.
+    rim_dia_m = rim_diameter * 0.0254
+    rim_dia_mm = rim_dia_m * 0.01
+    tire_width_mm = tire_width * 0.01
+    wheel_base_mm = (wheel_base / 2) * 0.01
+
+    rim_radius_mm = (rim_dia_mm / 2)
+    tire_radius_add_mm = (tire_width_mm * (tire_aspect / 100.0)) * 0.0001
+    wheel_radius_mm = rim_radius_mm + tire_radius_add_mm
+    if wheel_radius > 0.0:
+        wheel_radius_mm = wheel_radius * 0.01
+
+    front_track_width_mm = (front_track_width / 2) * 0.01
+    rear_track_width_mm = (rear_track_width / 2) * 0.01
+
+    locations = {
+        "LF": (front_track_width_mm, wheel_radius_mm, wheel_base_mm),
+        "RF": (-1 * front_track_width_mm, wheel_radius_mm, wheel_base_mm),
+        "LR": (rear_track_width_mm, wheel_radius_mm, -1 * wheel_base_mm),
+        "RR": (-1 * rear_track_width_mm, wheel_radius_mm, -1 * wheel_base_mm),
+    }
+    return wheel_radius_mm, locations
+
+def hierarchy_nodes(root_name, wheel_radius, wheel_locations):
+    # (name, location, parent name, empty display type, display size) per node
+    root_location = (0, 0, 0)
+
+    nodes = [(root_name, root_location, "", "PLAIN_AXES", 0.01),
+             ("COCKPIT_HR", root_location, root_name, "PLAIN_AXES", 0.01)]
+
+    for corner in ("LF", "RF", "LR", "RR"):
+        nodes.append(("WHEEL_" + corner, wheel_locations[corner], root_name, "SPHERE", wheel_radius * 1.5))
+    for corner in ("LF", "RF", "LR", "RR"):
+        nodes.append(("SUSP_" + corner, wheel_locations[corner], root_name, "PLAIN_AXES", 0.006))
+
+    nodes.append(("x0_main_body", root_location, root_name, "PLAIN_AXES", 0.01))
+    return nodes
+
+def build_empties(collection, nodes):
+    # Creates all empties through the data API and parents them in one pass,
+    # avoiding the context override, depsgraph update and undo push that
+    # bpy.ops.object.empty_add costs per node.
+    created = {}
+    for name, location, parent_name, display_type, display_size in nodes:
+        empty_obj = bpy.data.objects.new(name, None)
+        empty_obj.empty_display_type = display_type
+        empty_obj.empty_display_size = display_size
+        empty_obj.location = location
+        collection.objects.link(empty_obj)
+        created[name] = empty_obj
+
+    for name, location, parent_name, display_type, display_size in nodes:
+        if(parent_name != ""):
+            created[name].parent = created[parent_name]
+
+    return created
+
+def build_hierarchy(scene, collection_name, wheel_base, front_track_width, rear_track_width,
+                    tire_width, tire_aspect, rim_diameter, wheel_radius=0.0):
+    root_empty_name = collection_name + "_root"
+    wheel_radius, wheel_locations = wheel_layout(wheel_base, front_track_width, rear_track_width,
+                                                 tire_width, tire_aspect, rim_diameter, wheel_radius)
+
+    carRootCollection = bpy.data.collections.new(collection_name)
+    scene.collection.children.link(carRootCollection)
+
+    created = build_empties(carRootCollection, hierarchy_nodes(root_empty_name, wheel_radius, wheel_locations))
+
+    root_empty = created[root_empty_name]
+    root_empty.rotation_euler[0] = math.radians(90)
+    return root_empty
+
+# Spec table columns, each an AHC_Addon_Properties property that supplies
+# the type, default and range. collection_name has no default.
+SPEC_FIELDS = (
+    "collection_name",
+    "wheel_base",
+    "front_track_width",
+    "rear_track_width",
+    "tire_width",
+    "tire_aspect",
+    "rim_diameter",
+    "wheel_radius",
+)
+SPEC_REQUIRED = {"collection_name"}
+
+SPEC_ALIASES = {
+    "tyre_width": "tire_width",
+    "tyre_aspect": "tire_aspect",
+}
+
+def _parse_spec_value(prop, value):
+    if prop.type == 'STRING':
+        value = str(value).strip()
+        if value == "":
+            raise ValueError("is empty")
+        if prop.length_max and len(value) > prop.length_max:
+            raise ValueError("is longer than {} characters".format(prop.length_max))
+        return value
+
+    number = float(value)
+    if prop.type == 'INT':
+        if not number.is_integer():
+            raise ValueError("is not a whole number")
+        number = int(number)
+    if not prop.hard_min <= number <= prop.hard_max:
+        raise ValueError("is outside {} to {}".format(prop.hard_min, prop.hard_max))
+    return number
+
+def _normalize_spec(row, index, properties):
+    if not isinstance(row, dict):
+        raise ValueError("Car spec {} is not a table row".format(index + 1))
+
+    row = {SPEC_ALIASES.get(key.strip().lower(), key.strip().lower()): value
+           for key, value in row.items() if isinstance(key, str)}
+
+    spec = {}
+    for field in SPEC_FIELDS:
+        prop = properties[field]
+        value = row.get(field)
+        if value is None or (isinstance(value, str) and value.strip() == ""):
+            if field in SPEC_REQUIRED:
+                raise ValueError("Car spec {} is missing '{}'".format(index + 1, field))
+            spec[field] = prop.default
+            continue
+        try:
+            spec[field] = _parse_spec_value(prop, value)
+        except (TypeError, ValueError, OverflowError) as err:
+            raise ValueError("Car spec {} has an invalid '{}': {!r} ({})".format(index + 1, field, value, err))
+    return spec
+
+def load_car_specs(filepath, properties):
+    """Reads a table of car specs and validates every row.
+
+    The table is a CSV file with a header row of field names, or a JSON list
+    of objects (optionally under a "cars" key). properties is the bl_rna
+    properties collection of AHC_Addon_Properties, fields are checked against
+    it. Returns (specs, errors) with one error message per rejected row.
+    """
+    if filepath.lower().endswith(".json"):
+        with open(filepath, encoding="utf-8") as spec_file:
+            rows = json.load(spec_file)
+        if isinstance(rows, dict):
+            rows = rows.get("cars", [])
+    else:
+        with open(filepath, newline="", encoding="utf-8-sig") as spec_file:
+            rows = list(csv.DictReader(spec_file))
+
+    if not isinstance(rows, list):
+        raise ValueError("Car spec table must be a list of cars")
+
+    specs = []
+    errors = []
+    for index, row in enumerate(rows):
+        try:
+            specs.append(_normalize_spec(row, index, properties))
+        except ValueError as err:
+            errors.append(str(err))
+    return specs, errors
+
+def build_hierarchies(scene, specs):
+    return [build_hierarchy(scene, **spec) for spec in specs]
+
+# Wheel detection tolerances, relative to the size of the measured part
+DISC_ROUNDNESS = 0.15
+DISC_THICKNESS = 0.9
+MIN_WHEEL_SIZE = 0.08
+RADIUS_PERCENTILE = 99.5
+
+def read_world_geometry(objects, depsgraph):
+    # World space vertices and edges of the evaluated objects, as one graph
+    coords = []
+    edges = []
+    offset = 0
+    for obj in objects:
+        evaluated = obj.evaluated_get(depsgraph)
+        mesh = evaluated.to_mesh()
+        try:
+            co, buffer = ahc_mesh.read_vertex_coords(mesh)
+            coords.append(ahc_mesh.transform_coords(co, evaluated.matrix_world))
+            edges.append(ahc_mesh.read_edges(mesh).astype(np.int64) + offset)
+            offset += len(co)
+        finally:
+            evaluated.to_mesh_clear()
+
+    if not coords:
+        return np.empty((0, 3)), np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(coords), np.concatenate(edges)
+
+def fit_wheel(points):
+    # (center, axis, radius, width) of a wheel from its vertices. The axis
+    # is the direction of least variance, the radius a high percentile of the
+    # distance to it so stray vertices don't inflate the fit.
+    center = (points.min(axis=0) + points.max(axis=0)) * 0.5
+    offsets = points - center
+    eigenvalues, eigenvectors = np.linalg.eigh(offsets.T @ offsets)
+    axis = eigenvectors[:, 0]
+
+    along = offsets @ axis
+    radial = np.linalg.norm(offsets - np.outer(along, axis), axis=1)
+    radius = float(np.percentile(radial, RADIUS_PERCENTILE))
+    width = float(np.percentile(along, RADIUS_PERCENTILE) - np.percentile(along, 100.0 - RADIUS_PERCENTILE))
+    return center, axis, radius, width
+
+def detect_wheels(objects, depsgraph):
+    """Finds the four wheels of a car and measures them.
+
+    Expects the car in hierarchy orientation: +X left, -Y forward, +Z up.
+    Connected components whose bounding box is round in YZ and thin in X are
+    wheel parts. Parts whose centroids lie within each other's radius (found
+    with a KD-tree) form one wheel, and the largest wheel in each quadrant
+    around the car center is fitted. Returns {corner: (center, axis, radius,
+    width)} in world units, or raises ValueError when a corner is missing.
+    """
+    coords, edges = read_world_geometry(objects, depsgraph)
+    if len(coords) == 0:
+        raise ValueError("No mesh geometry to detect wheels in")
+
+    labels, count = ahc_mesh.connected_components(len(coords), edges)
+    low, high, centroid, sizes = ahc_mesh.component_bounds(coords, labels, count)
+    extent = high - low
+    diameter = (extent[:, 1] + extent[:, 2]) * 0.5
+    car_low = coords.min(axis=0)
+    car_high = coords.max(axis=0)
+    car_center = (car_low + car_high) * 0.5
+
+    discs = np.flatnonzero((np.abs(extent[:, 1] - extent[:, 2]) <= DISC_ROUNDNESS * diameter)
+                           & (extent[:, 0] <= DISC_THICKNESS * diameter)
+                           & (diameter >= MIN_WHEEL_SIZE * (car_high - car_low)[1]))
+    if len(discs) == 0:
+        raise ValueError("No wheel shaped parts found")
+
+    tree = kdtree.KDTree(len(discs))
+    for index, component in enumerate(discs):
+        tree.insert(centroid[component], index)
+    tree.balance()
+
+    pairs = []
+    for index, component in enumerate(discs):
+        for co, other, distance in tree.find_range(centroid[component], diameter[component] * 0.5):
+            if other != index:
+                pairs.append((index, other))
+    wheel_labels, wheel_count = ahc_mesh.connected_components(len(discs), np.array(pairs, dtype=np.int64).reshape(-1, 2))
+
+    wheels = {}
+    for wheel in range(wheel_count):
+        members = discs[wheel_labels == wheel]
+        wheel_low = low[members].min(axis=0)
+        wheel_high = high[members].max(axis=0)
+        center = (wheel_low + wheel_high) * 0.5
+        corner = ("L" if center[0] > car_center[0] else "R") + ("F" if center[1] < car_center[1] else "R")
+        size = (diameter[members].max(), sizes[members].sum())
+        if corner not in wheels or size > wheels[corner][0]:
+            wheels[corner] = (size, members)
+
+    missing = [corner for corner in ("LF", "RF", "LR", "RR") if corner not in wheels]
+    if missing:
+        raise ValueError("No wheel found at {}".format(", ".join(missing)))
+
+    return {corner: fit_wheel(coords[np.isin(labels, members)]) for corner, (size, members) in wheels.items()}
+
+def wheel_dimensions(wheels, unit_scale=1.0):
+    # Hierarchy properties measured from detect_wheels() results, in meters
+    def center(corner):
+        return wheels[corner][0] * unit_scale
+
+    front = (center("LF")[1] + center("RF")[1]) * 0.5
+    rear = (center("LR")[1] + center("RR")[1]) * 0.5
+    return {
+        "wheel_base": float(abs(rear - front)),
+        "front_track_width": float(abs(center("LF")[0] - center("RF")[0])),
+        "rear_track_width": float(abs(center("LR")[0] - center("RR")[0])),
+        "wheel_radius": float(np.mean([wheel[2] for wheel in wheels.values()])) * unit_scale,
+        "tire_width": float(np.mean([wheel[3] for wheel in wheels.values()])) * unit_scale,
+    }
+
+def component_parents(obj, components, selected, root, children=None):
+    """Picks the hierarchy node each selected component of obj belongs under.
+
+    A component whose center lies inside the display sphere of a sphere
+    empty below root (the WHEEL_* nodes) goes under that empty, everything
+    else under x0_main_body, or root when the car has none.
+    Returns {component: parent object}.
+    """
+    spheres = []
+    body = root
+    for node in ahc_mesh.iter_hierarchy(root, children):
+        if node.type != 'EMPTY':
+            continue
+        if node.empty_display_type == 'SPHERE':
+            radius = node.empty_display_size * max(node.matrix_world.to_scale())
+            spheres.append((node, np.array(tuple(node.matrix_world.translation)), radius))
+        elif node.name.startswith("x0_main_body"):
+            body = node
+
+    matrix = np.array(obj.matrix_world)
+    centers = (components.low[selected] + components.high[selected]) * 0.5
+    centers = centers @ matrix[:3, :3].T + matrix[:3, 3]
+
+    parents = {}
+    for component, center in zip(selected, centers):
+        parents[int(component)] = body
+        nearest = None
+        for node, location, radius in spheres:
+            distance = np.linalg.norm(center - location)
+            if distance <= radius and (nearest is None or distance < nearest):
+                parents[int(component)] = node
+                nearest = distance
+    return parents
+
+def sub_name_map(root):
+    # Target '{parent}_SUB#' name for every visible mesh below root. Children
+    # are named after the target name of their parent, walked without recursion.
+    children = ahc_mesh.children_map()
+    targets = {}
+    for obj in ahc_mesh.iter_hierarchy(root, children):
+        parent_name = targets.get(obj, obj.name)
+        count = 0
+        for child in children.get(obj, ()):
+            if child.type == 'MESH':
+                if child.visible_get():
+                    targets[child] = '{}_SUB{}'.format(parent_name, count)
+                    count = count + 1
+    return targets
+
+def name_conflicts(targets):
+    # Target names held by objects that are not part of the rename
+    renamed = set(targets)
+    conflicts = []
+    for name in targets.values():
+        holder = bpy.data.objects.get(name)
+        if holder is not None and holder not in renamed:
+            conflicts.append(name)
+    return conflicts
+
+def apply_names(targets, temp_prefix="ahc_rename_tmp_"):
+    """Renames objects to their target names in two phases.
+
+    Objects holding a name another object is about to take are first moved to
+    unique temporary names, so no assignment ever clashes inside the map and
+    Blender never has to resolve '.001' suffixes for them.
+    Returns the number of renamed objects.
+    """
+    pending = {obj: name for obj, name in targets.items() if obj.name != name}
+    wanted = set(pending.values())
+    existing = set(bpy.data.objects.keys())
+
+    temp_index = 0
+    for obj in pending:
+        if obj.name in wanted:
+            while temp_prefix + str(temp_index) in existing:
+                temp_index += 1
+            obj.name = temp_prefix + str(temp_index)
+            temp_index += 1
+
+    for obj, name in pending.items():
+        obj.name = name
+
+    return len(pending)
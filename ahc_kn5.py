@@ -0,0 +1,1010 @@
+import bpy
+import hashlib
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+from mathutils import Matrix
+
+from . import (ahc_materials,
+                ahc_mesh,
+                ahc_textures,
+                )
+
+KN5_MAGIC = b"sc6969"
+KN5_VERSION = 5
+
+NODE_BASE = 1
+NODE_MESH = 2
+NODE_SKINNED_MESH = 3
+
+BLEND_OPAQUE = 0
+BLEND_ALPHA_BLEND = 1
+BLEND_ALPHA_TO_COVERAGE = 2
+
+# 16-bit indices, the hard vertex limit of a single AC mesh node
+MAX_VERTICES = 65535
+
+DEFAULT_SHADER = "ksPerPixel"
+DEFAULT_MATERIAL_NAME = "ahc_default"
+
+VERTEX_DTYPE = np.dtype([
+    ("position", "<f4", 3),
+    ("normal", "<f4", 3),
+    ("uv", "<f4", 2),
+    ("tangent", "<f4", 3),
+    ])
+
+WRITE_BUFFER_SIZE = 1 << 20
+
+class Kn5Error(Exception):
+    pass
+
+# -----------------------------------------------------------------------------
+# Vertex packing
+# -----------------------------------------------------------------------------
+
+def _read_array(collection, attribute, count, width, dtype=np.float32):
+    data = np.empty(count * width, dtype=dtype)
+    collection.foreach_get(attribute, data)
+    return data.reshape(count, width) if width > 1 else data
+
+def _read_loop_normals(mesh):
+    count = len(mesh.loops)
+    if hasattr(mesh, "corner_normals"):
+        return _read_array(mesh.corner_normals, "vector", count, 3)
+    mesh.calc_normals_split()
+    return _read_array(mesh.loops, "normal", count, 3)
+
+def _triangle_tangents(positions, uvs, tri_loops, loop_count):
+    # Per-corner tangents from triangle UV derivatives, for meshes mikktspace
+    # can't handle (ngons)
+    p0, p1, p2 = (positions[tri_loops[:, i]] for i in range(3))
+    t0, t1, t2 = (uvs[tri_loops[:, i]] for i in range(3))
+    dp1, dp2 = p1 - p0, p2 - p0
+    duv1, duv2 = t1 - t0, t2 - t0
+
+    det = duv1[:, 0] * duv2[:, 1] - duv2[:, 0] * duv1[:, 1]
+    det[np.abs(det) < 1e-12] = 1.0
+    tangents = (dp1 * duv2[:, 1:2] - dp2 * duv1[:, 1:2]) / det[:, None]
+
+    loop_tangents = np.zeros((loop_count, 3), dtype=np.float64)
+    for i in range(3):
+        np.add.at(loop_tangents, tri_loops[:, i], tangents)
+    return loop_tangents
+
+def _read_loop_tangents(mesh, uv_layer, positions, uvs, tri_loops):
+    count = len(mesh.loops)
+    if uv_layer is not None:
+        try:
+            mesh.calc_tangents(uvmap=uv_layer.name)
+            return _read_array(mesh.loops, "tangent", count, 3)
+        except RuntimeError:
+            pass
+    return _triangle_tangents(positions, uvs, tri_loops, count)
+
+def _normalize_rows(rows):
+    lengths = np.linalg.norm(rows, axis=1)
+    lengths[lengths == 0.0] = 1.0
+    return rows / lengths[:, None]
+
+FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+FNV_PRIME = np.uint64(0x100000001B3)
+
+def unique_rows(rows):
+    """Groups identical packed rows, like np.unique over their bytes.
+
+    Rows are hashed to 64 bits and only the hashes are sorted, which is many
+    times faster than sorting the raw rows. Every row is then compared with
+    the first row of its hash, a collision falls back to the byte sort.
+    Returns (index of the first row per group, group per row).
+    """
+    rows = np.ascontiguousarray(rows)
+    if len(rows) and rows.dtype.itemsize % 4 == 0:
+        words = rows.view(np.uint32).reshape(len(rows), -1)
+        hashes = np.full(len(rows), FNV_OFFSET, dtype=np.uint64)
+        for column in words.T:
+            hashes ^= column
+            hashes *= FNV_PRIME
+            hashes ^= hashes >> np.uint64(29)
+        _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        if np.array_equal(words, words[first[inverse]]):
+            return first, inverse
+
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+def dedupe_vertices(rows):
+    """Collapses identical packed vertices.
+
+    Returns (unique vertices in first-use order, uint32 index per row).
+    """
+    first, inverse = unique_rows(rows)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return rows[first[order]], rank[inverse.ravel()].astype(np.uint32)
+
+def pack_loops(mesh, matrix):
+    """Packs every loop of mesh into a KN5 vertex.
+
+    matrix is applied to positions, normals and tangents. Returns (packed
+    VERTEX_DTYPE array per loop, triangle loops, triangle materials), or
+    None when mesh has no triangles. Loops with equal rows export as one
+    vertex.
+    """
+    mesh.calc_loop_triangles()
+    tri_count = len(mesh.loop_triangles)
+    if tri_count == 0:
+        return None
+
+    loop_count = len(mesh.loops)
+    tri_loops = _read_array(mesh.loop_triangles, "loops", tri_count, 3, np.int32)
+    if hasattr(mesh, "loop_triangle_polygons"):
+        tri_materials = ahc_mesh.read_face_materials(mesh)[_read_array(mesh.loop_triangle_polygons, "value", tri_count, 1, np.int32)]
+    else:
+        tri_materials = _read_array(mesh.loop_triangles, "material_index", tri_count, 1, np.int32)
+    loop_vertices = ahc_mesh.read_layer(mesh, mesh.loops, "vertex_index", ".corner_vert", 'INT', np.int32)
+    coords = ahc_mesh.read_layer(mesh, mesh.vertices, "co", "position", 'FLOAT_VECTOR', np.float32, 3).reshape(-1, 3)
+
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is not None:
+        uvs = ahc_mesh.read_layer(mesh, uv_layer.data, "uv", uv_layer.name, 'FLOAT2', np.float32, 2).reshape(-1, 2)
+    else:
+        uvs = np.zeros((loop_count, 2), dtype=np.float32)
+
+    positions = coords[loop_vertices]
+    normals = _read_loop_normals(mesh)
+    tangents = _read_loop_tangents(mesh, uv_layer, positions, uvs, tri_loops)
+
+    m = np.array(matrix, dtype=np.float64)
+    linear = m[:3, :3]
+    positions = positions @ linear.T + m[:3, 3]
+    normals = _normalize_rows(normals @ np.linalg.inv(linear))
+    tangents = _normalize_rows(tangents @ linear.T)
+    if np.linalg.det(linear) < 0:
+        tri_loops = tri_loops[:, ::-1]
+
+    packed = np.empty(loop_count, dtype=VERTEX_DTYPE)
+    packed["position"] = positions
+    packed["normal"] = normals
+    packed["uv"][:, 0] = uvs[:, 0]
+    packed["uv"][:, 1] = 1.0 - uvs[:, 1]
+    packed["tangent"] = tangents
+    return packed, tri_loops, tri_materials
+
+def pack_mesh(mesh, matrix):
+    """Packs mesh into KN5 vertex/index arrays, one chunk per material.
+
+    matrix is applied to positions, normals and tangents. Returns a list of
+    (material_index, vertices, indices) sorted by material index, vertices
+    being a VERTEX_DTYPE array and indices a flat uint32 triangle list.
+    """
+    result = pack_loops(mesh, matrix)
+    if result is None:
+        return []
+    packed, tri_loops, tri_materials = result
+
+    order = np.argsort(tri_materials, kind="stable")
+    materials, starts = np.unique(tri_materials[order], return_index=True)
+    groups = np.split(order, starts[1:])
+
+    chunks = []
+    for material_index, tris in zip(materials.tolist(), groups):
+        vertices, indices = dedupe_vertices(packed[tri_loops[tris].ravel()])
+        chunks.append((material_index, vertices, indices))
+    return chunks
+
+def vertex_ids(mesh):
+    # Id per loop of the KN5 vertex it exports as, deduplicated on the same
+    # position/normal/uv/tangent rows pack_mesh uses
+    result = pack_loops(mesh, Matrix.Identity(4))
+    if result is None:
+        return np.zeros(len(mesh.loops), dtype=np.int64)
+    return unique_rows(result[0])[1].astype(np.int64)
+
+def bounding_sphere(vertices):
+    positions = vertices["position"]
+    center = (positions.min(axis=0) + positions.max(axis=0)) * 0.5
+    radius = float(np.sqrt(((positions - center) ** 2).sum(axis=1).max()))
+    return center, radius
+
+# -----------------------------------------------------------------------------
+# Export planning
+# -----------------------------------------------------------------------------
+
+class Kn5Node:
+    __slots__ = ("node_class", "name", "matrix", "active", "vertices", "indices",
+                 "material", "visible", "transparent", "children",
+                 "cache_key", "fingerprint", "block")
+
+    def __init__(self, node_class, name, matrix=None, active=True):
+        self.node_class = node_class
+        self.name = name
+        self.matrix = matrix
+        self.active = active
+        self.vertices = None
+        self.indices = None
+        self.material = None
+        self.visible = True
+        self.transparent = False
+        self.children = []
+        # Incremental export: cache entry key, input fingerprint and the
+        # (offset, length) of an unchanged block in the previous output
+        self.cache_key = None
+        self.fingerprint = None
+        self.block = None
+
+def node_name(obj):
+    # LOD copies carry the node name of the object they were made from
+    return obj.get("ahc_node_name", obj.name)
+
+def export_space(root, scale=1.0):
+    # World to KN5 space. The root rotation is what turns the Y-up hierarchy
+    # into Blender's Z-up view, so it is undone here, while any root scale is
+    # kept so the exported car matches what is seen in the viewport.
+    location, rotation, _scale = root.matrix_world.decompose()
+    rigid = Matrix.Translation(location) @ rotation.to_matrix().to_4x4()
+    return Matrix.Scale(scale, 4) @ rigid.inverted_safe()
+
+def _object_material(obj, index):
+    if index < len(obj.material_slots):
+        return obj.material_slots[index].material
+    return None
+
+def mesh_geometry_hash(mesh, matrix):
+    # Hash of every mesh input that ends up in packed vertices, read with
+    # foreach_get only, so it costs a fraction of packing the mesh
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.array(matrix, dtype=np.float64).tobytes())
+
+    loop_count = len(mesh.loops)
+    face_count = len(mesh.polygons)
+    digest.update(_read_array(mesh.vertices, "co", len(mesh.vertices), 3).tobytes())
+    digest.update(_read_array(mesh.loops, "vertex_index", loop_count, 1, np.int32).tobytes())
+    digest.update(_read_array(mesh.polygons, "loop_start", face_count, 1, np.int32).tobytes())
+    digest.update(_read_array(mesh.polygons, "material_index", face_count, 1, np.int32).tobytes())
+    digest.update(_read_loop_normals(mesh).tobytes())
+    if mesh.uv_layers.active is not None:
+        digest.update(_read_array(mesh.uv_layers.active.data, "uv", loop_count, 2).tobytes())
+    return digest.hexdigest()
+
+def build_export_tree(root, depsgraph, scale=1.0, cache=None):
+    """Walks the hierarchy below root and packs every mesh.
+
+    When cache is a dict of entries from a previous export, mesh chunks whose
+    fingerprint matches are not packed again and reference the previous
+    block instead. Pass an empty dict to fingerprint without reusing.
+    Returns (root Kn5Node, ordered list of materials used, None for objects
+    without a material).
+    """
+    space = export_space(root, scale)
+    children = ahc_mesh.children_map()
+    materials = []
+    material_ids = {}
+
+    def material_id(mat):
+        key = mat.name_full if mat is not None else None
+        if key not in material_ids:
+            material_ids[key] = len(materials)
+            materials.append(mat)
+        return material_ids[key]
+
+    root_frame = space @ root.matrix_world
+    root_node = Kn5Node(NODE_BASE, node_name(root), root_frame)
+
+    # (object, KN5 parent node, frame of that node in KN5 space)
+    stack = [(child, root_node, root_frame) for child in reversed(children.get(root, ()))]
+    while stack:
+        obj, parent, parent_frame = stack.pop()
+        frame = space @ obj.matrix_world
+        local = parent_frame.inverted_safe() @ frame
+
+        if obj.type != 'MESH':
+            node = Kn5Node(NODE_BASE, node_name(obj), local, not obj.hide_render)
+            parent.children.append(node)
+            stack.extend((child, node, frame) for child in reversed(children.get(obj, ())))
+            continue
+
+        obj_children = children.get(obj, ())
+        obj_eval = obj.evaluated_get(depsgraph)
+        mesh = obj_eval.to_mesh()
+        try:
+            face_materials = _read_array(mesh.polygons, "material_index", len(mesh.polygons), 1, np.int32)
+            used = np.unique(face_materials).tolist()
+            grouped = len(obj_children) > 0 or len(used) > 1
+            mesh_matrix = Matrix.Identity(4) if grouped else local
+
+            nodes = []
+            for chunk_index, material_index in enumerate(used):
+                name = node_name(obj) if not grouped else '{}_SUB{}'.format(node_name(obj), chunk_index)
+                mat = _object_material(obj, material_index)
+                node = Kn5Node(NODE_MESH, name)
+                node.material = material_id(mat)
+                node.visible = not obj.hide_render
+                node.transparent = mat is not None and mat.blend_method not in ('OPAQUE', 'CLIP')
+                nodes.append((material_index, node))
+
+            if cache is not None:
+                geometry = mesh_geometry_hash(mesh, mesh_matrix)
+                for material_index, node in nodes:
+                    node.cache_key = '{}:{}'.format(obj.name_full, material_index)
+                    node.fingerprint = '{}:{}:{}:{}:{}:{}'.format(geometry, material_index, node.name,
+                                                                node.material, node.visible, node.transparent)
+                    entry = cache.get(node.cache_key)
+                    if entry is not None and entry.get("fingerprint") == node.fingerprint:
+                        node.block = (entry["offset"], entry["length"])
+
+            if any(node.block is None for material_index, node in nodes):
+                chunks = {chunk[0]: chunk for chunk in pack_mesh(mesh, mesh_matrix)}
+                for material_index, node in nodes:
+                    if node.block is not None or material_index not in chunks:
+                        continue
+                    vertices, indices = chunks[material_index][1:]
+                    if len(vertices) > MAX_VERTICES:
+                        raise Kn5Error('{} has {} vertices after splitting by material, AC meshes are limited to {}'.format(
+                            obj.name, len(vertices), MAX_VERTICES))
+                    node.vertices = vertices
+                    node.indices = indices.astype("<u2")
+        finally:
+            obj_eval.to_mesh_clear()
+
+        if grouped:
+            # Several materials or nested children: a base node carries the
+            # object transform and the chunks become its mesh children
+            group = Kn5Node(NODE_BASE, node_name(obj), local, not obj.hide_render)
+            parent.children.append(group)
+            mesh_parent, mesh_frame = group, frame
+        else:
+            mesh_parent, mesh_frame = parent, parent_frame
+
+        for material_index, node in nodes:
+            if node.block is not None or node.vertices is not None:
+                mesh_parent.children.append(node)
+
+        stack.extend((child, mesh_parent, mesh_frame) for child in reversed(obj_children))
+
+    return root_node, materials
+
+# -----------------------------------------------------------------------------
+# Materials and textures
+# -----------------------------------------------------------------------------
+
+def material_texture(mat):
+    if mat is None:
+        return None
+    images = ahc_materials.material_images(mat)
+    return images[0] if images else None
+
+def texture_source(image):
+    # (name in the KN5, file path or packed bytes, size)
+    path = ahc_textures.image_file_path(image)
+    if path is not None:
+        if not os.path.isfile(path):
+            return None
+        return os.path.basename(path), path, os.path.getsize(path)
+    if image.packed_file is not None:
+        return image.name, image.packed_file.data, image.packed_file.size
+    return None
+
+def material_block(mat, texture_name):
+    # (name, shader, blend mode, alpha tested, depth mode, properties, samplers)
+    if mat is None:
+        return (DEFAULT_MATERIAL_NAME, DEFAULT_SHADER, BLEND_OPAQUE, False, 0, [], [])
+
+    blend = BLEND_OPAQUE
+    if mat.blend_method in ('BLEND', 'HASHED'):
+        blend = BLEND_ALPHA_BLEND
+    properties = [
+        ("ksAmbient", 0.6, (0, 0), (0, 0, 0), (0, 0, 0, 0)),
+        ("ksDiffuse", 0.6, (0, 0), (0, 0, 0), (0, 0, 0, 0)),
+        ("ksSpecular", 0.0, (0, 0), (0, 0, 0), (0, 0, 0, 0)),
+        ("ksSpecularEXP", 50.0, (0, 0), (0, 0, 0), (0, 0, 0, 0)),
+        ("ksEmissive", 0.0, (0, 0), (0, 0, 0), (0, 0, 0, 0)),
+        ("ksAlphaRef", mat.alpha_threshold if mat.blend_method == 'CLIP' else 0.0, (0, 0), (0, 0, 0), (0, 0, 0, 0)),
+        ]
+    samplers = [("txDiffuse", 0, texture_name)] if texture_name is not None else []
+    return (mat.name, DEFAULT_SHADER, blend, mat.blend_method == 'CLIP', 0, properties, samplers)
+
+# -----------------------------------------------------------------------------
+# Writing
+# -----------------------------------------------------------------------------
+
+_INT = struct.Struct("<i")
+_UINT = struct.Struct("<I")
+_FLOAT = struct.Struct("<f")
+_BYTE = struct.Struct("<B")
+
+class Kn5Writer:
+    """Streams a KN5 file through a large buffered writer."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def int(self, value):
+        self.stream.write(_INT.pack(value))
+
+    def uint(self, value):
+        self.stream.write(_UINT.pack(value))
+
+    def float(self, value):
+        self.stream.write(_FLOAT.pack(value))
+
+    def floats(self, values):
+        self.stream.write(struct.pack("<{}f".format(len(values)), *values))
+
+    def bool(self, value):
+        self.stream.write(_BYTE.pack(1 if value else 0))
+
+    def byte(self, value):
+        self.stream.write(_BYTE.pack(value))
+
+    def string(self, value):
+        data = value.encode("utf-8")
+        self.int(len(data))
+        self.stream.write(data)
+
+    def array(self, array):
+        self.stream.write(memoryview(np.ascontiguousarray(array)).cast("B"))
+
+    def header(self):
+        self.stream.write(KN5_MAGIC)
+        self.int(KN5_VERSION)
+
+    def texture(self, name, source, size):
+        self.int(1)
+        self.string(name)
+        self.int(size)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.stream.write(source)
+        else:
+            with open(source, "rb") as texture_file:
+                shutil.copyfileobj(texture_file, self.stream, WRITE_BUFFER_SIZE)
+
+    def material(self, block):
+        name, shader, blend, alpha_tested, depth_mode, properties, samplers = block
+        self.string(name)
+        self.string(shader)
+        self.byte(blend)
+        self.bool(alpha_tested)
+        self.int(depth_mode)
+
+        self.int(len(properties))
+        for prop_name, value_a, value_b, value_c, value_d in properties:
+            self.string(prop_name)
+            self.float(value_a)
+            self.floats(value_b)
+            self.floats(value_c)
+            self.floats(value_d)
+
+        self.int(len(samplers))
+        for sampler_name, slot, texture_name in samplers:
+            self.string(sampler_name)
+            self.int(slot)
+            self.string(texture_name)
+
+    def node(self, node):
+        # Writes only this node's own block, children follow in preorder
+        self.int(node.node_class)
+        self.string(node.name)
+        self.int(len(node.children))
+        self.bool(node.active)
+
+        if node.node_class == NODE_BASE:
+            # KN5 matrices are row-vector (translation in the last row)
+            self.array(np.array(node.matrix, dtype="<f4").T)
+            return
+
+        self.bool(True)
+        self.bool(node.visible)
+        self.bool(node.transparent)
+        self.int(len(node.vertices))
+        self.array(node.vertices)
+        self.int(len(node.indices))
+        self.array(node.indices)
+        self.uint(node.material)
+        self.uint(0)
+        self.float(0.0)
+        self.float(0.0)
+
+        center, radius = bounding_sphere(node.vertices)
+        self.floats(center.tolist())
+        self.float(radius)
+        self.bool(True)
+
+# Bump whenever the bytes written for a mesh node change for the same inputs
+EXPORT_CACHE_VERSION = 1
+
+def export_cache_path(filepath):
+    return filepath + ".ahccache"
+
+def load_export_cache(filepath):
+    """Cache entries of the previous export to filepath.
+
+    The cache is only trusted when the output file on disk is exactly the one
+    it was written for, anything else returns None.
+    """
+    try:
+        with open(export_cache_path(filepath), encoding="utf-8") as cache_file:
+            data = json.load(cache_file)
+        stat = os.stat(filepath)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != EXPORT_CACHE_VERSION:
+        return None
+    if data.get("output") != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    return data.get("nodes", {})
+
+def save_export_cache(filepath, nodes):
+    stat = os.stat(filepath)
+    data = {
+        "version": EXPORT_CACHE_VERSION,
+        "output": [stat.st_size, stat.st_mtime_ns],
+        "nodes": nodes,
+        }
+    temp_path = export_cache_path(filepath) + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as cache_file:
+        json.dump(data, cache_file)
+    os.replace(temp_path, export_cache_path(filepath))
+
+def _copy_block(source, stream, offset, length):
+    source.seek(offset)
+    while length > 0:
+        data = source.read(min(length, WRITE_BUFFER_SIZE))
+        if not data:
+            raise Kn5Error('Previous KN5 output is shorter than its export cache')
+        stream.write(data)
+        length -= len(data)
+
+def export_kn5(filepath, root, depsgraph, scale=1.0, incremental=False):
+    """Exports the hierarchy below root to a KN5 file.
+
+    With incremental set, a sidecar cache keeps a fingerprint and the byte
+    range of every mesh node block. Mesh nodes whose geometry, transform,
+    name, flags and material id are unchanged are copied byte for byte from
+    the previous output instead of being packed again. Textures and materials
+    are always written fresh, so changing them never leaves stale data.
+    Returns (node count, mesh node count, material count, texture count,
+    reused mesh node count).
+    """
+    cache = None
+    if incremental:
+        cache = load_export_cache(filepath) or {}
+    root_node, materials = build_export_tree(root, depsgraph, scale, cache)
+
+    textures = {}
+    blocks = []
+    for mat in materials:
+        image = material_texture(mat)
+        source = texture_source(image) if image is not None else None
+        if source is not None:
+            textures.setdefault(source[0], source)
+        blocks.append(material_block(mat, source[0] if source is not None else None))
+
+    node_count = 0
+    mesh_count = 0
+    reused = 0
+    entries = {}
+    previous = None
+    temp_path = filepath + ".tmp"
+    try:
+        if cache:
+            previous = open(filepath, "rb")
+
+        with open(temp_path, "wb", buffering=WRITE_BUFFER_SIZE) as stream:
+            writer = Kn5Writer(stream)
+            writer.header()
+
+            writer.int(len(textures))
+            for name, source, size in textures.values():
+                writer.texture(name, source, size)
+
+            writer.int(len(blocks))
+            for block in blocks:
+                writer.material(block)
+
+            stack = [root_node]
+            while stack:
+                node = stack.pop()
+                offset = stream.tell()
+                if node.block is not None:
+                    _copy_block(previous, stream, *node.block)
+                    reused += 1
+                else:
+                    writer.node(node)
+
+                if node.cache_key is not None:
+                    entries[node.cache_key] = {
+                        "fingerprint": node.fingerprint,
+                        "offset": offset,
+                        "length": stream.tell() - offset,
+                        }
+
+                node_count += 1
+                if node.node_class == NODE_MESH:
+                    mesh_count += 1
+                stack.extend(reversed(node.children))
+
+        if previous is not None:
+            previous.close()
+            previous = None
+        os.replace(temp_path, filepath)
+    finally:
+        if previous is not None:
+            previous.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if incremental:
+        save_export_cache(filepath, entries)
+
+    return node_count, mesh_count, len(blocks), len(textures), reused
+
+# -----------------------------------------------------------------------------
+# Reading
+# -----------------------------------------------------------------------------
+
+SKINNED_VERTEX_DTYPE = np.dtype([
+    ("position", "<f4", 3),
+    ("normal", "<f4", 3),
+    ("uv", "<f4", 2),
+    ("tangent", "<f4", 3),
+    ("weights", "<f4", 4),
+    ("bones", "<f4", 4),
+    ])
+
+class Kn5ReadNode:
+    """A node of a memory-mapped KN5, geometry is read on access."""
+
+    __slots__ = ("kn5", "node_class", "name", "active", "matrix", "visible", "transparent",
+                 "material", "vertex_dtype", "vertex_offset", "vertex_count",
+                 "index_offset", "index_count", "children")
+
+    def __init__(self, kn5, node_class, name, active):
+        self.kn5 = kn5
+        self.node_class = node_class
+        self.name = name
+        self.active = active
+        self.matrix = None
+        self.visible = True
+        self.transparent = False
+        self.material = None
+        self.vertex_dtype = VERTEX_DTYPE
+        self.vertex_offset = 0
+        self.vertex_count = 0
+        self.index_offset = 0
+        self.index_count = 0
+        self.children = []
+
+    @property
+    def is_mesh(self):
+        return self.node_class in (NODE_MESH, NODE_SKINNED_MESH)
+
+    @property
+    def vertices(self):
+        # Zero-copy view into the mapped file
+        return np.frombuffer(self.kn5.buffer, self.vertex_dtype, self.vertex_count, self.vertex_offset)
+
+    @property
+    def indices(self):
+        return np.frombuffer(self.kn5.buffer, "<u2", self.index_count, self.index_offset)
+
+class Kn5File:
+    """Memory-mapped KN5 file.
+
+    Textures and materials are indexed when the file is opened, the node tree
+    is parsed on first access to root. Vertex and index data are only exposed
+    as NumPy views on the mapping, so listing the hierarchy never touches the
+    geometry. Views must be released before close().
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        self.buffer = memoryview(self._map)
+        self.offset = 0
+        self._root = None
+
+        try:
+            self._read_header()
+        except Kn5Error:
+            self.close()
+            raise
+        except (struct.error, UnicodeDecodeError) as err:
+            self.close()
+            raise Kn5Error('{} is not a valid KN5 file ({})'.format(filepath, err))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._map is None:
+            return
+        self._root = None
+        try:
+            self.buffer.release()
+            self._map.close()
+        except BufferError:
+            # Views are still alive, the mapping goes away with the last one
+            pass
+        self._file.close()
+        self._map = None
+
+    def _unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.buffer, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def _int(self):
+        return self._unpack("<i")[0]
+
+    def _bool(self):
+        return self._unpack("<B")[0] != 0
+
+    def _count(self, itemsize=1):
+        # Length or item count, refused when count items of at least itemsize
+        # bytes can't fit in the rest of the file
+        count = self._int()
+        if count < 0 or self.offset + count * itemsize > len(self.buffer):
+            raise Kn5Error('{} has an invalid count {} at offset {}'.format(
+                self.filepath, count, self.offset - 4))
+        return count
+
+    def _string(self):
+        length = self._count()
+        value = bytes(self.buffer[self.offset:self.offset + length]).decode("utf-8", "replace")
+        self.offset += length
+        return value
+
+    def _read_header(self):
+        if bytes(self.buffer[:len(KN5_MAGIC)]) != KN5_MAGIC:
+            raise Kn5Error('{} is not a KN5 file'.format(self.filepath))
+        self.offset = len(KN5_MAGIC)
+        self.version = self._int()
+        if self.version > 5:
+            self._int()
+
+        # name -> (offset, size), texture data is only sliced when requested
+        self.textures = {}
+        for i in range(self._count()):
+            self._int()
+            name = self._string()
+            size = self._count()
+            self.textures[name] = (self.offset, size)
+            self.offset += size
+
+        self.materials = []
+        for i in range(self._count()):
+            material = {
+                "name": self._string(),
+                "shader": self._string(),
+                "blend": self._unpack("<B")[0],
+                "alpha_tested": self._bool(),
+                "depth_mode": self._int(),
+                "properties": {},
+                "samplers": [],
+                }
+            for j in range(self._count()):
+                # The name comes first, a subscript target is evaluated after the value
+                property_name = self._string()
+                material["properties"][property_name] = self._unpack("<f2f3f4f")
+            for j in range(self._count()):
+                material["samplers"].append((self._string(), self._int(), self._string()))
+            self.materials.append(material)
+
+        self.nodes_offset = self.offset
+
+    def texture_data(self, name):
+        offset, size = self.textures[name]
+        return self.buffer[offset:offset + size]
+
+    def material_texture(self, material, sampler="txDiffuse"):
+        for sampler_name, slot, texture_name in material["samplers"]:
+            if sampler_name == sampler and texture_name in self.textures:
+                return texture_name
+        return None
+
+    def _read_node(self):
+        node_class = self._int()
+        name = self._string()
+        child_count = self._count()
+        node = Kn5ReadNode(self, node_class, name, self._bool())
+
+        if node_class == NODE_BASE:
+            node.matrix = Matrix(np.frombuffer(self.buffer, "<f4", 16, self.offset).reshape(4, 4).T.tolist())
+            self.offset += 64
+            return node, child_count
+
+        self._bool()
+        node.visible = self._bool()
+        node.transparent = self._bool()
+
+        if node_class == NODE_SKINNED_MESH:
+            for i in range(self._count(64)):
+                self._string()
+                self.offset += 64
+            node.vertex_dtype = SKINNED_VERTEX_DTYPE
+
+        node.vertex_count = self._count(node.vertex_dtype.itemsize)
+        node.vertex_offset = self.offset
+        self.offset += node.vertex_count * node.vertex_dtype.itemsize
+
+        node.index_count = self._count(2)
+        node.index_offset = self.offset
+        self.offset += node.index_count * 2
+
+        node.material = self._unpack("<I")[0]
+        self._int()
+        if node_class == NODE_SKINNED_MESH:
+            self.offset += 8
+        else:
+            self.offset += 8 + 16 + 1
+        return node, child_count
+
+    @property
+    def root(self):
+        if self._root is None:
+            self.offset = self.nodes_offset
+            try:
+                root, child_count = self._read_node()
+                stack = [(root, child_count)]
+                while stack:
+                    parent, remaining = stack[-1]
+                    if remaining == 0:
+                        stack.pop()
+                        continue
+                    stack[-1] = (parent, remaining - 1)
+                    node, child_count = self._read_node()
+                    parent.children.append(node)
+                    stack.append((node, child_count))
+            except (struct.error, ValueError, UnicodeDecodeError) as err:
+                raise Kn5Error('{} has a corrupt node tree ({})'.format(self.filepath, err))
+            self._root = root
+        return self._root
+
+    def iter_nodes(self):
+        # (node, depth) in file order
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            stack.extend((child, depth + 1) for child in reversed(node.children))
+
+# -----------------------------------------------------------------------------
+# Import
+# -----------------------------------------------------------------------------
+
+def _import_texture(kn5, name, images):
+    # Decoded through a temporary file and packed, only when first referenced
+    if name in images:
+        return images[name]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, os.path.basename(name) or "texture")
+        with open(path, "wb") as texture_file:
+            texture_file.write(kn5.texture_data(name))
+        image = bpy.data.images.load(path, check_existing=False)
+        image.name = name
+        image.pack()
+        image.filepath_raw = "//" + os.path.basename(path)
+
+    images[name] = image
+    return image
+
+def _import_material(kn5, index, materials, images):
+    if index in materials:
+        return materials[index]
+    if index >= len(kn5.materials):
+        raise Kn5Error('{} uses material {} of {}'.format(kn5.filepath, index, len(kn5.materials)))
+
+    material = kn5.materials[index]
+    mat = ahc_materials.build_material(material["name"])
+    if material["alpha_tested"]:
+        mat.blend_method = 'CLIP'
+    elif material["blend"] == BLEND_ALPHA_BLEND:
+        mat.blend_method = 'BLEND'
+
+    texture_name = kn5.material_texture(material)
+    if texture_name is not None:
+        tex_node = next(node for node in mat.node_tree.nodes if node.type == 'TEX_IMAGE')
+        tex_node.image = _import_texture(kn5, texture_name, images)
+
+    materials[index] = mat
+    return mat
+
+def build_mesh(name, vertices, indices):
+    """Creates a triangle mesh from KN5 vertex and index arrays in bulk."""
+    mesh = bpy.data.meshes.new(name)
+    loop_count = indices.size - indices.size % 3
+    indices = indices[:loop_count].astype(np.int32)
+    tri_count = loop_count // 3
+
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(vertices["position"]).ravel())
+
+    mesh.loops.add(loop_count)
+    mesh.loops.foreach_set("vertex_index", indices)
+
+    mesh.polygons.add(tri_count)
+    mesh.polygons.foreach_set("loop_start", np.arange(0, loop_count, 3, dtype=np.int32))
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", np.full(tri_count, 3, dtype=np.int32))
+    mesh.polygons.foreach_set("use_smooth", np.ones(tri_count, dtype=bool))
+
+    uvs = np.array(vertices["uv"][indices], dtype=np.float32)
+    uvs[:, 1] = 1.0 - uvs[:, 1]
+    uv_layer = mesh.uv_layers.new(name="UVMap")
+    uv_layer.data.foreach_set("uv", uvs.ravel())
+
+    mesh.update(calc_edges=True)
+    mesh.validate(clean_customdata=False)
+
+    if hasattr(mesh, "use_auto_smooth"):
+        mesh.use_auto_smooth = True
+    if len(mesh.vertices) == len(vertices):
+        mesh.normals_split_custom_set_from_vertices(np.ascontiguousarray(vertices["normal"]).tolist())
+    return mesh
+
+def import_kn5(filepath, collection):
+    """Imports a KN5 as objects linked to collection.
+
+    The top node gets the same 90 degree X rotation as the hierarchy builder's
+    root, so imported cars line up with generated hierarchies. Returns
+    (root object, object count).
+    """
+    materials = {}
+    images = {}
+    count = 0
+
+    with Kn5File(filepath) as kn5:
+        root = None
+        stack = [(kn5.root, None)]
+        while stack:
+            node, parent = stack.pop()
+
+            if node.is_mesh:
+                vertices = node.vertices
+                indices = node.indices
+                if indices.size and int(indices.max()) >= len(vertices):
+                    raise Kn5Error('{} node {} indexes vertex {} of {}'.format(
+                        kn5.filepath, node.name, int(indices.max()), len(vertices)))
+                mat = _import_material(kn5, node.material, materials, images)
+                mesh = build_mesh(node.name, vertices, indices)
+                del vertices, indices
+                mesh.materials.append(mat)
+                obj = bpy.data.objects.new(node.name, mesh)
+            else:
+                obj = bpy.data.objects.new(node.name, None)
+                obj.empty_display_size = 0.01
+                obj.matrix_basis = node.matrix
+
+            obj.hide_render = not node.active
+            collection.objects.link(obj)
+            if parent is None:
+                root = obj
+                obj.matrix_basis = Matrix.Rotation(math.radians(90), 4, 'X') @ obj.matrix_basis
+            else:
+                obj.parent = parent
+            count += 1
+
+            stack.extend((child, obj) for child in reversed(node.children))
+
+    return root, count
@@ -0,0 +1,374 @@
+import bpy
+import importlib.util
+import os
+import site
+import sys
+import threading
+import numpy as np
+
+from concurrent.futures import (ProcessPoolExecutor,
+                                ThreadPoolExecutor,
+                                )
+from multiprocessing import (get_context,
+                             shared_memory,
+                             )
+
+from . import ahc_decimate
+from . import ahc_kn5
+from . import ahc_mesh
+
+from mathutils import Vector
+
+# Spawned workers have no bpy and can't import this package, so tasks refer
+# to the decimator as the top level module WORKER_MODULE. The pool
+# initializer adds the add-on folder to the sys.path of the workers only.
+WORKER_MODULE = "ahc_decimate"
+_addon_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Before 2.91 sys.executable is Blender itself and can't run spawned workers,
+# decimation then runs on threads in the Blender process.
+PROCESS_WORKERS_VERSION = (2, 91, 0)
+
+LOD_LEVELS = ("LOD_B", "LOD_C", "LOD_D")
+
+# Smallest triangle target handed to the decimator per mesh
+MIN_TRIANGLES = 12
+
+# Meshes read and submitted per poll(), so the UI stays responsive
+READS_PER_POLL = 4
+
+def read_triangles(mesh):
+    """Reads the loop triangles of mesh.
+
+    Returns (positions, triangles, triangle loops, triangle polygons).
+    """
+    mesh.calc_loop_triangles()
+    count = len(mesh.loop_triangles)
+    positions = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    triangles = np.empty(count * 3, dtype=np.int32)
+    loops = np.empty(count * 3, dtype=np.int32)
+    polygons = np.empty(count, dtype=np.int32)
+    mesh.vertices.foreach_get("co", positions)
+    mesh.loop_triangles.foreach_get("vertices", triangles)
+    mesh.loop_triangles.foreach_get("loops", loops)
+    mesh.loop_triangles.foreach_get("polygon_index", polygons)
+    return positions.reshape(-1, 3), triangles.reshape(-1, 3), loops.reshape(-1, 3), polygons
+
+# Node the screen space importance of the car's parts is estimated from
+EYE_NODE = "COCKPIT_HR"
+
+def node_triangles(root, children=None):
+    # (object, triangle count) for every mesh object below root
+    return [(obj, ahc_mesh.triangle_count(obj.data))
+            for obj in ahc_mesh.iter_hierarchy(root, children) if obj.type == 'MESH']
+
+def collection_triangles(collection):
+    return sum(ahc_mesh.triangle_count(obj.data) for obj in collection.all_objects if obj.type == 'MESH')
+
+def world_bounds(obj):
+    corners = np.array([tuple(obj.matrix_world @ Vector(corner)) for corner in obj.bound_box])
+    return corners.min(axis=0), corners.max(axis=0)
+
+def node_importance(objects, root, children=None):
+    """Estimates how much screen space each object covers from the cockpit.
+
+    Importance is the world bounding box diagonal over the distance from the
+    box center to the COCKPIT_HR node (the root when there is none). The
+    distance is clamped to half the median object size, so parts right
+    around the eye point don't take the whole budget.
+    """
+    eye = root.matrix_world.translation
+    for obj in ahc_mesh.iter_hierarchy(root, children):
+        if ahc_kn5.node_name(obj) == EYE_NODE:
+            eye = obj.matrix_world.translation
+            break
+    eye = np.array(tuple(eye))
+
+    sizes = np.empty(len(objects))
+    distances = np.empty(len(objects))
+    for index, obj in enumerate(objects):
+        low, high = world_bounds(obj)
+        sizes[index] = np.linalg.norm(high - low)
+        distances[index] = np.linalg.norm((low + high) * 0.5 - eye)
+
+    if len(objects) == 0:
+        return sizes
+    nearest = max(float(np.median(sizes)) * 0.5, 1e-6)
+    return np.maximum(sizes, 1e-9) / np.maximum(distances, nearest)
+
+def decimation_ratios(counts, weights, budget):
+    """Keep ratios r = min(1, k * weight) whose kept triangles fill budget.
+
+    counts are the triangles each entry adds to the total. k is found by
+    bisection, so important entries keep their full detail first and the
+    rest shares what is left in proportion to their weight.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if counts.sum() <= budget:
+        return np.ones(len(counts))
+
+    low, high = 0.0, 1.0 / weights.min()
+    for _ in range(60):
+        k = (low + high) * 0.5
+        if (np.minimum(1.0, k * weights) * counts).sum() > budget:
+            high = k
+        else:
+            low = k
+    return np.minimum(1.0, low * weights)
+
+def budget_plan(root, children=None):
+    """Collects the unique meshes below root for triangle budgeting.
+
+    Returns (meshes, triangle counts, instance counts, weights) where the
+    weight of a mesh is the highest importance of the objects using it.
+    """
+    nodes = node_triangles(root, children)
+    importance = node_importance([obj for obj, count in nodes], root, children)
+
+    meshes = []
+    index = {}
+    counts = []
+    instances = []
+    weights = []
+    for (obj, count), weight in zip(nodes, importance):
+        if obj.data not in index:
+            index[obj.data] = len(meshes)
+            meshes.append(obj.data)
+            counts.append(count)
+            instances.append(0)
+            weights.append(weight)
+        i = index[obj.data]
+        instances[i] += 1
+        weights[i] = max(weights[i], weight)
+    return meshes, np.array(counts, dtype=np.int64), np.array(instances, dtype=np.int64), np.array(weights)
+
+def allocate_targets(plan, budget):
+    # Triangle target per mesh, every instance of a mesh counts against the budget
+    meshes, counts, instances, weights = plan
+    if len(meshes) == 0:
+        return {}
+    ratios = decimation_ratios(counts * instances, weights, budget)
+    return {mesh: int(min(count, max(MIN_TRIANGLES, ratio * count)))
+            for mesh, count, ratio in zip(meshes, counts, ratios)}
+
+def worker_decimator():
+    """The decimator module under the name the spawned workers import.
+
+    Tasks are pickled by module name, so the copy submitted to the process
+    pool is registered as WORKER_MODULE in sys.modules until unregister().
+    """
+    module = sys.modules.get(WORKER_MODULE)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(WORKER_MODULE, ahc_decimate.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[WORKER_MODULE] = module
+    return module
+
+def use_process_workers():
+    return bpy.app.version >= PROCESS_WORKERS_VERSION
+
+def build_lod_mesh(name, mesh, topology, loops, polygons, result):
+    # Mesh from decimated triangles, UVs and materials come from the source
+    # triangle corner every output corner collapsed from
+    positions, triangles, source, corners = result
+    count = len(triangles)
+    source_loops = np.take_along_axis(loops[source], corners.astype(np.intp), axis=1).ravel()
+    source_polygons = polygons[source]
+
+    lod_topology = {
+        "co": positions,
+        "loop_vertex": triangles.ravel(),
+        "loop_start": np.arange(0, count * 3, 3, dtype=np.int32),
+        "loop_total": np.full(count, 3, dtype=np.int32),
+        "material_index": topology["material_index"][source_polygons],
+        "use_smooth": topology["use_smooth"][source_polygons],
+        "uvs": {uv_name: uvs[source_loops] for uv_name, uvs in topology["uvs"].items()},
+        }
+    return ahc_mesh.build_mesh(name, [(lod_topology, None, None)], list(mesh.materials))
+
+def clear_collection(collection):
+    meshes = set()
+    for obj in list(collection.objects):
+        if obj.type == 'MESH':
+            meshes.add(obj.data)
+        bpy.data.objects.remove(obj)
+    for mesh in meshes:
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+
+def lod_collection_name(root, level):
+    base = root.users_collection[0].name if root.users_collection else root.name
+    return '{}_{}'.format(base, level)
+
+def lod_collection(scene, root, level):
+    # LOD collection of root, emptied when it already exists
+    name = lod_collection_name(root, level)
+    collection = bpy.data.collections.get(name)
+    if collection is None:
+        collection = bpy.data.collections.new(name)
+        scene.collection.children.link(collection)
+    else:
+        clear_collection(collection)
+    return collection
+
+def build_lod_hierarchy(scene, root, level, meshes, children=None):
+    """Copies the hierarchy below root into the collection of an LOD level.
+
+    Mesh objects get the mesh of meshes[obj.data] when there is one. Copies
+    are named '{node}.{level}' and keep their node name in 'ahc_node_name',
+    so the exported LOD uses the same node names as LOD_A.
+    Returns the copy of root.
+    """
+    collection = lod_collection(scene, root, level)
+    copies = {}
+    for obj in ahc_mesh.iter_hierarchy(root, children):
+        copy = obj.copy()
+        node_name = ahc_kn5.node_name(obj)
+        copy["ahc_node_name"] = node_name
+        copy.name = '{}.{}'.format(node_name, level)
+        if obj.type == 'MESH':
+            copy.data = meshes.get(obj.data, obj.data)
+        collection.objects.link(copy)
+        if obj.parent in copies:
+            copy.parent = copies[obj.parent]
+        copies[obj] = copy
+    return copies[root]
+
+class LodGenerator:
+    """Builds LOD_B/C/D copies of a hierarchy with decimation in worker processes.
+
+    Every mesh is written once to a shared memory block, and one task per
+    mesh and level decimates it in a spawned process, largest meshes first.
+    Where Blender can't spawn Python processes the tasks run on threads
+    instead. poll() runs on the main thread, reading and submitting a few
+    meshes per call, turning finished results into meshes, and builds the
+    LOD hierarchies when everything is done.
+    """
+
+    def __init__(self, scene, root, budgets, workers=None):
+        self.scene = scene
+        self.root = root
+        self.budgets = budgets
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._children = None
+        self._blocks = {}
+        self._arrays = {}
+        self._sources = {}
+        self._futures = {}
+        # (triangle count, mesh, [(level, target)]) still to read, largest first
+        self._pending = []
+        self._results = {level: {} for level in budgets}
+        self.task_count = 0
+        self.finished_count = 0
+
+    @property
+    def progress(self):
+        if self.task_count == 0:
+            return 1.0
+        return self.finished_count / self.task_count
+
+    def start(self):
+        # Plans the tasks from the triangle counts, meshes are read in poll()
+        self._children = ahc_mesh.children_map()
+        plan = budget_plan(self.root, self._children)
+        targets = {level: allocate_targets(plan, budget) for level, budget in self.budgets.items()}
+        for mesh, count in zip(plan[0], plan[1]):
+            levels = [(level, targets[level][mesh]) for level in self.budgets if targets[level][mesh] < count]
+            if levels:
+                self._pending.append((count, mesh, levels))
+        self._pending.sort(key=lambda entry: entry[0], reverse=True)
+
+        self.task_count = sum(len(levels) for count, mesh, levels in self._pending)
+        if self.task_count == 0:
+            return
+        workers = min(self.workers, self.task_count)
+        if use_process_workers():
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                                 initializer=site.addsitedir, initargs=(_addon_dir,))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _submit(self, mesh, levels):
+        positions, triangles, loops, polygons = read_triangles(mesh)
+        self._sources[mesh] = (ahc_mesh.read_mesh_topology(mesh), loops, polygons)
+        if not use_process_workers():
+            self._arrays[mesh] = (positions, triangles)
+            for level, target in levels:
+                future = self._executor.submit(ahc_decimate.decimate, positions, triangles, target)
+                self._futures[future] = (mesh, level)
+            return
+
+        block = shared_memory.SharedMemory(create=True, size=positions.nbytes + triangles.nbytes)
+        shared_positions, shared_triangles = ahc_decimate.shared_arrays(block, len(positions), len(triangles))
+        shared_positions[:] = positions
+        shared_triangles[:] = triangles
+        del shared_positions, shared_triangles
+        self._blocks[mesh] = (block, len(positions), len(triangles))
+        decimator = worker_decimator()
+        for level, target in levels:
+            future = self._executor.submit(decimator.decimate_shared, block.name,
+                                           len(positions), len(triangles), target)
+            self._futures[future] = (mesh, level)
+
+    def poll(self):
+        # Submits the next few meshes and collects finished tasks,
+        # True once all LOD hierarchies are built
+        for count, mesh, levels in self._pending[:READS_PER_POLL]:
+            self._submit(mesh, levels)
+        del self._pending[:READS_PER_POLL]
+
+        for future in [future for future in self._futures if future.done()]:
+            mesh, level = self._futures.pop(future)
+            topology, loops, polygons = self._sources[mesh]
+            self._results[level][mesh] = build_lod_mesh('{}.{}'.format(mesh.name, level), mesh,
+                                                        topology, loops, polygons, future.result())
+            self.finished_count += 1
+
+        if self._futures or self._pending:
+            return False
+
+        self._release()
+        for level in self.budgets:
+            build_lod_hierarchy(self.scene, self.root, level, self._results[level], self._children)
+        return True
+
+    def cancel(self):
+        for future in self._futures:
+            future.cancel()
+        self._futures = {}
+        self._pending = []
+        self._release()
+        for meshes in self._results.values():
+            for mesh in meshes.values():
+                bpy.data.meshes.remove(mesh)
+        self._results = {level: {} for level in self.budgets}
+
+    def _release(self):
+        # Tasks already handed to a worker can't be cancelled and may still
+        # open their shared memory block, so the blocks are unlinked once the
+        # pool has shut down, on a thread to keep the UI responsive
+        blocks = [block for block, vertex_count, triangle_count in self._blocks.values()]
+        if self._executor is not None:
+            threading.Thread(target=shutdown_pool, args=(self._executor, blocks)).start()
+        else:
+            release_blocks(blocks)
+        self._executor = None
+        self._blocks = {}
+        self._arrays = {}
+        self._sources = {}
+
+def release_blocks(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def shutdown_pool(executor, blocks):
+    # Waits for the running tasks, queued ones were cancelled with their futures
+    executor.shutdown(wait=True)
+    release_blocks(blocks)
+
+def unregister():
+    sys.modules.pop(WORKER_MODULE, None)
@@ -0,0 +1,159 @@
+import bpy
+import numpy as np
+
+from . import ahc_textures
+
+def build_material(name):
+    mat = bpy.data.materials.new(name=name)
+    mat.use_nodes = True
+    #setup the node_tree and links as you would manually on shader Editor
+    #to define an image texture for a material
+    principled_BSDF = mat.node_tree.nodes.get('Principled BSDF')
+
+    tex_node = mat.node_tree.nodes.new('ShaderNodeTexImage')
+    mat.node_tree.links.new(tex_node.outputs[0], principled_BSDF.inputs[0])
+    principled_BSDF.inputs[0].show_expanded = True
+    return mat
+
+def ensure_materials(names):
+    """Creates the materials of names that don't exist yet.
+
+    Only one node tree is built, every other missing material is a copy of
+    it. Existing materials are left untouched, so repeat runs create nothing.
+    Returns the created materials.
+    """
+    existing = set(bpy.data.materials.keys())
+    missing = []
+    for name in names:
+        if name not in existing:
+            existing.add(name)
+            missing.append(name)
+
+    if not missing:
+        return []
+
+    template = build_material(missing[0])
+    created = [template]
+    for name in missing[1:]:
+        mat = template.copy()
+        mat.name = name
+        created.append(mat)
+
+    for mat in created:
+        if(mat.name.endswith(("_AT", "_Alpha"))):
+            mat.blend_method = 'BLEND'
+
+    return created
+
+def ensure_gl_material():
+    if(bpy.data.materials.get("GL") is None):
+        gl_mat = bpy.data.materials.new(name="GL")
+        gl_mat.use_nodes = True
+        return gl_mat
+    return None
+
+ALPHA_SAMPLES = 65536
+OPAQUE_ALPHA = 0.99
+BINARY_TOLERANCE = 0.05
+BLEND_FRACTION = 0.02
+
+BLEND_ORDER = ('OPAQUE', 'CLIP', 'BLEND')
+
+# Alpha classification per image, keyed on image_cache_key()
+_alpha_cache = {}
+
+def image_cache_key(image):
+    if image.is_dirty:
+        return None
+    path = ahc_textures.image_file_path(image)
+    if path is not None:
+        stat = ahc_textures.stat_image(image, path)
+        return None if stat is None else (path, image.alpha_mode) + stat
+    if image.packed_file is not None:
+        return (image.name_full, image.alpha_mode, image.packed_file.size)
+    return None
+
+def classify_image_alpha(image, buffer=None):
+    """Classifies the alpha of image as 'OPAQUE', 'CLIP' or 'BLEND'.
+
+    Pixels are read with a single foreach_get into a reusable float32 buffer
+    and the alpha channel is sampled with a stride of about ALPHA_SAMPLES
+    pixels. Mostly 0/1 alpha is alpha-test, anything softer is alpha-blend.
+    Returns (classification, buffer), classification is None for images
+    without pixel data, such as missing files.
+    """
+    # Reading size loads the image, has_data is only reliable after it
+    width, height = image.size
+    if not image.has_data or width * height == 0:
+        return None, buffer
+    channels = image.channels
+    if channels < 4 or image.alpha_mode == 'NONE':
+        return 'OPAQUE', buffer
+
+    count = width * height * channels
+    if buffer is None or buffer.size < count:
+        buffer = np.empty(count, dtype=np.float32)
+    pixels = buffer[:count]
+    image.pixels.foreach_get(pixels)
+
+    stride = max(1, (width * height) // ALPHA_SAMPLES)
+    alpha = pixels[3::channels * stride]
+
+    if alpha.min() >= OPAQUE_ALPHA:
+        return 'OPAQUE', buffer
+
+    soft = np.count_nonzero((alpha > BINARY_TOLERANCE) & (alpha < 1.0 - BINARY_TOLERANCE))
+    if soft <= BLEND_FRACTION * alpha.size:
+        return 'CLIP', buffer
+    return 'BLEND', buffer
+
+def material_images(mat):
+    # Images feeding the base color or alpha, else every image in the tree
+    if mat.node_tree is None:
+        return []
+
+    tex_nodes = [node for node in mat.node_tree.nodes if node.type == 'TEX_IMAGE' and node.image is not None]
+    linked = set()
+    for link in mat.node_tree.links:
+        if link.from_node in tex_nodes and link.to_socket.name in ('Base Color', 'Alpha'):
+            linked.add(link.from_node)
+
+    nodes = [node for node in tex_nodes if node in linked] or tex_nodes
+    return list({node.image.name_full: node.image for node in nodes}.values())
+
+def detect_blend_modes(materials=None):
+    """Sets blend_method of each material from the alpha of its images.
+
+    Materials without images, or whose images have no pixel data, are left
+    untouched. Returns a dict with the number of materials set to each blend
+    method.
+    """
+    if materials is None:
+        materials = bpy.data.materials
+
+    counts = dict.fromkeys(BLEND_ORDER, 0)
+    buffer = None
+    for mat in materials:
+        images = material_images(mat)
+        if not images:
+            continue
+
+        blend = None
+        for image in images:
+            key = image_cache_key(image)
+            classification = _alpha_cache.get(key) if key is not None else None
+            if classification is None:
+                classification, buffer = classify_image_alpha(image, buffer)
+                if classification is None:
+                    continue
+                if key is not None:
+                    _alpha_cache[key] = classification
+            blend = classification if blend is None else max(blend, classification, key=BLEND_ORDER.index)
+
+        if blend is None:
+            continue
+        if mat.blend_method != blend:
+            mat.blend_method = blend
+        counts[blend] += 1
+
+    return counts
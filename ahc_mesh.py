@@ -0,0 +1,1225 @@
+import bpy
+import hashlib
+import numpy as np
+
+from mathutils import (Matrix,
+                        Vector,
+                        )
+
+# Geometry generation per mesh datablock, keyed on as_pointer(). Bumped by the
+# depsgraph handler whenever Blender reports a geometry update, so any cache
+# keyed on mesh_fingerprint() is invalidated by edits without rehashing data.
+_geometry_generation = {}
+
+# Bumped on every depsgraph update, for caches that depend on more than one
+# mesh, like the triangle totals of a whole hierarchy.
+_depsgraph_generation = 0
+
+def depsgraph_generation():
+    return _depsgraph_generation
+
+def mesh_fingerprint(mesh):
+    pointer = mesh.as_pointer()
+    return (pointer,
+            mesh.name,
+            len(mesh.vertices),
+            len(mesh.polygons),
+            _geometry_generation.get(pointer, 0))
+
+@bpy.app.handlers.persistent
+def _on_depsgraph_update(scene, depsgraph):
+    global _depsgraph_generation
+    _depsgraph_generation += 1
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+
+        datablock = update.id.original
+        if isinstance(datablock, bpy.types.Object):
+            if datablock.type != 'MESH':
+                continue
+            datablock = datablock.data
+        if isinstance(datablock, bpy.types.Mesh):
+            pointer = datablock.as_pointer()
+            _geometry_generation[pointer] = _geometry_generation.get(pointer, 0) + 1
+
+def read_vertex_coords(mesh, buffer=None):
+    # Pulls vertex coordinates into an (n, 3) view of buffer (grown as needed)
+    count = len(mesh.vertices)
+    if buffer is None or buffer.size < count * 3:
+        buffer = np.empty(count * 3, dtype=np.float64)
+
+    flat = buffer[:count * 3]
+    mesh.vertices.foreach_get("co", flat)
+    return flat.reshape(count, 3), buffer
+
+def transform_coords(coords, matrix):
+    # In-place affine transform of an (n, 3) coordinate array
+    m = np.array(matrix, dtype=np.float64)
+    coords[:] = coords @ m[:3, :3].T
+    coords += m[:3, 3]
+    return coords
+
+def children_map():
+    # Object.children scans every object in the file on each access, so large
+    # trees are walked through a parent -> children map built in one pass.
+    children = {}
+    for obj in bpy.data.objects:
+        if obj.parent is not None:
+            children.setdefault(obj.parent, []).append(obj)
+    return children
+
+def iter_hierarchy(root, children=None):
+    # Depth-first, parents before children, without recursion
+    if children is None:
+        children = children_map()
+
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        yield obj
+        stack.extend(reversed(children.get(obj, ())))
+
+class MeshCenterEngine:
+    """Computes mesh centers from a shared coordinate buffer with caching"""
+
+    MODES = ('MEDIAN', 'BOUNDS')
+    SPACES = ('LOCAL', 'WORLD')
+
+    CACHE_LIMIT = 4096
+
+    def __init__(self):
+        self._buffer = np.empty(0, dtype=np.float64)
+        self._cache = {}
+
+    def clear(self):
+        self._buffer = np.empty(0, dtype=np.float64)
+        self._cache.clear()
+
+    def center(self, obj, mode='MEDIAN', space='LOCAL'):
+        mesh = obj.data
+        if len(mesh.vertices) == 0:
+            return None
+
+        key = (mesh_fingerprint(mesh), mode, space)
+        if space == 'WORLD':
+            # World space depends on the object transform, not only on the mesh
+            key += (tuple(v for row in obj.matrix_world for v in row),)
+
+        center = self._cache.get(key)
+        if center is None:
+            coords, self._buffer = read_vertex_coords(mesh, self._buffer)
+            if space == 'WORLD':
+                transform_coords(coords, obj.matrix_world)
+
+            if mode == 'BOUNDS':
+                center = (coords.min(axis=0) + coords.max(axis=0)) * 0.5
+            else:
+                center = coords.mean(axis=0)
+
+            center = tuple(center.tolist())
+            if len(self._cache) >= self.CACHE_LIMIT:
+                self._cache.clear()
+            self._cache[key] = center
+
+        return Vector(center)
+
+center_engine = MeshCenterEngine()
+
+def _matrix_key(matrix):
+    return tuple(round(v, 6) for row in matrix for v in row)
+
+def transform_mesh_data(mesh, matrix, buffer=None):
+    # Applies matrix to the vertex and shape key coordinates of mesh in place
+    coords, buffer = read_vertex_coords(mesh, buffer)
+    transform_coords(coords, matrix)
+    mesh.vertices.foreach_set("co", coords.ravel())
+
+    if mesh.shape_keys is not None:
+        for key_block in mesh.shape_keys.key_blocks:
+            coords = buffer[:len(key_block.data) * 3]
+            key_block.data.foreach_get("co", coords)
+            coords = coords.reshape(-1, 3)
+            transform_coords(coords, matrix)
+            key_block.data.foreach_set("co", coords.ravel())
+
+    if matrix.to_3x3().determinant() < 0 and hasattr(mesh, "flip_normals"):
+        mesh.flip_normals()
+
+    mesh.update()
+    return buffer
+
+def bake_scale(root):
+    """Bakes the scale of root and all nested children into their data.
+
+    Every object ends up with unit scale while keeping its world placement.
+    Mesh datablocks are transformed once per distinct bake matrix, shared
+    meshes needing different matrices (or used outside the hierarchy) are
+    copied first. Never touches selection or calls operators.
+    Returns the number of datablocks that were transformed.
+    """
+    identity_key = _matrix_key(Matrix.Identity(4))
+    old_world = {}
+    new_world = {}
+    data_users = {}
+
+    for obj in iter_hierarchy(root):
+        if obj is not root and obj.parent in old_world:
+            parent_old = old_world[obj.parent]
+            parent_new = new_world[obj.parent]
+        else:
+            parent_old = obj.parent.matrix_world.copy() if obj.parent else Matrix.Identity(4)
+            parent_new = parent_old
+
+        # matrix_world may be stale here, so rebuild it from the parent chain
+        world = parent_old @ obj.matrix_parent_inverse @ obj.matrix_basis
+        old_world[obj] = world
+
+        if obj.type == 'EMPTY' or obj.type == 'MESH' or hasattr(obj.data, "transform"):
+            location, rotation, scale = world.decompose()
+            rigid = Matrix.Translation(location) @ rotation.to_matrix().to_4x4()
+            bake = rigid.inverted_safe() @ world
+
+            if obj.type == 'EMPTY':
+                obj.empty_display_size *= max(column.length for column in bake.to_3x3().col)
+            else:
+                data_users.setdefault(obj.data, []).append((obj, bake))
+        else:
+            # Data that can't be transformed keeps its scale
+            rigid = world
+
+        new_world[obj] = rigid
+        obj.matrix_basis = (parent_new @ obj.matrix_parent_inverse).inverted_safe() @ rigid
+
+    buffer = None
+    transformed = 0
+    for data, users in data_users.items():
+        groups = {}
+        for obj, bake in users:
+            groups.setdefault(_matrix_key(bake), (bake, []))[1].append(obj)
+
+        # The original datablock is only reused when every user gets the
+        # same transform, anything else transforms a copy.
+        shared_outside = data.users - (1 if data.use_fake_user else 0) > len(users)
+        reuse = not shared_outside and identity_key not in groups
+        for key, (bake, group) in groups.items():
+            if key == identity_key:
+                continue
+
+            target = data if reuse else data.copy()
+            reuse = False
+            for obj in group:
+                if obj.data != target:
+                    obj.data = target
+
+            if isinstance(target, bpy.types.Mesh):
+                buffer = transform_mesh_data(target, bake, buffer)
+            else:
+                target.transform(bake)
+            transformed += 1
+
+    return transformed
+
+# Generic attribute data type -> (foreach key, width, dtype)
+ATTRIBUTE_TYPES = {
+    'FLOAT': ("value", 1, np.float32),
+    'INT': ("value", 1, np.int32),
+    'INT8': ("value", 1, np.int32),
+    'BOOLEAN': ("value", 1, bool),
+    'FLOAT2': ("vector", 2, np.float32),
+    'FLOAT_VECTOR': ("vector", 3, np.float32),
+    'FLOAT_COLOR': ("color", 4, np.float32),
+    'BYTE_COLOR': ("color", 4, np.float32),
+    'INT32_2D': ("value", 2, np.int32),
+    'QUATERNION': ("value", 4, np.float32),
+}
+
+def _attribute(mesh, name, data_type):
+    # The attribute storing a layer, when the running Blender has one
+    attributes = getattr(mesh, "attributes", None)
+    attribute = attributes.get(name) if attributes is not None else None
+    if attribute is None or attribute.data_type != data_type:
+        return None
+    return attribute
+
+def read_layer(mesh, collection, prop, attribute_name, data_type, dtype, width=1):
+    # Reads a per element property of mesh. Layers Blender stores as
+    # attributes are copied raw from them, RNA access is only the fallback.
+    values = np.empty(len(collection) * width, dtype=dtype)
+    attribute = _attribute(mesh, attribute_name, data_type)
+    if attribute is not None:
+        attribute.data.foreach_get(ATTRIBUTE_TYPES[data_type][0], values)
+    else:
+        collection.foreach_get(prop, values)
+    return values
+
+def write_layer(mesh, collection, prop, attribute_name, data_type, values):
+    attribute = _attribute(mesh, attribute_name, data_type)
+    if attribute is not None:
+        attribute.data.foreach_set(ATTRIBUTE_TYPES[data_type][0], values)
+    else:
+        collection.foreach_set(prop, values)
+
+def read_face_materials(mesh):
+    # Since 4.0 the attribute is absent while every face uses slot 0
+    if bpy.app.version >= (4, 0, 0) and "material_index" not in mesh.attributes:
+        return np.zeros(len(mesh.polygons), dtype=np.int32)
+    return read_layer(mesh, mesh.polygons, "material_index", "material_index", 'INT', np.int32)
+
+def read_mesh_topology(mesh):
+    """Reads the face/loop/vertex buffers of mesh into NumPy arrays."""
+    vertex_count = len(mesh.vertices)
+    loop_count = len(mesh.loops)
+    face_count = len(mesh.polygons)
+
+    topology = {
+        "co": read_layer(mesh, mesh.vertices, "co", "position", 'FLOAT_VECTOR', np.float32, 3).reshape(vertex_count, 3),
+        "loop_vertex": read_layer(mesh, mesh.loops, "vertex_index", ".corner_vert", 'INT', np.int32),
+        "loop_start": np.empty(face_count, dtype=np.int32),
+        "loop_total": np.empty(face_count, dtype=np.int32),
+        "material_index": read_face_materials(mesh),
+        "use_smooth": np.ones(face_count, dtype=bool),
+        "uvs": {},
+        }
+    mesh.polygons.foreach_get("loop_start", topology["loop_start"])
+    if bpy.app.version >= (4, 0, 0):
+        # Faces are stored as sorted offsets, the sizes follow from them
+        topology["loop_total"][:] = np.diff(topology["loop_start"], append=loop_count)
+    else:
+        mesh.polygons.foreach_get("loop_total", topology["loop_total"])
+
+    # Since 4.0 faces are smooth unless the sharp_face attribute says not
+    if _attribute(mesh, "sharp_face", 'BOOLEAN') is not None:
+        topology["use_smooth"] = ~read_layer(mesh, mesh.polygons, "use_smooth", "sharp_face", 'BOOLEAN', bool)
+    elif bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_get("use_smooth", topology["use_smooth"])
+
+    for uv_layer in mesh.uv_layers:
+        uvs = read_layer(mesh, uv_layer.data, "uv", uv_layer.name, 'FLOAT2', np.float32, 2)
+        topology["uvs"][uv_layer.name] = uvs.reshape(loop_count, 2)
+    return topology
+
+def face_loops(topology, faces):
+    # Loop indices of faces (in face order) and the new loop_start per face
+    totals = topology["loop_total"][faces]
+    starts = np.zeros(len(faces), dtype=np.int64)
+    np.cumsum(totals[:-1], out=starts[1:])
+    loops = np.repeat(topology["loop_start"][faces] - starts, totals) + np.arange(int(totals.sum()))
+    return loops, starts
+
+def corner_ids(mesh):
+    # Id per loop of the distinct vertex the KN5 export writes for it, so
+    # index limits are checked against what the export will emit
+    from . import ahc_kn5  # ahc_kn5 imports this module
+    return ahc_kn5.vertex_ids(mesh)
+
+def _spread_bits(values):
+    values = values & np.uint64(0x3FF)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x030000FF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x0300F00F)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x030C30C3)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x09249249)
+    return values
+
+def morton_order(points):
+    # Sort order of points along a Z-order curve, neighbours stay together
+    low = points.min(axis=0)
+    span = points.max(axis=0) - low
+    span[span == 0] = 1.0
+    cells = ((points - low) / span * 1023).astype(np.uint64)
+    codes = _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << np.uint64(1)) | (_spread_bits(cells[:, 2]) << np.uint64(2))
+    return np.argsort(codes, kind="stable")
+
+def partition_faces(topology, max_vertices, ids=None, faces=None):
+    """Splits the faces of topology into chunks of at most max_vertices ids.
+
+    Faces are ordered along a Z-order curve of their first corner, then a
+    greedy sweep cuts the sequence whenever the next face would push the
+    chunk over the limit. Each cut is found with one np.unique over a window
+    of faces, using first occurrences to count distinct ids per prefix.
+    faces limits the split to a subset of the faces (default all of them).
+    Returns a list of face index arrays.
+    """
+    if ids is None:
+        ids = topology["loop_vertex"]
+    if faces is None:
+        faces = np.arange(len(topology["loop_start"]))
+
+    face_count = len(faces)
+    if face_count == 0:
+        return []
+
+    first_corners = topology["co"][topology["loop_vertex"][topology["loop_start"][faces]]]
+    order = faces[morton_order(first_corners)]
+
+    chunks = []
+    start = 0
+    window = max(1, max_vertices)
+    while start < face_count:
+        end = min(face_count, start + window)
+        faces = order[start:end]
+        loops, loop_starts = face_loops(topology, faces)
+        flat = ids[loops]
+
+        first = np.unique(flat, return_index=True)[1]
+        new = np.zeros(len(flat), dtype=np.int64)
+        new[first] = 1
+        distinct = np.cumsum(new)[loop_starts + topology["loop_total"][faces] - 1]
+
+        fits = int(np.searchsorted(distinct, max_vertices, side="right"))
+        if fits == len(faces) and end < face_count:
+            window *= 2
+            continue
+
+        fits = max(fits, 1)
+        chunks.append(faces[:fits])
+        start += fits
+    return chunks
+
+def build_mesh(name, parts, materials=()):
+    """Creates a mesh from face subsets of one or more topologies.
+
+    parts is a list of (topology, faces, matrix[, material_map]) where faces
+    is an index array (None for all faces), matrix a 4x4 applied to the
+    positions (None to keep them) and the optional material_map an array
+    mapping the part's material indices to the new mesh's slots. Vertices are
+    remapped per part and UV layers are merged by name. Faces of parts with
+    a mirroring matrix get their winding reversed so they keep facing out.
+    """
+    co = []
+    loop_vertex = []
+    loop_totals = []
+    material_index = []
+    use_smooth = []
+    uv_names = []
+    part_loops = []
+    vertex_offset = 0
+
+    for part in parts:
+        topology, faces, matrix = part[:3]
+        if faces is None:
+            faces = np.arange(len(topology["loop_start"]))
+        loops, loop_starts = face_loops(topology, faces)
+        if matrix is not None and np.linalg.det(np.array(matrix)[:3, :3]) < 0:
+            totals = topology["loop_total"][faces]
+            loops = loops[np.repeat(2 * loop_starts + totals - 1, totals) - np.arange(len(loops))]
+        vertices, remap = np.unique(topology["loop_vertex"][loops], return_inverse=True)
+
+        positions = topology["co"][vertices].astype(np.float64)
+        if matrix is not None:
+            transform_coords(positions, matrix)
+        co.append(positions)
+        loop_vertex.append(remap.ravel() + vertex_offset)
+        loop_totals.append(topology["loop_total"][faces])
+        if len(part) > 3:
+            material_index.append(part[3][topology["material_index"][faces]])
+        else:
+            material_index.append(topology["material_index"][faces])
+        use_smooth.append(topology["use_smooth"][faces])
+        part_loops.append(loops)
+        vertex_offset += len(vertices)
+
+        for uv_name in topology["uvs"]:
+            if uv_name not in uv_names:
+                uv_names.append(uv_name)
+
+    co = np.concatenate(co)
+    loop_vertex = np.concatenate(loop_vertex).astype(np.int32)
+    loop_totals = np.concatenate(loop_totals).astype(np.int32)
+    loop_starts = np.zeros(len(loop_totals), dtype=np.int32)
+    np.cumsum(loop_totals[:-1], out=loop_starts[1:])
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set("co", co.astype(np.float32).ravel())
+    mesh.loops.add(len(loop_vertex))
+    mesh.loops.foreach_set("vertex_index", loop_vertex)
+    mesh.polygons.add(len(loop_totals))
+    mesh.polygons.foreach_set("loop_start", loop_starts)
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", loop_totals)
+    mesh.polygons.foreach_set("material_index", np.concatenate(material_index).astype(np.int32))
+    mesh.polygons.foreach_set("use_smooth", np.concatenate(use_smooth))
+
+    for uv_name in uv_names:
+        uvs = [topology["uvs"][uv_name][loops] if uv_name in topology["uvs"]
+               else np.zeros((len(loops), 2), dtype=np.float32)
+               for topology, loops in zip((part[0] for part in parts), part_loops)]
+        uv_layer = mesh.uv_layers.new(name=uv_name)
+        uv_layer.data.foreach_set("uv", np.concatenate(uvs).astype(np.float32).ravel())
+
+    for mat in materials:
+        mesh.materials.append(mat)
+
+    mesh.update(calc_edges=True)
+    return mesh
+
+# Per element RNA properties read_mesh_layers carries besides the topology,
+# with the attribute newer versions store them in. A property is only read
+# through RNA when its attribute is missing, otherwise the attribute is
+# copied with all others.
+ELEMENT_PROPERTIES = {
+    "vertices": (("select", bool, ".select_vert"), ("hide", bool, ".hide_vert"),
+                 ("bevel_weight", np.float32, "bevel_weight_vert")),
+    "edges": (("select", bool, ".select_edge"), ("hide", bool, ".hide_edge"),
+              ("use_seam", bool, ".uv_seam"), ("use_edge_sharp", bool, "sharp_edge"),
+              ("crease", np.float32, "crease_edge"), ("bevel_weight", np.float32, "bevel_weight_edge"),
+              ("use_freestyle_mark", bool, None)),
+    "polygons": (("select", bool, ".select_poly"), ("hide", bool, ".hide_poly"),
+                 ("use_smooth", bool, "sharp_face"), ("use_freestyle_mark", bool, None)),
+}
+
+ELEMENT_TYPES = {
+    "vertices": ("MeshVertex", 'POINT'),
+    "edges": ("MeshEdge", 'EDGE'),
+    "polygons": ("MeshPolygon", 'FACE'),
+}
+
+# Attributes fill_mesh writes from the topology instead of copying them
+TOPOLOGY_ATTRIBUTES = {"position", ".edge_verts", ".corner_vert", ".corner_edge", "material_index"}
+
+SHAPE_KEY_PROPERTIES = ("value", "slider_min", "slider_max", "mute", "interpolation", "vertex_group")
+
+def _read_corner_normals(mesh):
+    normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+    if hasattr(mesh, "corner_normals"):
+        mesh.corner_normals.foreach_get("vector", normals)
+    else:
+        mesh.calc_normals_split()
+        mesh.loops.foreach_get("normal", normals)
+    return normals.reshape(-1, 3)
+
+def read_mesh_layers(obj, corner_normals=False):
+    """Reads every layer of obj's mesh that fill_mesh can write back.
+
+    Besides the topology this holds the edges, all attributes, the element
+    properties not stored as attributes, UV layers, vertex weights, shape
+    keys and the custom normals (or the corner normals of any mesh when
+    corner_normals is set). Only vertex weights need a Python pass, over
+    the vertices that have any.
+    """
+    mesh = obj.data
+    layers = {
+        "topology": read_mesh_topology(mesh),
+        "edges": read_layer(mesh, mesh.edges, "vertices", ".edge_verts", 'INT32_2D', np.int32, 2).reshape(-1, 2),
+        "loop_edge": read_layer(mesh, mesh.loops, "edge_index", ".corner_edge", 'INT', np.int32),
+        "properties": {},
+        "attributes": {},
+        "uv_active": mesh.uv_layers.active.name if mesh.uv_layers.active is not None else None,
+        "uv_render": [uv_layer.name for uv_layer in mesh.uv_layers if uv_layer.active_render],
+        "active_color": getattr(getattr(mesh, "attributes", None), "active_color_name", ""),
+        "default_color": getattr(getattr(mesh, "attributes", None), "default_color_name", ""),
+        "normals": None,
+        "custom_normals": mesh.has_custom_normals,
+        "auto_smooth": None,
+        "vertex_groups": [group.name for group in obj.vertex_groups],
+        "active_group": obj.vertex_groups.active_index,
+        "weights": None,
+        "shape_keys": [],
+        "use_relative": True,
+        }
+
+    uv_names = set(layers["topology"]["uvs"])
+    for attribute in getattr(mesh, "attributes", ()):
+        if (attribute.name in TOPOLOGY_ATTRIBUTES or attribute.name in uv_names
+                or attribute.data_type not in ATTRIBUTE_TYPES):
+            continue
+        key, width, dtype = ATTRIBUTE_TYPES[attribute.data_type]
+        values = np.empty(len(attribute.data) * width, dtype=dtype)
+        attribute.data.foreach_get(key, values)
+        layers["attributes"][attribute.name] = (attribute.domain, attribute.data_type, values.reshape(-1, width))
+
+    for collection_name, (type_name, domain) in ELEMENT_TYPES.items():
+        collection = getattr(mesh, collection_name)
+        rna = getattr(bpy.types, type_name).bl_rna.properties
+        for name, dtype, attribute_name in ELEMENT_PROPERTIES[collection_name]:
+            if name not in rna or attribute_name in layers["attributes"]:
+                continue
+            values = np.empty(len(collection), dtype=dtype)
+            collection.foreach_get(name, values)
+            # Unset flags are left out, they are the default of new elements
+            if values.any() or (name == "use_smooth" and bpy.app.version < (4, 0, 0)):
+                layers["properties"][(collection_name, name)] = values
+
+    if hasattr(mesh, "use_auto_smooth"):
+        layers["auto_smooth"] = (mesh.use_auto_smooth, mesh.auto_smooth_angle)
+    if mesh.has_custom_normals or corner_normals:
+        layers["normals"] = _read_corner_normals(mesh)
+
+    if layers["vertex_groups"]:
+        vertices = []
+        groups = []
+        weights = []
+        for vertex in mesh.vertices:
+            for element in vertex.groups:
+                vertices.append(vertex.index)
+                groups.append(element.group)
+                weights.append(element.weight)
+        layers["weights"] = (np.array(vertices, dtype=np.int64), np.array(groups, dtype=np.int64),
+                             np.array(weights, dtype=np.float32))
+
+    if mesh.shape_keys is not None:
+        layers["use_relative"] = mesh.shape_keys.use_relative
+        for key_block in mesh.shape_keys.key_blocks:
+            co = np.empty(len(key_block.data) * 3, dtype=np.float32)
+            key_block.data.foreach_get("co", co)
+            properties = {name: getattr(key_block, name) for name in SHAPE_KEY_PROPERTIES}
+            layers["shape_keys"].append((key_block.name, key_block.relative_key.name, properties, co.reshape(-1, 3)))
+    return layers
+
+def _used(indices, count):
+    # Mask of the values below count that occur in indices
+    used = np.zeros(count, dtype=bool)
+    used[indices] = True
+    return used
+
+def _part_selection(layers, faces, matrix, keep_loose):
+    # Source vertices, edges, corners and faces of one fill_mesh part, plus
+    # the corner each new corner takes its edge from. Corners run in reverse
+    # when matrix mirrors, so faces keep facing out.
+    topology = layers["topology"]
+    if faces is None:
+        faces = np.arange(len(topology["loop_start"]))
+    loops, loop_starts = face_loops(topology, faces)
+    edge_loops = loops
+    if matrix is not None and np.linalg.det(np.array(matrix)[:3, :3]) < 0:
+        totals = topology["loop_total"][faces]
+        reverse = np.repeat(2 * loop_starts + totals - 1, totals) - np.arange(len(loops))
+        following = reverse - 1
+        wrap = following < np.repeat(loop_starts, totals)
+        following[wrap] += np.repeat(totals, totals)[wrap]
+        loops, edge_loops = loops[reverse], loops[following]
+
+    edge_count = len(layers["edges"])
+    vertex_count = len(topology["co"])
+    # Masks instead of np.unique, the index arrays come out sorted
+    edges = _used(layers["loop_edge"][edge_loops], edge_count)
+    if keep_loose:
+        edges |= ~_used(layers["loop_edge"], edge_count)
+    edges = np.flatnonzero(edges)
+    vertices = _used(topology["loop_vertex"][loops], vertex_count) | _used(layers["edges"][edges].ravel(), vertex_count)
+    if keep_loose:
+        vertices |= ~_used(layers["edges"].ravel(), vertex_count)
+    vertices = np.flatnonzero(vertices)
+    return {'POINT': vertices, 'EDGE': edges, 'CORNER': loops, 'FACE': faces, "edge_loops": edge_loops}
+
+def _add_weights(obj, vertices, groups, weights):
+    # One vertex_groups[].add call per distinct (group, weight) pair
+    if len(vertices) == 0:
+        return
+    order = np.lexsort((weights, groups))
+    vertices, groups, weights = vertices[order], groups[order], weights[order]
+    breaks = np.flatnonzero((np.diff(groups) != 0) | (np.diff(weights) != 0)) + 1
+    for start, end in zip(np.concatenate(([0], breaks)).tolist(), np.concatenate((breaks, [len(order)])).tolist()):
+        obj.vertex_groups[int(groups[start])].add(vertices[start:end].tolist(), float(weights[start]), 'REPLACE')
+
+def fill_mesh(obj, parts, keep_loose=False):
+    """Fills the empty mesh of obj with face subsets of read_mesh_layers.
+
+    parts is a list of (layers, faces, matrix, material_map) like build_mesh
+    takes them. Only the selected faces with their edges and vertices are
+    written, carrying every layer read: attributes and element properties,
+    UVs (each part's active UV map goes to the active one), custom normals,
+    vertex weights by group name and, for a single part without matrix,
+    shape keys. Loose vertices and edges of the part are kept when
+    keep_loose is set.
+    """
+    mesh = obj.data
+    part_layers = [part[0] for part in parts]
+    selections = [_part_selection(layers, faces, matrix, keep_loose)
+                  for layers, faces, matrix, material_map in parts]
+
+    co = []
+    edges = []
+    loop_vertex = []
+    loop_edge = []
+    loop_totals = []
+    material_index = []
+    normals = []
+    vertex_offsets = []
+    vertex_offset = 0
+    edge_offset = 0
+    for (layers, faces, matrix, material_map), selection in zip(parts, selections):
+        topology = layers["topology"]
+        vertices = selection['POINT']
+        faces = selection['FACE']
+        vertex_map = np.full(len(topology["co"]), -1, dtype=np.int64)
+        vertex_map[vertices] = np.arange(len(vertices)) + vertex_offset
+        edge_map = np.full(len(layers["edges"]), -1, dtype=np.int64)
+        edge_map[selection['EDGE']] = np.arange(len(selection['EDGE'])) + edge_offset
+
+        positions = topology["co"][vertices].astype(np.float64)
+        part_normals = layers["normals"][selection['CORNER']] if layers["normals"] is not None else None
+        if matrix is not None:
+            transform_coords(positions, matrix)
+            if part_normals is not None:
+                part_normals = part_normals @ np.linalg.inv(np.array(matrix)[:3, :3])
+                part_normals /= np.maximum(np.linalg.norm(part_normals, axis=1), 1e-12)[:, None]
+        co.append(positions)
+        normals.append(part_normals)
+        edges.append(vertex_map[layers["edges"][selection['EDGE']]])
+        loop_vertex.append(vertex_map[topology["loop_vertex"][selection['CORNER']]])
+        loop_edge.append(edge_map[layers["loop_edge"][selection["edge_loops"]]])
+        loop_totals.append(topology["loop_total"][faces])
+        face_materials = topology["material_index"][faces]
+        material_index.append(material_map[face_materials] if material_map is not None else face_materials)
+        vertex_offsets.append(vertex_offset)
+        vertex_offset += len(vertices)
+        edge_offset += len(selection['EDGE'])
+
+    loop_vertex = np.concatenate(loop_vertex).astype(np.int32)
+    loop_totals = np.concatenate(loop_totals).astype(np.int32)
+    loop_starts = np.zeros(len(loop_totals), dtype=np.int32)
+    np.cumsum(loop_totals[:-1], out=loop_starts[1:])
+    material_index = np.concatenate(material_index).astype(np.int32)
+
+    mesh.vertices.add(vertex_offset)
+    write_layer(mesh, mesh.vertices, "co", "position", 'FLOAT_VECTOR', np.concatenate(co).astype(np.float32).ravel())
+    mesh.edges.add(edge_offset)
+    write_layer(mesh, mesh.edges, "vertices", ".edge_verts", 'INT32_2D', np.concatenate(edges).astype(np.int32).ravel())
+    mesh.loops.add(len(loop_vertex))
+    write_layer(mesh, mesh.loops, "vertex_index", ".corner_vert", 'INT', loop_vertex)
+    write_layer(mesh, mesh.loops, "edge_index", ".corner_edge", 'INT', np.concatenate(loop_edge).astype(np.int32))
+    mesh.polygons.add(len(loop_totals))
+    mesh.polygons.foreach_set("loop_start", loop_starts)
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", loop_totals)
+    if material_index.any() or bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("material_index", material_index)
+
+    # UV layers merged by name, the active layer of each part feeds the first
+    uv_active = part_layers[0]["uv_active"]
+    uv_names = [uv_active] if uv_active is not None else []
+    for layers in part_layers:
+        uv_names.extend(name for name in layers["topology"]["uvs"] if name not in uv_names)
+    for uv_name in uv_names:
+        uvs = []
+        for layers, selection in zip(part_layers, selections):
+            part_uvs = layers["topology"]["uvs"].get(layers["uv_active"] if uv_name == uv_active else uv_name)
+            loops = selection['CORNER']
+            uvs.append(part_uvs[loops] if part_uvs is not None else np.zeros((len(loops), 2), dtype=np.float32))
+        uv_layer = mesh.uv_layers.new(name=uv_name)
+        write_layer(mesh, uv_layer.data, "uv", uv_layer.name, 'FLOAT2', np.concatenate(uvs).ravel())
+        uv_layer.active_render = uv_name in part_layers[0]["uv_render"]
+    if uv_active is not None:
+        mesh.uv_layers.active = mesh.uv_layers[uv_active]
+
+    # Attributes by name, parts without one get zeros
+    attributes = {}
+    for layers in part_layers:
+        for name, (domain, data_type, values) in layers["attributes"].items():
+            attributes.setdefault(name, (domain, data_type))
+    for name, (domain, data_type) in attributes.items():
+        key, width, dtype = ATTRIBUTE_TYPES[data_type]
+        values = []
+        for layers, selection in zip(part_layers, selections):
+            index = selection[domain]
+            source = layers["attributes"].get(name)
+            if source is not None and source[:2] == (domain, data_type):
+                values.append(source[2][index])
+            else:
+                values.append(np.zeros((len(index), width), dtype=dtype))
+        attribute = _attribute(mesh, name, data_type)
+        if attribute is None or attribute.domain != domain:
+            attribute = mesh.attributes.new(name, data_type, domain)
+        attribute.data.foreach_set(key, np.concatenate(values).ravel())
+    for name in ("active_color", "default_color"):
+        if part_layers[0][name] and hasattr(mesh.attributes, name + "_name"):
+            setattr(mesh.attributes, name + "_name", part_layers[0][name])
+
+    # Element properties without attribute, parts without one get defaults
+    for collection_name, (type_name, domain) in ELEMENT_TYPES.items():
+        for name, dtype, attribute_name in ELEMENT_PROPERTIES[collection_name]:
+            key = (collection_name, name)
+            if not any(key in layers["properties"] for layers in part_layers):
+                continue
+            default = getattr(bpy.types, type_name).bl_rna.properties[name].default
+            values = [layers["properties"][key][selection[domain]] if key in layers["properties"]
+                      else np.full(len(selection[domain]), default, dtype=dtype)
+                      for layers, selection in zip(part_layers, selections)]
+            getattr(mesh, collection_name).foreach_set(name, np.concatenate(values))
+
+    mesh.update()
+
+    # Custom normals, also written when merged parts disagree on auto smooth
+    auto_smooth = [layers["auto_smooth"] for layers in part_layers]
+    custom = any(layers["custom_normals"] for layers in part_layers) or len(set(auto_smooth)) > 1
+    if auto_smooth[0] is not None:
+        mesh.use_auto_smooth = auto_smooth[0][0] or custom
+        mesh.auto_smooth_angle = auto_smooth[0][1]
+    if custom and all(part_normals is not None for part_normals in normals):
+        mesh.normals_split_custom_set(np.concatenate(normals))
+
+    # Vertex weights, groups matched by name
+    for layers, selection, offset in zip(part_layers, selections, vertex_offsets):
+        if layers["weights"] is None:
+            continue
+        for name in layers["vertex_groups"]:
+            if name not in obj.vertex_groups:
+                obj.vertex_groups.new(name=name)
+        vertices, groups, weights = layers["weights"]
+        vertex_map = np.full(len(layers["topology"]["co"]), -1, dtype=np.int64)
+        vertex_map[selection['POINT']] = np.arange(len(selection['POINT'])) + offset
+        kept = vertex_map[vertices] >= 0
+        group_map = np.array([obj.vertex_groups[name].index for name in layers["vertex_groups"]], dtype=np.int64)
+        _add_weights(obj, vertex_map[vertices[kept]], group_map[groups[kept]], weights[kept])
+    if len(parts) == 1 and part_layers[0]["vertex_groups"]:
+        obj.vertex_groups.active_index = part_layers[0]["active_group"]
+
+    layers, faces, matrix, material_map = parts[0]
+    if len(parts) == 1 and matrix is None and layers["shape_keys"]:
+        vertices = selections[0]['POINT']
+        for name, relative_name, properties, key_co in layers["shape_keys"]:
+            key_block = obj.shape_key_add(name=name, from_mix=False)
+            key_block.data.foreach_set("co", key_co[vertices].ravel())
+        key_blocks = mesh.shape_keys.key_blocks
+        mesh.shape_keys.use_relative = layers["use_relative"]
+        for name, relative_name, properties, key_co in layers["shape_keys"]:
+            key_block = key_blocks[name]
+            for property_name, value in properties.items():
+                setattr(key_block, property_name, value)
+            if relative_name in key_blocks:
+                key_block.relative_key = key_blocks[relative_name]
+
+def clear_mesh(obj):
+    # Empties obj's mesh, keeping its materials and settings
+    if obj.data.shape_keys is not None:
+        obj.shape_key_clear()
+    obj.data.clear_geometry()
+
+def copy_object(obj, name):
+    """Copy of obj with its own mesh copy, linked to the same collections.
+
+    Modifiers, constraints, custom properties, visibility and the parent
+    come along, the KN5 node name override does not.
+    """
+    copy = obj.copy()
+    copy.data = obj.data.copy()
+    copy.name = name
+    if "ahc_node_name" in copy:
+        del copy["ahc_node_name"]
+    for collection in obj.users_collection:
+        collection.objects.link(copy)
+    return copy
+
+def split_faces(obj, chunks, names, layers=None):
+    """Splits obj into one object per face chunk in a single pass.
+
+    The mesh is read once (or taken from layers), then obj keeps the first
+    chunk and its loose geometry and every other chunk goes to a copy of
+    obj, each written from only its own faces with all of its data. Copies
+    are made while obj is empty, so they never duplicate the full mesh.
+    Returns obj followed by the copies.
+    """
+    if layers is None:
+        layers = read_mesh_layers(obj)
+    if obj.data.users > 1:
+        obj.data = obj.data.copy()
+    clear_mesh(obj)
+
+    pieces = [obj] + [copy_object(obj, name) for name in names[1:]]
+    for piece, faces in zip(pieces, chunks):
+        fill_mesh(piece, [(layers, faces, None, None)], keep_loose=piece is obj)
+    obj.name = names[0]
+    return pieces
+
+def split_mesh_object(obj, max_vertices):
+    """Splits obj into pieces of at most max_vertices exported vertices.
+
+    Returns the pieces (obj first), or an empty list when obj already fits.
+    """
+    ids = corner_ids(obj.data)
+    if len(ids) == 0 or np.unique(ids).size <= max_vertices:
+        return []
+
+    layers = read_mesh_layers(obj)
+    chunks = partition_faces(layers["topology"], max_vertices, ids)
+    names = [obj.name] + ['{}_{}'.format(obj.name, index) for index in range(1, len(chunks))]
+    return split_faces(obj, chunks, names, layers)
+
+def split_by_material(obj):
+    """Splits obj into one single-material object per used material.
+
+    Faces are grouped with an argsort over their material index, every group
+    keeps the data of obj and only its own material slot.
+    Returns the pieces (obj first), or an empty list when obj uses one material.
+    """
+    if used_material_count(obj.data) <= 1:
+        return []
+
+    layers = read_mesh_layers(obj)
+    face_materials = layers["topology"]["material_index"]
+    order = np.argsort(face_materials, kind="stable")
+    used, starts = np.unique(face_materials[order], return_index=True)
+
+    chunks = [np.sort(faces) for faces in np.split(order, starts[1:])]
+    slots = []
+    names = []
+    for material_index in used.tolist():
+        if material_index < len(obj.material_slots):
+            slot = obj.material_slots[material_index]
+            slots.append((material_index, slot.link, slot.material))
+        else:
+            slots.append((material_index, 'DATA', None))
+        mat = slots[-1][2]
+        names.append('{}_{}'.format(obj.name, mat.name if mat is not None else material_index))
+
+    pieces = split_faces(obj, chunks, names, layers)
+    for piece, (material_index, link, mat) in zip(pieces, slots):
+        # Popping a slot moves the face indices above it down
+        for index in reversed(range(len(piece.data.materials))):
+            if index != material_index:
+                piece.data.materials.pop(index=index)
+        if len(piece.material_slots) > 0:
+            # Object level slots are truncated at the end, not shifted
+            piece.material_slots[0].link = link
+            if link == 'OBJECT':
+                piece.material_slots[0].material = mat
+    return pieces
+
+def used_material_count(mesh):
+    return np.unique(read_face_materials(mesh)).size
+
+def count_draw_calls(objects):
+    # One draw call per used material of every mesh object
+    return sum(used_material_count(obj.data) for obj in objects if obj.type == 'MESH')
+
+# Triangle count per mesh_fingerprint()
+_triangle_cache = {}
+TRIANGLE_CACHE_LIMIT = 4096
+
+def triangle_count(mesh):
+    # Loop triangles of mesh, every n-gon triangulates into n - 2 triangles.
+    # Summed from loop_total so panels don't have to triangulate the mesh.
+    key = mesh_fingerprint(mesh)
+    count = _triangle_cache.get(key)
+    if count is None:
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_total", loop_totals)
+        count = int(loop_totals.sum()) - 2 * len(loop_totals)
+        if len(_triangle_cache) >= TRIANGLE_CACHE_LIMIT:
+            _triangle_cache.clear()
+        _triangle_cache[key] = count
+    return count
+
+def _mergeable(obj, children):
+    return (obj.type == 'MESH'
+            and not (obj.hide_get() or obj.hide_viewport or obj.hide_render)
+            and len(children.get(obj, ())) == 0
+            and len(obj.modifiers) == 0
+            and obj.data.shape_keys is None
+            and len(obj.data.polygons) > 0)
+
+def consolidate_node(node, max_vertices, children=None):
+    """Merges the leaf mesh children of node into one mesh per material.
+
+    Child transforms are baked into the vertices, so every merged object sits
+    at the node's origin. A material whose geometry exceeds max_vertices is
+    spread over several meshes packed first-fit in child order, a single
+    child over the limit is partitioned first. The merged meshes keep the
+    children's attributes, UV layers, vertex weights and normals through
+    fill_mesh, and one that still exports too many vertices is split again.
+    Hidden children and children with modifiers, shape keys or children of
+    their own are left alone.
+    Returns (created objects, removed object count).
+    """
+    if children is None:
+        children = children_map()
+
+    sources = [child for child in children.get(node, ()) if _mergeable(child, children)]
+    if not sources:
+        return [], 0
+
+    # material name -> (material, [(layers, faces, matrix, material_map, vertex count)])
+    groups = {}
+    for child in sources:
+        layers = read_mesh_layers(child, corner_normals=True)
+        topology = layers["topology"]
+        ids = corner_ids(child.data)
+        matrix = child.matrix_parent_inverse @ child.matrix_basis
+        face_materials = topology["material_index"]
+        order = np.argsort(face_materials, kind="stable")
+        used, starts = np.unique(face_materials[order], return_index=True)
+
+        for material_index, faces in zip(used.tolist(), np.split(order, starts[1:])):
+            faces = np.sort(faces)
+            mat = child.material_slots[material_index].material if material_index < len(child.material_slots) else None
+            material_map = np.zeros(material_index + 1, dtype=np.int32)
+            key = mat.name_full if mat is not None else None
+            vertex_count = np.unique(ids[face_loops(topology, faces)[0]]).size
+            chunks = [faces]
+            if vertex_count > max_vertices:
+                chunks = [np.sort(chunk) for chunk in partition_faces(topology, max_vertices, ids, faces)]
+            for chunk in chunks:
+                if len(chunks) > 1:
+                    vertex_count = np.unique(ids[face_loops(topology, chunk)[0]]).size
+                groups.setdefault(key, (mat, []))[1].append((layers, chunk, matrix, material_map, vertex_count))
+
+    if len(sources) == 1 and len(groups) == 1:
+        return [], 0
+
+    created = []
+    collections = list(sources[0].users_collection)
+    for key, (mat, parts) in groups.items():
+        bins = []
+        for part in parts:
+            for bin_parts in bins:
+                if bin_parts[0] + part[4] <= max_vertices:
+                    bin_parts[0] += part[4]
+                    bin_parts[1].append(part[:4])
+                    break
+            else:
+                bins.append([part[4], [part[:4]]])
+
+        for bin_index, (vertex_count, bin_parts) in enumerate(bins):
+            name = '{}_{}'.format(node.name, mat.name if mat is not None else "NoMaterial")
+            if len(bins) > 1:
+                name = '{}_{}'.format(name, bin_index)
+            mesh = bpy.data.meshes.new(name)
+            if mat is not None:
+                mesh.materials.append(mat)
+            merged = bpy.data.objects.new(name, mesh)
+            for collection in collections:
+                collection.objects.link(merged)
+            merged.parent = node
+            fill_mesh(merged, bin_parts)
+            created.append(merged)
+            # The bins were packed on the children's counts, recheck the result
+            created.extend(split_mesh_object(merged, max_vertices)[1:])
+
+    for child in sources:
+        old_mesh = child.data
+        bpy.data.objects.remove(child)
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+
+    return created, len(sources)
+
+def read_edges(mesh):
+    return read_layer(mesh, mesh.edges, "vertices", ".edge_verts", 'INT32_2D', np.int32, 2).reshape(-1, 2)
+
+def connected_components(vertex_count, edges):
+    """Labels the connected components of a vertex/edge graph.
+
+    Vectorized union-find: every round hooks the larger root of each edge
+    whose ends still disagree onto the smaller one, then compresses all
+    paths by pointer jumping. Returns (labels 0..count-1 per vertex, count).
+    """
+    labels = np.arange(vertex_count)
+    u = edges[:, 0]
+    v = edges[:, 1]
+    while len(u):
+        a = labels[u]
+        b = labels[v]
+        differ = a != b
+        if not differ.any():
+            break
+        a = a[differ]
+        b = b[differ]
+        np.minimum.at(labels, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        u = u[differ]
+        v = v[differ]
+
+    roots, labels = np.unique(labels, return_inverse=True)
+    return labels.reshape(-1), len(roots)
+
+def group_indices(labels, count):
+    # Indices sorted by label and where each label's run starts
+    order = np.argsort(labels, kind='stable')
+    sizes = np.bincount(labels, minlength=count)
+    starts = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(sizes, out=starts[1:])
+    return order, starts
+
+def component_bounds(coords, labels, count):
+    # (low, high, centroid, vertex count) per component, from one sort
+    order, starts = group_indices(labels, count)
+    sizes = np.diff(starts)
+    starts = starts[:-1]
+    sorted_coords = coords[order]
+    low = np.minimum.reduceat(sorted_coords, starts, axis=0)
+    high = np.maximum.reduceat(sorted_coords, starts, axis=0)
+    centroid = np.add.reduceat(sorted_coords, starts, axis=0) / sizes[:, None]
+    return low, high, centroid, sizes
+
+class MeshComponents:
+    """Connected components of a mesh, labeled without changing the mesh.
+
+    Holds the component of every vertex (labels) and face (face_labels),
+    the bounds of every component and its vertex and face index arrays, so
+    callers can decide what to do with each part before splitting anything.
+    """
+
+    def __init__(self, mesh, topology=None):
+        if topology is None:
+            topology = read_mesh_topology(mesh)
+        self.topology = topology
+        co = topology["co"].astype(np.float64)
+
+        self.labels, self.count = connected_components(len(co), read_edges(mesh))
+        self.face_labels = self.labels[topology["loop_vertex"][topology["loop_start"]]]
+        self.low, self.high, self.centroid, self.sizes = component_bounds(co, self.labels, self.count)
+        self._vertex_order, self._vertex_starts = group_indices(self.labels, self.count)
+        self._face_order, self._face_starts = group_indices(self.face_labels, self.count)
+
+    def vertices(self, component):
+        return self._vertex_order[self._vertex_starts[component]:self._vertex_starts[component + 1]]
+
+    def faces(self, component):
+        return self._face_order[self._face_starts[component]:self._face_starts[component + 1]]
+
+    def selected(self, mesh):
+        # Components with at least one selected vertex
+        select = read_layer(mesh, mesh.vertices, "select", ".select_vert", 'BOOLEAN', bool)
+        return np.unique(self.labels[select])
+
+def separate_components(obj, components, parents):
+    """Moves components of obj into new objects, one per component.
+
+    components is a MeshComponents of obj.data and parents maps each chosen
+    component to the object it gets parented to (keeping its world
+    placement). obj and every part are written in one split_faces pass, so
+    none of them loses mesh data. obj is removed when no faces are left and
+    it has no children.
+    Returns the new objects.
+    """
+    matrix_world = obj.matrix_world.copy()
+    mesh_name = obj.data.name
+
+    taken = np.zeros(len(obj.data.polygons), dtype=bool)
+    chunks = []
+    part_parents = []
+    for component, parent in parents.items():
+        faces = components.faces(component)
+        if len(faces) == 0:
+            continue
+        taken[faces] = True
+        chunks.append(faces)
+        part_parents.append(parent)
+
+    if not chunks:
+        return []
+
+    remaining = np.flatnonzero(~taken)
+    names = [obj.name] + ['{}_part{}'.format(obj.name, index) for index in range(len(chunks))]
+    pieces = split_faces(obj, [remaining] + chunks, names)
+
+    created = pieces[1:]
+    for index, (part, parent) in enumerate(zip(created, part_parents)):
+        part.data.name = '{}_part{}'.format(mesh_name, index)
+        part.parent = parent
+        part.matrix_parent_inverse = parent.matrix_world.inverted()
+        part.matrix_basis = matrix_world
+
+    if len(remaining) == 0 and not any(child.parent == obj for child in bpy.data.objects):
+        old_mesh = obj.data
+        bpy.data.objects.remove(obj)
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+    return created
+
+# Quantization step of canonical coordinates, in mesh local units
+HASH_PRECISION = 1e-5
+
+def canonical_geometry(mesh):
+    """Hashes mesh geometry independently of where its origin sits.
+
+    Coordinates are moved so the bounding box center is at the origin and
+    quantized to HASH_PRECISION before hashing together with the topology,
+    UVs and material names. Returns (hex digest, center, quantized coords).
+    """
+    topology = read_mesh_topology(mesh)
+    co = topology["co"].astype(np.float64)
+    center = (co.min(axis=0) + co.max(axis=0)) * 0.5 if len(co) else np.zeros(3)
+    quantized = np.round((co - center) / HASH_PRECISION).astype(np.int64)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(quantized.tobytes())
+    for key in ("loop_vertex", "loop_start", "loop_total", "material_index", "use_smooth"):
+        digest.update(topology[key].tobytes())
+    for uv_name in sorted(topology["uvs"]):
+        digest.update(uv_name.encode("utf-8"))
+        digest.update(np.round(topology["uvs"][uv_name] / HASH_PRECISION).astype(np.int64).tobytes())
+    for mat in mesh.materials:
+        digest.update((mat.name_full if mat is not None else "").encode("utf-8"))
+    return digest.hexdigest(), center, quantized
+
+def mesh_memory(mesh):
+    # Approximate bytes of the core mesh buffers
+    loop_count = len(mesh.loops)
+    return (len(mesh.vertices) * 12 + len(mesh.edges) * 8 + loop_count * 8
+            + len(mesh.polygons) * 12 + loop_count * 8 * len(mesh.uv_layers))
+
+def deduplicate_meshes(root, children=None):
+    """Relinks objects below root with identical geometry to one shared mesh.
+
+    Each mesh datablock is hashed once. Objects whose mesh only differs by
+    its origin get their transform shifted by the center difference (and
+    their children compensated), so nothing moves in world space.
+    Meshes with shape keys are skipped. Returns (clusters as lists of
+    objects, meshes removed, bytes saved).
+    """
+    users = {}
+    for obj in iter_hierarchy(root, children):
+        if obj.type == 'MESH' and obj.data.shape_keys is None:
+            users.setdefault(obj.data, []).append(obj)
+
+    clusters = {}
+    for mesh, objects in users.items():
+        digest, center, quantized = canonical_geometry(mesh)
+        for rep_mesh, rep_center, rep_quantized, members in clusters.get(digest, ()):
+            if np.array_equal(quantized, rep_quantized):
+                members.append((mesh, center, objects))
+                break
+        else:
+            clusters.setdefault(digest, []).append((mesh, center, quantized, [(mesh, center, objects)]))
+
+    if children is None:
+        children = children_map()
+
+    result = []
+    removed = 0
+    saved = 0
+    for candidates in clusters.values():
+        for rep_mesh, rep_center, rep_quantized, members in candidates:
+            if len(members) < 2:
+                if len(members[0][2]) > 1:
+                    result.append(members[0][2])
+                continue
+
+            cluster = []
+            for mesh, center, objects in members:
+                cluster.extend(objects)
+                if mesh == rep_mesh:
+                    continue
+
+                offset = Matrix.Translation(Vector(center - rep_center))
+                for obj in objects:
+                    obj.data = rep_mesh
+                    obj.matrix_basis = obj.matrix_basis @ offset
+                    for child in children.get(obj, ()):
+                        child.matrix_parent_inverse = offset.inverted() @ child.matrix_parent_inverse
+
+                if mesh.users == 0:
+                    saved += mesh_memory(mesh)
+                    bpy.data.meshes.remove(mesh)
+                    removed += 1
+            result.append(cluster)
+
+    return result, removed, saved
+
+def register():
+    if _on_depsgraph_update not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(_on_depsgraph_update)
+
+def unregister():
+    if _on_depsgraph_update in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(_on_depsgraph_update)
+    center_engine.clear()
+    _triangle_cache.clear()
+    _geometry_generation.clear()
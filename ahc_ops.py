@@ -1,9 +1,18 @@
 
 import bpy
+import csv
 import math
+import os
 import textwrap
+import time
 from . import addon_updater_ops
 from . import ahc_ops
+from . import ahc_hierarchy
+from . import ahc_kn5
+from . import ahc_lod
+from . import ahc_materials
+from . import ahc_mesh
+from . import ahc_textures
                              
 from mathutils import (Matrix,
                         Vector,
@@ -12,6 +21,15 @@ from mathutils import (Matrix,
 from bpy.types import (Operator,
                         )
 
+from bpy.props import (BoolProperty,
+                        FloatProperty,
+                        StringProperty,
+                        )
+
+from bpy_extras.io_utils import (ExportHelper,
+                                ImportHelper,
+                                )
+
 
 
 class OBJECT_OT_AssettoMaterialCreation(Operator):
@@ -46,33 +64,26 @@ class OBJECT_OT_AssettoMaterialCreation(Operator):
         'INT_FUEL_INDICATOR',
     ]
     
-    def setup_material_list(self, material_list):
-        for mat_name in material_list:
-            mat = bpy.data.materials.new(name=mat_name)
-            mat.use_nodes = True
-            #setup the node_tree and links as you would manually on shader Editor
-            #to define an image texture for a material
-            material_output = mat.node_tree.nodes.get('Material Output')
-            principled_BSDF = mat.node_tree.nodes.get('Principled BSDF')
-
-            tex_node = mat.node_tree.nodes.new('ShaderNodeTexImage')
-            mat.node_tree.links.new(tex_node.outputs[0], principled_BSDF.inputs[0])
-            bpy.data.materials[mat_name].node_tree.nodes["Principled BSDF"].inputs[0].show_expanded = True
-            
-            if(mat_name.endswith(("_AT", "_Alpha"))):
-                mat.blend_method = 'BLEND'
-
     def execute(self, context):
-        scene = context.scene
-        ahc_tool = scene.ahc_tool
-                   
-        self.setup_material_list(self.EXT_MATERIALS)
-        self.setup_material_list(self.INT_MATERIALS)
+        created = ahc_materials.ensure_materials(self.EXT_MATERIALS + self.INT_MATERIALS)
         
-        if(bpy.data.materials["GL"] == None):
-            gl_mat = bpy.data.materials.new(name="GL")
-            gl_mat.use_nodes = True
+        gl_mat = ahc_materials.ensure_gl_material()
+        if(gl_mat is not None):
+            created.append(gl_mat)
         
+        self.report({'INFO'}, 'Created {} materials.'.format(len(created)))
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoMaterialBlendDetect(Operator):
+    """Set the blend mode of every material from the alpha of its textures"""
+    bl_idname = "object.assetto_hierarchy_material_blend_detect"
+    bl_label = "Detect Blend Modes"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        counts = ahc_materials.detect_blend_modes()
+        self.report({'INFO'}, 'Blend modes: {} opaque, {} alpha test, {} alpha blend.'.format(
+            counts['OPAQUE'], counts['CLIP'], counts['BLEND']))
         return {'FINISHED'}
 
 class OBJECT_OT_AssettoMeshRename(Operator):
@@ -80,21 +91,181 @@ class OBJECT_OT_AssettoMeshRename(Operator):
     bl_idname = "object.assetto_hierarchy_mesh_renamer"
     bl_label = "Rename Meshes"
     bl_options = {'REGISTER', 'UNDO'}
+    
+    dry_run: BoolProperty(
+        name = "Dry Run",
+        description = "Only report the old to new name mapping",
+        default = False,
+        options = {'SKIP_SAVE'}
+        )
+
+    def execute(self, context):
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
+        
+        targets = ahc_hierarchy.sub_name_map(ahc_tool.root_node)
+        conflicts = ahc_hierarchy.name_conflicts(targets)
+        
+        if self.dry_run:
+            for obj, name in targets.items():
+                if obj.name != name:
+                    self.report({'INFO'}, '{} -> {}'.format(obj.name, name))
+            for name in conflicts:
+                self.report({'WARNING'}, '{} is held by an object outside the hierarchy'.format(name))
+            self.report({'INFO'}, 'Preview: {} meshes, {} already named, {} names held by other objects.'.format(
+                len(targets), sum(1 for obj, name in targets.items() if obj.name == name), len(conflicts)))
+            return {'FINISHED'}
+        
+        renamed = ahc_hierarchy.apply_names(targets)
+        if conflicts:
+            self.report({'WARNING'}, 'Renamed {} meshes, {} names were taken by objects outside the hierarchy.'.format(renamed, len(conflicts)))
+        else:
+            self.report({'INFO'}, 'Renamed {} meshes.'.format(renamed))
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoMeshSplit(Operator):
+    """Split meshes below the root node that exceed the AC vertex limit"""
+    bl_idname = "object.assetto_hierarchy_mesh_splitter"
+    bl_label = "Split Large Meshes"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
+        start = time.perf_counter()
+        
+        # The root is the model's top node and never gets split
+        root = ahc_tool.root_node
+        meshes = [obj for obj in ahc_mesh.iter_hierarchy(root) if obj.type == 'MESH' and obj != root]
+        split = 0
+        created = 0
+        parents = []
+        for obj in meshes:
+            parent = obj.parent
+            pieces = ahc_mesh.split_mesh_object(obj, ahc_tool.split_vertex_limit)
+            if pieces:
+                split += 1
+                created += len(pieces)
+                if parent is not None and parent not in parents:
+                    parents.append(parent)
+        
+        # Give the pieces the same _SUB# names the renamer would
+        for parent in parents:
+            ahc_hierarchy.apply_names(ahc_hierarchy.sub_name_map(parent))
+        
+        self.report({'INFO'}, 'Split {} meshes into {} pieces in {:.2f} s.'.format(split, created, time.perf_counter() - start))
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoMeshSplitMaterials(Operator):
+    """Split multi-material meshes below the root node into one mesh per material"""
+    bl_idname = "object.assetto_hierarchy_mesh_material_splitter"
+    bl_label = "Split By Material"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
         scene = context.scene
         ahc_tool = scene.ahc_tool
+        start = time.perf_counter()
         
-        def rename_object(obj):   
-            count = 0             
-            for child in obj.children:
-                if child.type == 'MESH':
-                    if child.visible_get():
-                        child.name = '{}_SUB{}'.format(child.parent.name, count)
-                        count = count + 1
-                rename_object(child)
+        # The root is the model's top node and never gets split
+        root = ahc_tool.root_node
+        meshes = [obj for obj in ahc_mesh.iter_hierarchy(root) if obj.type == 'MESH' and obj != root]
+        split = 0
+        created = 0
+        for obj in meshes:
+            pieces = ahc_mesh.split_by_material(obj)
+            if pieces:
+                split += 1
+                created += len(pieces)
         
-        rename_object(ahc_tool.root_node)
+        self.report({'INFO'}, 'Split {} meshes into {} single material meshes in {:.2f} s.'.format(split, created, time.perf_counter() - start))
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoMeshConsolidate(Operator):
+    """Merge the mesh children of every node below the root node into one mesh per material"""
+    bl_idname = "object.assetto_hierarchy_mesh_consolidator"
+    bl_label = "Merge By Material"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
+        start = time.perf_counter()
+        
+        children = ahc_mesh.children_map()
+        objects = list(ahc_mesh.iter_hierarchy(ahc_tool.root_node, children))
+        draw_calls_before = ahc_mesh.count_draw_calls(objects)
+        
+        # Merged children get removed, so only keep references to the nodes
+        nodes = [obj for obj in objects if obj.type != 'MESH']
+        del objects
+        
+        merged = 0
+        created = 0
+        for node in nodes:
+            node_created, node_merged = ahc_mesh.consolidate_node(node, ahc_tool.split_vertex_limit, children)
+            merged += node_merged
+            created += len(node_created)
+        
+        draw_calls_after = ahc_mesh.count_draw_calls(ahc_mesh.iter_hierarchy(ahc_tool.root_node))
+        self.report({'INFO'}, 'Merged {} meshes into {}, draw calls {} -> {} in {:.2f} s.'.format(
+            merged, created, draw_calls_before, draw_calls_after, time.perf_counter() - start))
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoMeshDeduplicate(Operator):
+    """Relink identical meshes below the root node to a single shared mesh"""
+    bl_idname = "object.assetto_hierarchy_mesh_deduplicator"
+    bl_label = "Instance Identical Meshes"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
+        start = time.perf_counter()
+        
+        clusters, removed, saved = ahc_mesh.deduplicate_meshes(ahc_tool.root_node)
+        
+        for cluster in sorted(clusters, key=len, reverse=True):
+            self.report({'INFO'}, '{} instances: {}'.format(len(cluster), ', '.join(obj.name for obj in cluster)))
+        self.report({'INFO'}, 'Removed {} duplicate meshes ({:.2f} MB), {} shared meshes with {} instances in {:.2f} s.'.format(
+            removed, saved / (1024 * 1024), len(clusters), sum(len(cluster) for cluster in clusters), time.perf_counter() - start))
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoSeparateComponents(Operator):
+    """Separate the connected parts with selected vertices into their own objects, parented under the matching hierarchy node"""
+    bl_idname = "object.assetto_hierarchy_component_separator"
+    bl_label = "Separate Selected Parts"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    @classmethod
+    def poll(cls, context):
+        return context.scene.ahc_tool.root_node is not None
+
+    def execute(self, context):
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
+        start = time.perf_counter()
+        
+        objects = [obj for obj in context.selected_objects if obj.type == 'MESH']
+        if(context.mode == 'EDIT_MESH'):
+            # Selection and geometry are only written to the mesh outside edit mode
+            bpy.ops.object.mode_set(mode='OBJECT')
+        
+        children = ahc_mesh.children_map()
+        created = []
+        for obj in objects:
+            components = ahc_mesh.MeshComponents(obj.data)
+            selected = components.selected(obj.data)
+            if(len(selected) == 0):
+                continue
+            parents = ahc_hierarchy.component_parents(obj, components, selected, ahc_tool.root_node, children)
+            created.extend(ahc_mesh.separate_components(obj, components, parents))
+        
+        if(len(created) == 0):
+            self.report({'WARNING'}, 'No selected vertices in the selected meshes.')
+            return {'CANCELLED'}
+        
+        self.report({'INFO'}, 'Separated {} parts in {:.2f} s.'.format(len(created), time.perf_counter() - start))
         return {'FINISHED'}
 
 class OBJECT_OT_AssettoMaterialImageReload(Operator):
@@ -104,8 +275,23 @@ class OBJECT_OT_AssettoMaterialImageReload(Operator):
     bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
-        for image in bpy.data.images:
-            image.reload()
+        reloaded, checked, elapsed = ahc_textures.reload_changed_images()
+        self.report({'INFO'}, 'Reloaded {} of {} textures in {:.0f} ms.'.format(reloaded, checked, elapsed * 1000))
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoTextureWatcherToggle(Operator):
+    """Start or stop watching texture folders and reloading changed files automatically"""
+    bl_idname = "object.assetto_hierarchy_texture_watcher_toggle"
+    bl_label = "Toggle Texture Watcher"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        if ahc_textures.texture_watcher.is_running:
+            ahc_textures.texture_watcher.stop()
+            self.report({'INFO'}, 'Texture watcher stopped.')
+        else:
+            ahc_textures.texture_watcher.start()
+            self.report({'INFO'}, 'Texture watcher started.')
         return {'FINISHED'}
 
 class OBJECT_OT_AssettoMeshAdjustScale(Operator):
@@ -118,29 +304,13 @@ class OBJECT_OT_AssettoMeshAdjustScale(Operator):
         scene = context.scene
         ahc_tool = scene.ahc_tool
         
-        def select_children(obj):
-            for child in obj.children:
-                child.select_set(True)
-                select_children(child)
-            
-        def scale_object(obj, scale_adjustment):   
-            for ob in bpy.context.selected_objects:
-                ob.select_set(False)
-                
-            obj.select_set(True)
-            obj.scale *= (scale_adjustment / ahc_tool.root_final_scale)
-            select_children(obj)
-                
-            bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
-            
-            for ob in bpy.context.selected_objects:
-                ob.select_set(False)
-                
-        scale_object(ahc_tool.root_node, ahc_tool.scale_adjust)
-                
-        ahc_tool.root_node.select_set(True)
-        ahc_tool.root_node.scale *= ahc_tool.root_final_scale
-        ahc_tool.root_node.select_set(False)
+        root = ahc_tool.root_node
+        root.scale *= (ahc_tool.scale_adjust / ahc_tool.root_final_scale)
+        
+        transformed = ahc_mesh.bake_scale(root)
+        
+        root.scale *= ahc_tool.root_final_scale
+        self.report({'INFO'}, 'Applied scale to {} ({} datablocks transformed).'.format(root.name, transformed))
         
         return {'FINISHED'}
 
@@ -150,69 +320,83 @@ class OBJECT_OT_AssettoHierarchy(Operator):
     bl_label = "Create Assetto Hierarchy"
     bl_options = {'REGISTER', 'UNDO'}
 
-    # Makes an empty, at location, stores it in existing collection
-    def make_empty(self, context, name, location, coll_name, parent_name = "", type = "PLAIN_AXES", radius=0.01):
-        bpy.ops.object.empty_add(type=type, radius=radius, location=location, scale=(1, 1, 1))
-        empty_obj = bpy.context.active_object 
-        bpy.ops.object.collection_link(collection=coll_name)
-        context.scene.collection.objects.unlink(empty_obj)
-        empty_obj.name = name
+    def execute(self, context):
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
         
-        if(parent_name != ""):
-            empty_obj.parent = bpy.data.objects[parent_name]
-            
-        empty_obj.select_set(False)
-        return empty_obj
+        ahc_hierarchy.build_hierarchy(scene,
+                                      ahc_tool.collection_name,
+                                      ahc_tool.wheel_base,
+                                      ahc_tool.front_track_width,
+                                      ahc_tool.rear_track_width,
+                                      ahc_tool.tire_width,
+                                      ahc_tool.tire_aspect,
+                                      ahc_tool.rim_diameter,
+                                      ahc_tool.wheel_radius)
+        
+        return {'FINISHED'}
+
+class OBJECT_OT_AssettoWheelDetect(Operator):
+    """Measure wheel base, track widths and wheel size from the wheels of the selected meshes (all visible meshes when nothing is selected)"""
+    bl_idname = "object.assetto_hierarchy_wheel_detect"
+    bl_label = "Detect From Wheels"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
         scene = context.scene
         ahc_tool = scene.ahc_tool
+        start = time.perf_counter()
         
-        root_empty_name = ahc_tool.collection_name + "_root"
-        root_location = (0,0,0)
-        
-        rim_dia_m = ahc_tool.rim_diameter * 0.0254
-        rim_dia_mm = rim_dia_m * 0.01
-        tire_width_mm = ahc_tool.tire_width * 0.01
-        wheel_base_mm = (ahc_tool.wheel_base / 2) * 0.01
+        objects = [obj for obj in context.selected_objects if obj.type == 'MESH']
+        if(len(objects) == 0):
+            objects = [obj for obj in context.visible_objects if obj.type == 'MESH']
         
-        rim_radius_mm = (rim_dia_mm / 2)
-        tire_radius_add_mm = (tire_width_mm * (ahc_tool.tire_aspect / 100.0)) * 0.0001
-        wheel_radius_mm = rim_radius_mm + tire_radius_add_mm
+        try:
+            wheels = ahc_hierarchy.detect_wheels(objects, context.evaluated_depsgraph_get())
+        except ValueError as err:
+            self.report({'ERROR'}, str(err))
+            return {'CANCELLED'}
         
-        front_track_width_mm = (ahc_tool.front_track_width / 2) * 0.01
-        rear_track_width_mm = (ahc_tool.rear_track_width / 2) * 0.01
+        dimensions = ahc_hierarchy.wheel_dimensions(wheels, scene.unit_settings.scale_length)
+        ahc_tool.wheel_base = dimensions["wheel_base"]
+        ahc_tool.front_track_width = dimensions["front_track_width"]
+        ahc_tool.rear_track_width = dimensions["rear_track_width"]
+        ahc_tool.wheel_radius = dimensions["wheel_radius"]
+        ahc_tool.tire_width = min(max(int(round(dimensions["tire_width"] * 1000)), 150), 500)
         
-        lf_wheel_location = (front_track_width_mm, wheel_radius_mm, wheel_base_mm)
-        rf_wheel_location = (-1 * front_track_width_mm, wheel_radius_mm, wheel_base_mm)
-        lr_wheel_location = (rear_track_width_mm, wheel_radius_mm, -1 * wheel_base_mm)
-        rr_wheel_location = (-1 * rear_track_width_mm, wheel_radius_mm, -1 * wheel_base_mm)
-
+        self.report({'INFO'}, 'Wheel base {:.3f} m, track {:.3f} / {:.3f} m, wheel radius {:.3f} m in {:.2f} s.'.format(
+            ahc_tool.wheel_base, ahc_tool.front_track_width, ahc_tool.rear_track_width, ahc_tool.wheel_radius,
+            time.perf_counter() - start))
+        return {'FINISHED'}
 
-        carRootCollection = bpy.data.collections.new(ahc_tool.collection_name)
-        bpy.context.scene.collection.children.link(carRootCollection)
+class OBJECT_OT_AssettoHierarchyBatch(Operator, ImportHelper):
+    """Create one Assetto hierarchy per car in a CSV or JSON spec table"""
+    bl_idname = "object.create_assetto_hierarchy_batch"
+    bl_label = "Create Hierarchies From Table"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    filter_glob: StringProperty(
+        default = "*.csv;*.json",
+        options = {'HIDDEN'}
+        )
 
-        root_empty = self.make_empty(context, root_empty_name, root_location, ahc_tool.collection_name)
-        
-        bpy.data.objects[root_empty_name].rotation_euler[0] = math.radians(90)
-        
-        # Make cockpit
-        self.make_empty(context, "COCKPIT_HR", root_location, ahc_tool.collection_name, root_empty_name)
-        
-        # Make wheels
-        self.make_empty(context, "WHEEL_LF", lf_wheel_location, ahc_tool.collection_name, root_empty_name, "SPHERE", wheel_radius_mm*1.5)
-        self.make_empty(context, "WHEEL_RF", rf_wheel_location, ahc_tool.collection_name, root_empty_name, "SPHERE", wheel_radius_mm*1.5)
-        self.make_empty(context, "WHEEL_LR", lr_wheel_location, ahc_tool.collection_name, root_empty_name, "SPHERE", wheel_radius_mm*1.5)
-        self.make_empty(context, "WHEEL_RR", rr_wheel_location, ahc_tool.collection_name, root_empty_name, "SPHERE", wheel_radius_mm*1.5)
+    def execute(self, context):
+        properties = context.scene.ahc_tool.bl_rna.properties
+        try:
+            specs, errors = ahc_hierarchy.load_car_specs(self.filepath, properties)
+        except (OSError, ValueError, csv.Error) as err:
+            self.report({'ERROR'}, str(err))
+            return {'CANCELLED'}
         
-        # Make Suspension
-        self.make_empty(context, "SUSP_LF", lf_wheel_location, ahc_tool.collection_name, root_empty_name, radius=0.006)
-        self.make_empty(context, "SUSP_RF", rf_wheel_location, ahc_tool.collection_name, root_empty_name, radius=0.006)
-        self.make_empty(context, "SUSP_LR", lr_wheel_location, ahc_tool.collection_name, root_empty_name, radius=0.006)
-        self.make_empty(context, "SUSP_RR", rr_wheel_location, ahc_tool.collection_name, root_empty_name, radius=0.006)
+        # Nothing is built unless the whole table is valid
+        if errors:
+            for error in errors:
+                self.report({'ERROR'}, error)
+            return {'CANCELLED'}
         
-        # Make main body
-        self.make_empty(context, "x0_main_body", root_location, ahc_tool.collection_name, root_empty_name)
+        # A single operator run is a single undo step for every car
+        roots = ahc_hierarchy.build_hierarchies(context.scene, specs)
+        self.report({'INFO'}, 'Created {} car hierarchies.'.format(len(roots)))
         
         return {'FINISHED'}
 
@@ -222,14 +406,9 @@ class OBJECT_OT_AssettoMeshEmptyPositioner(Operator):
     bl_label = "Center to Direct Children"
     bl_options = {'REGISTER', 'UNDO'}
     
-    def get_obj_mesh_center(self, obj):
-        # Total value of each vertex
-        x, y, z = [ sum( [v.co[i] for v in obj.data.vertices] ) for i in range(3)]
-        # number of vertices
-        count = float(len(obj.data.vertices))
-        # Divide the sum of each vector by the number of vertices
-        # And make the position a world reference.
-        center = (Vector( (x, y, z ) ) / count )        
+    def get_obj_mesh_center(self, obj, mode='MEDIAN', space='LOCAL'):
+        # Median or bounding box center of the mesh, cached per mesh data
+        center = ahc_mesh.center_engine.center(obj, mode, space)
         self.report({'INFO'}, 'Child Center: {}.'.format(center))
         
         return center
@@ -244,12 +423,16 @@ class OBJECT_OT_AssettoMeshEmptyPositioner(Operator):
         for child in ahc_tool.node_to_reposition.children:
             if child.type == 'MESH':
                 if child.visible_get():
-                    child_center = self.get_obj_mesh_center(child)
+                    child_center = self.get_obj_mesh_center(child, ahc_tool.center_mode, ahc_tool.center_space)
+                    if child_center is None:
+                        continue
+                    
                     x += child_center[0]
                     y += child_center[1]
                     z += child_center[2]
                     
-                    if ahc_tool.include_child_translation:
+                    # World space centers already include the child transform
+                    if ahc_tool.include_child_translation and ahc_tool.center_space == 'LOCAL':
                         child_translation = child.matrix_world.translation
                         x += child_translation[0]
                         y += child_translation[1]
@@ -269,13 +452,228 @@ class OBJECT_OT_AssettoMeshEmptyPositioner(Operator):
         return {'FINISHED'}
 
 
+class OBJECT_OT_AssettoExportKN5(Operator, ExportHelper):
+    """Export the hierarchy below the root node as an Assetto Corsa KN5 model"""
+    bl_idname = "object.assetto_hierarchy_export_kn5"
+    bl_label = "Export KN5"
+    bl_options = {'REGISTER'}
+    
+    filename_ext = ".kn5"
+    
+    filter_glob: StringProperty(
+        default = "*.kn5",
+        options = {'HIDDEN'}
+        )
+        
+    scale: FloatProperty(
+        name = "Scale",
+        description = "Scale applied on top of the world space size of the car",
+        default = 1.0,
+        precision = 4,
+        min = 0.0001
+        )
+        
+    incremental: BoolProperty(
+        name = "Incremental",
+        description = "Copy unchanged mesh nodes from the previous export using a sidecar cache",
+        default = True
+        )
+    
+    @classmethod
+    def poll(cls, context):
+        return context.scene.ahc_tool.root_node is not None
+
+    def execute(self, context):
+        ahc_tool = context.scene.ahc_tool
+        start = time.perf_counter()
+        
+        try:
+            nodes, meshes, materials, textures, reused = ahc_kn5.export_kn5(self.filepath, ahc_tool.root_node,
+                                                                            context.evaluated_depsgraph_get(),
+                                                                            self.scale, self.incremental)
+        except (OSError, ahc_kn5.Kn5Error) as err:
+            self.report({'ERROR'}, str(err))
+            return {'CANCELLED'}
+        
+        self.report({'INFO'}, 'Exported {} nodes ({} meshes, {} unchanged), {} materials and {} textures in {:.2f} s.'.format(
+            nodes, meshes, reused, materials, textures, time.perf_counter() - start))
+        return {'FINISHED'}
+
+
+class OBJECT_OT_AssettoTriangleBudget(Operator):
+    """Compare the triangle count below the root node with the LOD budgets and report the proposed decimation ratios"""
+    bl_idname = "object.assetto_hierarchy_triangle_budget"
+    bl_label = "Analyze Triangle Budget"
+    bl_options = {'REGISTER'}
+    
+    # Decimated nodes reported one by one, the rest only in the summary
+    REPORTED_NODES = 10
+    
+    @classmethod
+    def poll(cls, context):
+        return context.scene.ahc_tool.root_node is not None
+    
+    def execute(self, context):
+        ahc_tool = context.scene.ahc_tool
+        root = ahc_tool.root_node
+        budgets = (
+            ("LOD_A", ahc_tool.lod_a_budget),
+            ("LOD_B", ahc_tool.lod_b_budget),
+            ("LOD_C", ahc_tool.lod_c_budget),
+            ("LOD_D", ahc_tool.lod_d_budget),
+        )
+        
+        children = ahc_mesh.children_map()
+        nodes = ahc_lod.node_triangles(root, children)
+        importance = ahc_lod.node_importance([obj for obj, count in nodes], root, children)
+        plan = ahc_lod.budget_plan(root, children)
+        targets = [ahc_lod.allocate_targets(plan, budget) for level, budget in budgets]
+        
+        total = sum(count for obj, count in nodes)
+        over = [(level, target) for (level, budget), target in zip(budgets, targets) if total > budget]
+        
+        # Nodes the over budget levels decimate, largest first
+        decimated = [(obj, count, weight) for (obj, count), weight in zip(nodes, importance)
+                     if any(target[obj.data] < count for level, target in over)]
+        decimated.sort(key=lambda node: node[1], reverse=True)
+        for obj, count, weight in decimated[:self.REPORTED_NODES]:
+            ratios = ', '.join('{} {:.3f}'.format(level, target[obj.data] / count) for level, target in over)
+            self.report({'INFO'}, '{}: {} triangles, importance {:.4f}, ratios {}'.format(
+                ahc_kn5.node_name(obj), count, weight, ratios))
+        if(len(decimated) > self.REPORTED_NODES):
+            self.report({'INFO'}, '{} more nodes are decimated.'.format(len(decimated) - self.REPORTED_NODES))
+        
+        self.report({'INFO'}, '{} triangles in {} nodes, over budget for {}, {} nodes decimated.'.format(
+            total, len(nodes), ', '.join(level for level, target in over) if over else 'no LOD', len(decimated)))
+        return {'FINISHED'}
+
+
+class OBJECT_OT_AssettoGenerateLods(Operator):
+    """Generate LOD_B/C/D collections of the root hierarchy, decimated in background processes"""
+    bl_idname = "object.assetto_hierarchy_lod_generator"
+    bl_label = "Generate LODs"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    _timer = None
+    _generator = None
+    
+    @classmethod
+    def poll(cls, context):
+        return context.scene.ahc_tool.root_node is not None
+    
+    def execute(self, context):
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
+        budgets = {
+            "LOD_B": ahc_tool.lod_b_budget,
+            "LOD_C": ahc_tool.lod_c_budget,
+            "LOD_D": ahc_tool.lod_d_budget,
+        }
+        self._start = time.perf_counter()
+        self._generator = ahc_lod.LodGenerator(scene, ahc_tool.root_node, budgets)
+        self._generator.start()
+        
+        wm = context.window_manager
+        wm.progress_begin(0, 100)
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def modal(self, context, event):
+        if(event.type == 'ESC'):
+            self._generator.cancel()
+            self.finish(context)
+            self.report({'WARNING'}, 'LOD generation cancelled.')
+            return {'CANCELLED'}
+        
+        if(event.type == 'TIMER'):
+            try:
+                done = self._generator.poll()
+            except Exception as err:
+                self._generator.cancel()
+                self.finish(context)
+                self.report({'ERROR'}, 'LOD generation failed: {}'.format(err))
+                return {'CANCELLED'}
+            
+            context.window_manager.progress_update(int(self._generator.progress * 100))
+            if(done):
+                self.finish(context)
+                self.report({'INFO'}, 'Generated {} from {} decimation tasks in {:.2f} s.'.format(
+                    ', '.join(self._generator.budgets), self._generator.task_count, time.perf_counter() - self._start))
+                return {'FINISHED'}
+        
+        return {'PASS_THROUGH'}
+    
+    def finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+
+
+class OBJECT_OT_AssettoImportKN5(Operator, ImportHelper):
+    """Import a KN5 model, or list its node hierarchy without importing"""
+    bl_idname = "object.assetto_hierarchy_import_kn5"
+    bl_label = "Import KN5"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    filter_glob: StringProperty(
+        default = "*.kn5",
+        options = {'HIDDEN'}
+        )
+        
+    list_only: BoolProperty(
+        name = "List Hierarchy Only",
+        description = "Report the node hierarchy without importing any geometry",
+        default = False,
+        options = {'SKIP_SAVE'}
+        )
+
+    def execute(self, context):
+        start = time.perf_counter()
+        
+        try:
+            if self.list_only:
+                with ahc_kn5.Kn5File(self.filepath) as kn5:
+                    count = 0
+                    for node, depth in kn5.iter_nodes():
+                        if node.is_mesh:
+                            self.report({'INFO'}, '{}{} ({} vertices, {} triangles)'.format('  ' * depth, node.name, node.vertex_count, node.index_count // 3))
+                        else:
+                            self.report({'INFO'}, '{}{}'.format('  ' * depth, node.name))
+                        count += 1
+                self.report({'INFO'}, 'Listed {} nodes in {:.0f} ms.'.format(count, (time.perf_counter() - start) * 1000))
+                return {'FINISHED'}
+            
+            collection = bpy.data.collections.new(os.path.splitext(os.path.basename(self.filepath))[0])
+            context.scene.collection.children.link(collection)
+            root, count = ahc_kn5.import_kn5(self.filepath, collection)
+        except (OSError, ahc_kn5.Kn5Error) as err:
+            self.report({'ERROR'}, str(err))
+            return {'CANCELLED'}
+        
+        self.report({'INFO'}, 'Imported {} objects in {:.2f} s.'.format(count, time.perf_counter() - start))
+        return {'FINISHED'}
+
 classes = (
     OBJECT_OT_AssettoMaterialCreation,
+    OBJECT_OT_AssettoMaterialBlendDetect,
     OBJECT_OT_AssettoMaterialImageReload,
+    OBJECT_OT_AssettoTextureWatcherToggle,
     OBJECT_OT_AssettoMeshRename,
+    OBJECT_OT_AssettoMeshSplit,
+    OBJECT_OT_AssettoMeshSplitMaterials,
+    OBJECT_OT_AssettoMeshConsolidate,
+    OBJECT_OT_AssettoMeshDeduplicate,
+    OBJECT_OT_AssettoSeparateComponents,
     OBJECT_OT_AssettoMeshAdjustScale,
     OBJECT_OT_AssettoHierarchy,
+    OBJECT_OT_AssettoWheelDetect,
+    OBJECT_OT_AssettoHierarchyBatch,
     OBJECT_OT_AssettoMeshEmptyPositioner,
+    OBJECT_OT_AssettoExportKN5,
+    OBJECT_OT_AssettoTriangleBudget,
+    OBJECT_OT_AssettoGenerateLods,
+    OBJECT_OT_AssettoImportKN5,
 )
 
 def register():    
@@ -283,8 +681,15 @@ def register():
     for cls in classes:
         addon_updater_ops.make_annotations(cls)  # Avoid blender 2.8 warnings.
         register_class(cls)
+        
+    ahc_mesh.register()
+    ahc_textures.register()
 
 def unregister():
+    ahc_textures.unregister()
+    ahc_mesh.unregister()
+    ahc_lod.unregister()
+    
     from bpy.utils import unregister_class
     for cls in reversed(classes):
         unregister_class(cls)
\ No newline at end of file
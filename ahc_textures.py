@@ -0,0 +1,243 @@
+import bpy
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+STAT_WORKERS = 8
+
+# (filepath, mtime_ns, size) of the file each image was last read from, keyed
+# on image.name_full
+_reload_index = {}
+
+def image_file_path(image):
+    # Absolute path of a file backed image, None for packed/generated images.
+    # UDIM images keep their <UDIM> or <UVTILE> token, see image_tile_paths.
+    if image.source not in ('FILE', 'TILED') or image.packed_file is not None or image.filepath == "":
+        return None
+    return os.path.normpath(bpy.path.abspath(image.filepath, library=image.library))
+
+def image_tile_paths(image, path):
+    # The file of every UDIM tile, or just path for single file images
+    if image.source != 'TILED' or ('<UDIM>' not in path and '<UVTILE>' not in path):
+        return [path]
+    paths = []
+    for tile in image.tiles:
+        index = tile.number - 1001
+        paths.append(path.replace('<UDIM>', str(tile.number)).replace(
+            '<UVTILE>', 'u{}_v{}'.format(index % 10 + 1, index // 10 + 1)))
+    return paths
+
+def stat_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def combine_stats(stats):
+    # One stat for all tiles of an image, None if any tile is missing
+    if any(stat is None for stat in stats):
+        return None
+    return tuple(value for stat in stats for value in stat)
+
+def stat_image(image, path):
+    return combine_stats([stat_file(tile) for tile in image_tile_paths(image, path)])
+
+def stat_files(paths):
+    # Stats run on a thread pool, network shares make them latency bound
+    paths = list(paths)
+    if not paths:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(STAT_WORKERS, len(paths))) as pool:
+        return dict(zip(paths, pool.map(stat_file, paths)))
+
+def file_images():
+    images = []
+    for image in bpy.data.images:
+        path = image_file_path(image)
+        if path is not None:
+            images.append((image, path))
+    return images
+
+def record_images(images=None):
+    # Marks images as matching their file on disk without reloading them
+    if images is None:
+        images = file_images()
+    tiles = [(image, path, image_tile_paths(image, path)) for image, path in images]
+    stats = stat_files(set(tile for image, path, paths in tiles for tile in paths))
+    for image, path, paths in tiles:
+        stat = combine_stats([stats[tile] for tile in paths])
+        if stat is not None:
+            _reload_index[image.name_full] = (path,) + stat
+
+def reload_changed_images(images=None):
+    """Reloads the images whose file changed since they were last read.
+
+    Returns (reloaded count, checked count, elapsed seconds).
+    """
+    start = time.perf_counter()
+    if images is None:
+        images = file_images()
+    tiles = [(image, path, image_tile_paths(image, path)) for image, path in images]
+    stats = stat_files(set(tile for image, path, paths in tiles for tile in paths))
+
+    reloaded = 0
+    for image, path, paths in tiles:
+        stat = combine_stats([stats[tile] for tile in paths])
+        if stat is None:
+            continue
+
+        key = (path,) + stat
+        if _reload_index.get(image.name_full) == key:
+            continue
+
+        # Images that were never loaded will be read fresh on first use
+        if image.has_data:
+            image.reload()
+            reloaded += 1
+        _reload_index[image.name_full] = key
+
+    return reloaded, len(images), time.perf_counter() - start
+
+class TextureWatcher:
+    """Polls the folders of all file images and reloads changed files.
+
+    A worker thread scans each watched folder with os.scandir and compares
+    the entries against its cached listing. Changes are queued and picked up
+    by a bpy.app.timers callback on the main thread, which waits until no new
+    change arrived for SETTLE_TIME so a burst of saves reloads as one batch.
+    Every run gets its own stop event and listing, so a worker still winding
+    down after stop() can't be revived or corrupt the next run.
+    """
+
+    POLL_INTERVAL = 1.0
+    SETTLE_TIME = 0.75
+    TIMER_INTERVAL = 0.25
+    WATCH_REFRESH = 5.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._watched = {}
+        self._changed = set()
+        self._last_change = 0.0
+        self._last_refresh = 0.0
+        # Timers are matched by identity, so keep one bound method around
+        self._tick = self._main_thread_tick
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+
+        self._stop = threading.Event()
+        with self._lock:
+            self._changed = set()
+        self.refresh_watch_list()
+
+        self._thread = threading.Thread(target=self._poll_loop, args=(self._stop,),
+                                        name="ahc_texture_watcher", daemon=True)
+        self._thread.start()
+        bpy.app.timers.register(self._tick, first_interval=self.TIMER_INTERVAL, persistent=True)
+
+    def stop(self):
+        self._stop.set()
+        if bpy.app.timers.is_registered(self._tick):
+            bpy.app.timers.unregister(self._tick)
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def refresh_watch_list(self):
+        # Main thread only, bpy data must not be read from the worker
+        watched = {}
+        for image, path in file_images():
+            for tile in image_tile_paths(image, path):
+                directory, name = os.path.split(tile)
+                watched.setdefault(directory, set()).add(os.path.normcase(name))
+
+        with self._lock:
+            self._watched = watched
+        self._last_refresh = time.monotonic()
+
+    def _scan_directory(self, directory, names):
+        listing = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = os.path.normcase(entry.name)
+                    if name in names:
+                        st = entry.stat()
+                        listing[name] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+        return listing
+
+    def _poll_loop(self, stop):
+        listings = {}
+        while not stop.wait(self.POLL_INTERVAL):
+            with self._lock:
+                watched = self._watched
+
+            changed = []
+            for directory, names in watched.items():
+                listing = self._scan_directory(directory, names)
+                if listing is None:
+                    continue
+
+                previous = listings.get(directory)
+                listings[directory] = listing
+                if previous is None:
+                    continue
+                for name, stat in listing.items():
+                    if previous.get(name) != stat:
+                        changed.append(os.path.normcase(os.path.join(directory, name)))
+
+            if changed:
+                with self._lock:
+                    if stop.is_set():
+                        return
+                    self._changed.update(changed)
+                    self._last_change = time.monotonic()
+
+    def _main_thread_tick(self):
+        if self._stop.is_set():
+            return None
+
+        now = time.monotonic()
+        if now - self._last_refresh > self.WATCH_REFRESH:
+            self.refresh_watch_list()
+
+        with self._lock:
+            if not self._changed or now - self._last_change < self.SETTLE_TIME:
+                return self.TIMER_INTERVAL
+            batch = self._changed
+            self._changed = set()
+
+        images = [(image, path) for image, path in file_images()
+                  if any(os.path.normcase(tile) in batch for tile in image_tile_paths(image, path))]
+        reload_changed_images(images)
+        return self.TIMER_INTERVAL
+
+texture_watcher = TextureWatcher()
+
+@bpy.app.handlers.persistent
+def _on_load_post(*args):
+    _reload_index.clear()
+    record_images()
+
+def register():
+    if _on_load_post not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(_on_load_post)
+
+def unregister():
+    texture_watcher.stop()
+    if _on_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(_on_load_post)
+    _reload_index.clear()
@@ -1,8 +1,12 @@
+import bpy
 import math
 import textwrap
 
 from . import (addon_updater_ops,
-                ahc_ops)
+                ahc_lod,
+                ahc_mesh,
+                ahc_ops,
+                ahc_textures)
                        
 from bpy.types import (Panel,
                         Operator,
@@ -48,6 +52,7 @@ class OBJECT_PT_AssettoHierarchyPanel(Panel):
         col.prop(ahc_tool, "wheel_base")
         col.prop(ahc_tool, "front_track_width")
         col.prop(ahc_tool, "rear_track_width")
+        col.operator(ahc_ops.OBJECT_OT_AssettoWheelDetect.bl_idname)
         
         box = layout.box()
         col = box.column()
@@ -55,11 +60,15 @@ class OBJECT_PT_AssettoHierarchyPanel(Panel):
         col.prop(ahc_tool, "tire_width")
         col.prop(ahc_tool, "tire_aspect")
         col.prop(ahc_tool, "rim_diameter")
+        col.prop(ahc_tool, "wheel_radius")
                 
         row = layout.row()
         if(ahc_tool.collection_name == ""):
             row.enabled = False
         row.operator(ahc_ops.OBJECT_OT_AssettoHierarchy.bl_idname)
+        
+        col = layout.column()
+        col.operator(ahc_ops.OBJECT_OT_AssettoHierarchyBatch.bl_idname)
 
 class OBJECT_PT_AssettoMaterialPanel(Panel):
     bl_label = 'Assetto Materials'
@@ -77,8 +86,14 @@ class OBJECT_PT_AssettoMaterialPanel(Panel):
         
         col = layout.column()
         col.operator(ahc_ops.OBJECT_OT_AssettoMaterialCreation.bl_idname)
+        col.operator(ahc_ops.OBJECT_OT_AssettoMaterialBlendDetect.bl_idname)
         col.operator(ahc_ops.OBJECT_OT_AssettoMaterialImageReload.bl_idname)
         
+        if(ahc_textures.texture_watcher.is_running):
+            col.operator(ahc_ops.OBJECT_OT_AssettoTextureWatcherToggle.bl_idname, text = "Stop Texture Watcher", icon = 'PAUSE')
+        else:
+            col.operator(ahc_ops.OBJECT_OT_AssettoTextureWatcherToggle.bl_idname, text = "Start Texture Watcher", icon = 'PLAY')
+        
 class OBJECT_PT_AssettoMeshCleanupPanel(Panel):
     bl_label = 'Assetto Mesh Cleanup'
     bl_idname = 'AHC_PT_AssettoMeshCleanupPanel'
@@ -106,6 +121,37 @@ class OBJECT_PT_AssettoMeshCleanupPanel(Panel):
         if(ahc_tool.root_node == None):
             row.enabled = False
         row.operator(ahc_ops.OBJECT_OT_AssettoMeshRename.bl_idname)
+        row.operator(ahc_ops.OBJECT_OT_AssettoMeshRename.bl_idname, text = "Preview").dry_run = True
+        
+        box = layout.box()
+        col = box.column()
+        col.label(text = 'Mesh Splitting')
+        col.prop(ahc_tool, "root_node")
+        col.prop(ahc_tool, "split_vertex_limit")
+        col.separator()
+        if(ahc_tool.root_node != None):
+            multiline_label(col, context, text = 'Splits meshes below {} into pieces of at most {} vertices named _SUB#'.format(ahc_tool.root_node.name, ahc_tool.split_vertex_limit))
+        
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoMeshSplit.bl_idname)
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoMeshSplitMaterials.bl_idname)
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoMeshConsolidate.bl_idname)
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoMeshDeduplicate.bl_idname)
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoSeparateComponents.bl_idname)
         
         box = layout.box()
         col = box.column()
@@ -132,17 +178,102 @@ class OBJECT_PT_AssettoMeshCleanupPanel(Panel):
         else:
             multiline_label(col, context, text = 'Only the children\'s mesh position will be used to calculate the final parent position.')
              
-        col.prop(ahc_tool, "include_child_translation")        
+        col.prop(ahc_tool, "center_mode")
+        col.prop(ahc_tool, "center_space")
+        
+        row = col.row()
+        if(ahc_tool.center_space == 'WORLD'):
+            row.enabled = False
+        row.prop(ahc_tool, "include_child_translation")        
         
         row = col.row()
         if(ahc_tool.node_to_reposition == None):
             row.enabled = False
         row.operator(ahc_ops.OBJECT_OT_AssettoMeshEmptyPositioner.bl_idname)
 
+# (root pointer, root name, depsgraph generation) -> triangle totals per LOD level
+_triangle_totals = {}
+
+def triangle_totals(root):
+    # Triangle totals of the main model and the generated LOD collections,
+    # recounted only after a depsgraph update instead of on every redraw
+    key = (root.as_pointer(), root.name, ahc_mesh.depsgraph_generation())
+    totals = _triangle_totals.get(key)
+    if(totals == None):
+        totals = {"LOD_A": sum(count for obj, count in ahc_lod.node_triangles(root))}
+        for level in ("LOD_B", "LOD_C", "LOD_D"):
+            collection = bpy.data.collections.get(ahc_lod.lod_collection_name(root, level))
+            if(collection != None):
+                totals[level] = ahc_lod.collection_triangles(collection)
+        _triangle_totals.clear()
+        _triangle_totals[key] = totals
+    return totals
+
+def draw_triangle_totals(layout, ahc_tool):
+    totals = triangle_totals(ahc_tool.root_node)
+    budgets = (("LOD_A", ahc_tool.lod_a_budget), ("LOD_B", ahc_tool.lod_b_budget),
+               ("LOD_C", ahc_tool.lod_c_budget), ("LOD_D", ahc_tool.lod_d_budget))
+    for level, budget in budgets:
+        if(level in totals):
+            layout.label(text = '{}: {:,} / {:,} triangles'.format(level.replace('_', ' '), totals[level], budget),
+                         icon = 'ERROR' if totals[level] > budget else 'CHECKMARK')
+
+class OBJECT_PT_AssettoExportPanel(Panel):
+    bl_label = 'Assetto Export'
+    bl_idname = 'AHC_PT_AssettoExportPanel'
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Assetto'
+    
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        ahc_tool = scene.ahc_tool
+        
+        box = layout.box()
+        col = box.column()
+        col.label(text = 'KN5 Model')
+        col.prop(ahc_tool, "root_node")
+        col.separator()
+        if(ahc_tool.root_node != None):
+            multiline_label(col, context, text = 'Exports {} and all nested children'.format(ahc_tool.root_node.name))
+        
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoExportKN5.bl_idname)
+        
+        box = layout.box()
+        col = box.column()
+        col.label(text = 'LODs')
+        col.prop(ahc_tool, "lod_a_budget")
+        col.prop(ahc_tool, "lod_b_budget")
+        col.prop(ahc_tool, "lod_c_budget")
+        col.prop(ahc_tool, "lod_d_budget")
+        if(ahc_tool.root_node != None):
+            col.separator()
+            draw_triangle_totals(col, ahc_tool)
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoTriangleBudget.bl_idname)
+        row = col.row()
+        if(ahc_tool.root_node == None):
+            row.enabled = False
+        row.operator(ahc_ops.OBJECT_OT_AssettoGenerateLods.bl_idname)
+        
+        box = layout.box()
+        col = box.column()
+        col.label(text = 'Reference KN5')
+        row = col.row()
+        row.operator(ahc_ops.OBJECT_OT_AssettoImportKN5.bl_idname)
+        row.operator(ahc_ops.OBJECT_OT_AssettoImportKN5.bl_idname, text = "List Hierarchy").list_only = True
+
 classes = (
     OBJECT_PT_AssettoHierarchyPanel,
     OBJECT_PT_AssettoMaterialPanel,
     OBJECT_PT_AssettoMeshCleanupPanel,
+    OBJECT_PT_AssettoExportPanel,
 )
 
 def register(properties_bl_idname):
@@ -158,4 +289,5 @@ def unregister():
     for cls in reversed(classes):
         unregister_class(cls)
     
+    _triangle_totals.clear()
     properties_bl_idname = None
\ No newline at end of file
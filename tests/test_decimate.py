@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+
+# ahc_decimate only depends on NumPy, the add-on package itself needs bpy
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ahc_decimate
+
+
+def grid_mesh(size):
+    # Wavy size x size grid, two triangles per quad
+    x, y = np.meshgrid(np.linspace(0.0, 1.0, size), np.linspace(0.0, 1.0, size))
+    z = 0.1 * np.sin(x * 7.0) * np.cos(y * 5.0)
+    positions = np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1)
+    index = np.arange(size * size).reshape(size, size)
+    a, b = index[:-1, :-1].ravel(), index[:-1, 1:].ravel()
+    c, d = index[1:, :-1].ravel(), index[1:, 1:].ravel()
+    triangles = np.concatenate([np.stack([a, b, d], axis=1), np.stack([a, d, c], axis=1)])
+    return positions, triangles
+
+
+def test_uvs_follow_collapsed_corners():
+    positions, triangles = grid_mesh(60)
+    loops = np.arange(triangles.size).reshape(-1, 3)
+    # One UV per loop, taken from the position of the loop's vertex
+    uvs = positions[triangles.ravel(), :2]
+
+    target = 400
+    out_positions, out_triangles, source, corners = ahc_decimate.decimate(positions, triangles, target)
+    assert 0 < len(out_triangles) <= target
+
+    resolution = ahc_decimate.find_resolution(positions, triangles, target)
+    labels = ahc_decimate._cluster(positions, triangles, resolution)[0]
+    used = np.unique(labels[triangles[source]])
+
+    # The loop every output corner takes its UV from belongs to a vertex of
+    # the cluster that became that output vertex
+    source_loops = np.take_along_axis(loops[source], corners, axis=1)
+    uv_vertices = triangles.ravel()[source_loops]
+    assert np.array_equal(labels[uv_vertices], used[out_triangles])
+    assert np.allclose(uvs[source_loops], positions[uv_vertices, :2])
+
+
+def test_untouched_mesh_keeps_corner_order():
+    positions, triangles = grid_mesh(4)
+    out_positions, out_triangles, source, corners = ahc_decimate.decimate(positions, triangles, len(triangles))
+    assert np.array_equal(out_triangles, triangles)
+    assert np.array_equal(source, np.arange(len(triangles)))
+    assert np.array_equal(corners, np.tile(np.arange(3), (len(triangles), 1)))